@@ -7,6 +7,12 @@ import os
 import cartopy.crs as ccrs
 from shapely.geometry import LineString
 import cartopy.feature as cfeature
+import colocation as coloc  # for selecting the CMEMS points around the tide gauges
+import parallel_extraction as parallel  # for extracting the files in parallel
+import tg_store as tgs  # for loading the tide gauge data
+import station_stats as stats  # for the statistics of all the stations at once
+import ragged as rg  # for the locations within the radius of the records (flat values and offsets)
+import extraction_records as recs  # for the typed column buffers of the extraction records
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -32,253 +38,169 @@ cmems_path = f'{path}CMEMS_data/SEALEVEL_EUR_PHY_L4_NRT_008_060/daily'
 # cmems_path = f'{path}CMEMS_data/cmems_obs-sl_eur_phy-ssh_my_allsat-l4-duacs-0.125deg_P1D'
 
 
-data_tg = np.load(f'{path}mareografos/TGresiduals1d_2023_European_Seas_SWOT_FSP.npz')
-names_tg = pd.read_csv(f'{path}mareografos/GLOBAL_TGstations_CMEMS_SWOT_FSP_Feb2024', header=None)
+tg_file = f'{path}mareografos/TGresiduals1d_2023_European_Seas_SWOT_FSP.npz'
+tg_names_file = f'{path}mareografos/GLOBAL_TGstations_CMEMS_SWOT_FSP_Feb2024'
+cache_path = f'{path}cache/'  # Folder for the cached tide gauge data
 
 # ---------------------------------- READING TIDE GAUGE DATA --------------------------------------------------------
 
-sla = data_tg.get('resdacTOTday') * 100  # Convert to centimeters (cm)
-time = data_tg.get('timeTOTday')
-lat_tg = data_tg.get('latTOT')
-lon_tg = data_tg.get('lonTOT')
+# Tide gauge stations sorted by longitude from east to west (loaded once, cached in binary form)
+tg = tgs.load_tg(tg_file, tg_names_file, cache_path)
+sorted_names = tg['names'].tolist()
+ordered_lat = tg['latitude'].tolist()
+ordered_lon = tg['longitude'].tolist()
 
-# Convert datenum into datetime
-epoch_start = pd.Timestamp('1970-01-01')
-time_days = np.array(time, dtype='timedelta64[D]')  # Convert 'time' to a timedelta array
-time_datetime = epoch_start.to_numpy() + time_days
+# ------------------------ PROCESSING CMEMS DATA AROUND TG LOCATIONS --------------------------------------------------
 
-data_arrays = []
+lolabox = [-2, 8, 35, 45]
 
-for i in range(lat_tg.size):  # Assuming lat_tg and lon_tg are 1D arrays with length 21
-    # Create a DataArray for each station with its corresponding time and SLA values
+strategy = 0
 
-    station_name = names_tg[0][i]
+# Number of processes extracting the files in parallel (None: all the CPUs, 1: sequential)
+n_workers = None
+prefetch_depth = 4  # Files read ahead while processing the current one (sequential extraction)
 
-    da = xr.DataArray(
-        data=sla[i, :],  # SLA data for the i-th station
-        dims=["time"],
-        coords={
-            "time": time_datetime[i, :],  # Time data for the i-th station
-            "latitude": lat_tg[i],
-            "longitude": lon_tg[i]
-        },
-        name=f"station_{station_name}"
-    )
-    data_arrays.append(da)
+# Maximum distance from each CMEMS point to the tide gauge location
+# dmedia = 10 # Km
+dmedia = np.arange(5, 20, 5)
 
-    # Order by longitude from east to west:
-    # Pair each station name with its corresponding longitude
-    name_longitude_pairs = [(da.name, da.longitude.item()) for da in data_arrays]
+# Loop through all netCDF files in the folder
+nc_files = parallel.sort_by_time([f for f in os.listdir(cmems_path) if f.endswith('.nc')])
 
-    # Sort the pairs by longitude in descending order
-    sorted_pairs = sorted(name_longitude_pairs, key=lambda x: x[1], reverse=True)
+# List to store distances between CMEMS and tide gauge locations
+all_distances = []
 
-    # Extract the sorted names
-    sorted_names = [name for name, _ in sorted_pairs]
+# Loop through all netCDF files in the folder
+nc_files = parallel.sort_by_time([f for f in os.listdir(cmems_path) if f.endswith('.nc')])
 
+results_rad_comparison = []  # List to store results for each radius
 
-# Setting the names_tg per longitude order from east to west
-# Create a new list to store ordered data arrays
-ordered_data_arrays = []
-ordered_lat = []
-ordered_lon = []
+# Columns of the records (typed buffers) and of the locations within the radius (ragged arrays)
+record_columns = ['station', 'longitude', 'latitude', 'n_val', 'ssha', 'time', 'mean_distance']
+raw_columns = ['cmems_lat_within_radius', 'cmems_lon_within_radius']
 
-# Loop through the sorted station names and get the corresponding DataArray
-for name in sorted_names:
-  for da in data_arrays:
-    if da.name == name:
-      ordered_data_arrays.append(da)
-      ordered_lat.append(np.float64(da['latitude'].values))
-      ordered_lon.append(np.float64(da['longitude'].values))
-      break  # Exit the inner loop once the matching DataArray is found
 
-# Replace the original data_arrays list with the ordered version
-data_arrays = ordered_data_arrays
+# Function for reading the lolabox window of one daily CMEMS file (loaded in memory)
+def read_cmems_file(filename):
+    file_path = os.path.join(cmems_path, filename)
+    with xr.open_dataset(file_path) as ds_all:
+        # Select all latitudes and the last 370 longitudes
+        # ds_subset = ds.sel(longitude=slice(-370, None))
+        ds = ds_all.sel(latitude=slice(lolabox[2], lolabox[3]), longitude=slice(lolabox[0], lolabox[1])).load()
+    return ds
 
-# ------------------------ PROCESSING CMEMS DATA AROUND TG LOCATIONS --------------------------------------------------
 
-lolabox = [-2, 8, 35, 45]
+# Function for extracting the CMEMS values around all the tide gauges from one daily file (run in parallel)
+def extract_cmems_file(filename, ds, rad):
+    # Typed buffers of the CMEMS values of all the tide gauges for this file (one record per tide gauge)
+    file_records = recs.allocate(len(ordered_lon), record_columns)
+    file_records['station'][:] = np.arange(len(ordered_lon))
 
-strategy = 0
+    # Locations of the grid cells within the radius of each record (stored as ragged arrays, None without data)
+    file_raw = {name: [None] * len(ordered_lon) for name in raw_columns}
 
-# Maximum distance from each CMEMS point to the tide gauge location
-# dmedia = 10 # Km
-dmedia = np.arange(5, 20, 5)
+    time = ds['time'].values
+    ssh = ds['sla'][0, :, :]
+    lat = ds['latitude']
+    lon = ds['longitude']
 
-# Loop through all netCDF files in the folder
-nc_files = [f for f in os.listdir(cmems_path) if f.endswith('.nc')]
+    if strategy == 0:
+        file_records['longitude'][:] = ordered_lon  # Location of the tide gauges
+        file_records['latitude'][:] = ordered_lat
+        file_records['time'][:] = time[0]
 
-# List to store distances between CMEMS and tide gauge locations
-all_distances = []
+        # Grid points as flattened (latitude, longitude) arrays
+        lon_grid, lat_grid = np.meshgrid(lon.values, lat.values)
 
-# Loop through all netCDF files in the folder
-nc_files = [f for f in os.listdir(cmems_path) if f.endswith('.nc')]
+        # Points within the radius of all the gauges (haversine only for the points inside the lat/lon bands)
+        in_radius_gauges, distances_gauges, band_stats = coloc.query_radius_bbox(lon_grid.ravel(), lat_grid.ravel(),
+                                                                                 ordered_lon, ordered_lat, rad)
+        file_rejected_stages = {stage: band_stats[stage] for stage in rejected_stages}
+    else:
+        file_rejected_stages = {stage: 0 for stage in rejected_stages}
 
-results_rad_comparison = []  # List to store results for each radius
+    # Loop through each tide gauge location
+    for tg_idx, (tg_lon, tg_lat) in enumerate(zip(ordered_lon, ordered_lat)):
+
+        if strategy == 0:  # ------------------------------------------------------------------------------------------
+
+            # Latitude and longitude indexes of the points within the radius
+            ssh_indexes = np.unravel_index(in_radius_gauges[tg_idx], lon_grid.shape)
+            distances = distances_gauges[tg_idx]
+
+            # Average nearby SSH values (if any, the record remains without data otherwise)
+            if distances.size > 0:
+                file_records['n_val'][tg_idx] = distances.size  # Number of CMEMS points within the radius
+                file_records['ssha'][tg_idx] = np.nanmean(ssh.values[ssh_indexes]) * 100  # Convert to centimeters (cm)
+                file_records['mean_distance'][tg_idx] = np.mean(distances)  # Mean distance between CMEMS and tide gauge
+
+                # Use the indexes to subset lat and lon
+                file_raw['cmems_lat_within_radius'][tg_idx] = lat.values[ssh_indexes[0]]
+                file_raw['cmems_lon_within_radius'][tg_idx] = lon.values[ssh_indexes[1]]
+
+        else:  # ----------------------------------------------------------------------------------------------------
+            # Calculate distance for each data point
+            distances = haversine(lon, lat, tg_lon, tg_lat)
+
+            # Find indices within the specified radius
+            mask = distances <= rad
+
+            # Select closest SSH value within the radius (if any)
+            if np.any(mask):
+                # Find the closest non-NaN index
+                closest_idx = np.nanargmin(distances[mask])
+                file_records['longitude'][tg_idx] = lon[closest_idx]  # Longitude of selected CMEMS point
+                file_records['latitude'][tg_idx] = lat[closest_idx]  # Latitude of selected CMEMS point
+                file_records['n_val'][tg_idx] = 1
+                file_records['ssha'][tg_idx] = ssh[closest_idx] * 100  # Retrieve closest non-NaN SSH and convert to centimeters (cm)
+                file_records['time'][tg_idx] = time[closest_idx]
+                file_records['mean_distance'][tg_idx] = distances[mask][closest_idx]  # Obtain the closest distance
+
+    return file_records, file_rejected_stages, {name: rg.from_arrays(file_raw[name]) for name in raw_columns}
 
 
 for rad in dmedia:
     print(f'Beggining processing radius {rad} km')
     print(f'{sorted_names}')
-    # List to store all CMEMS time series (one list per tide gauge)
-    all_cmems_timeseries = []
+    # List to store the records (typed buffers) and the locations within the radius of each file
+    all_cmems_records = []
+    all_cmems_raw = []
 
-    for filename in nc_files:
-        file_path = os.path.join(cmems_path, filename)
-        ds_all = xr.open_dataset(file_path)
+    # Number of candidate points rejected by each stage of the selection (latitude band, longitude band, haversine)
+    rejected_stages = {'n_candidates': 0, 'rejected_lat': 0, 'rejected_lon': 0, 'rejected_haversine': 0}
 
-        # Select all latitudes and the last 370 longitudes
-        # ds_subset = ds.sel(longitude=slice(-370, None))
-        ds = ds_all.sel(latitude=slice(lolabox[2], lolabox[3]), longitude=slice(lolabox[0], lolabox[1]))
-
-        time = ds['time'].values
-        ssh = ds['sla'][0, :, :]
-        lat = ds['latitude']
-        lon = ds['longitude']
-
-        # Loop through each tide gauge location
-        for tg_idx, (tg_lon, tg_lat) in enumerate(zip(ordered_lon, ordered_lat)):
-
-            if strategy == 0:  # ------------------------------------------------------------------------------------------
-
-                # Calculate distances
-                distances = haversine(lon, lat, tg_lon, tg_lat)
-
-                mask = distances <= rad
-
-                # Convert the mask to a numpy array to use it for indexing
-                mask_array = np.array(mask)
-
-                # Apply the mask to the ssh array
-                ssh_serie_within_rad = ssh.values[mask_array]
-                mean_distance = np.mean(distances.values[mask_array])
-
-                # Apply the mask to get boolean indexes for all dimensions
-                ssh_indexes = np.where(mask_array)
-
-                # Use the boolean indexes to subset ssh, lat, and lon
-                ssh_series = ssh[ssh_indexes]
-                cmems_lat_within_radius = lat.values[ssh_indexes[0]]
-                cmems_lon_within_radius = lon.values[ssh_indexes[1]]
-
-                # Average nearby SSH values (if any)
-                if len(ssh_serie_within_rad) > 0:
-                    n_idx = len(ssh_serie_within_rad)  # How many values are used for computing the mean value
-                    ssh_serie = np.nanmean(ssh_serie_within_rad) * 100  # Convert to centimeters (cm)
-                else:
-                    ssh_serie = np.nan  # No data within radius (remains NaN)
-
-                # Create a dictionary to store tide gauge and CMEMS  data
-                selected_data = {
-                    "station_name": sorted_names[tg_idx],  # Access station name
-                    "longitude": tg_lon,  # Longitude of tide gauge
-                    "latitude": tg_lat,  # Latitude of tide gauge
-                    "num_cmems_points": np.sum(mask),  # Number of CMEMS points within the radius
-                    "ssha": ssh_serie,  # Retrieved SSH valueu
-                    "time": time,
-                    "mean_distance": mean_distance,  # Mean distance between CMEMS and tide gauge
-                    "cmems_lat_within_radius": cmems_lat_within_radius,
-                    "cmems_lon_within_radius": cmems_lon_within_radius
-                    }
-                
-            else:  # ----------------------------------------------------------------------------------------------------
-                # Calculate distance for each data point
-                distances = haversine(lon, lat, tg_lon, tg_lat)
-
-                # Find indices within the specified radius
-                mask = distances <= rad
-
-                # Select closest SSH value within the radius (if any)
-                if np.any(mask):
-                    # Find the closest non-NaN index
-                    closest_idx = np.nanargmin(distances[mask])
-                    distance_point = distances[mask][closest_idx]  # Obtain the closest distance
-                    ssh_serie = ssh[closest_idx] * 100  # Retrieve closest non-NaN SSH and convert to centimeters (cm)
-                    time_serie = time[closest_idx]
-
-                    # Create a dictionary to store selected CMEMS data
-                    selected_data = {
-                        "station_name": sorted_names[tg_idx],  # Access station name
-                        "longitude": lon[closest_idx],  # Longitude of selected CMEMS point
-                        "latitude": lat[closest_idx],  # Latitude of selected CMEMS point
-                        "ssha": ssh_serie,  # Retrieved SSH value
-                        "time": time_serie,
-                        "mean_distance": distance_point
-                    }
-
-            # Append the selected data to the list
-            all_cmems_timeseries.append(selected_data)
-
-    # Dataframe to store time series data for each station
-    station_time_series = []
-
-    for i in range(0, len(all_cmems_timeseries)):  # Loop through each file's data
-        file_data = all_cmems_timeseries[i]
-
-        station_name = file_data["station_name"]
-        ssha_value = file_data["ssha"]
-        lon = file_data['longitude']  # Longitude of selected CMEMS point
-        lat = file_data['latitude']  # Latitude of selected CMEMS point
-        time = file_data['time']
-        num_cmems_points = file_data['num_cmems_points']  # Number of points for the average within the radius or distance of the closest point
-        cmems_lat_within_radius = file_data['cmems_lat_within_radius']  # Latitude of CMEMS points within the radius
-        cmems_lon_within_radius = file_data['cmems_lon_within_radius']  # Longitude of CMEMS points within the radius
-
-        # Append the SSH and time s to the station's time series
-        station_time_series.append({'station_name': station_name,
-                                    'ssha': ssha_value,
-                                    'latitude': lat,
-                                    'longitude': lon,
-                                    'time': time,
-                                    'num_cmems_points': num_cmems_points,
-                                    'cmems_lat_within_radius': cmems_lat_within_radius,
-                                    'cmems_lon_within_radius': cmems_lon_within_radius})
-
-    df2 = pd.DataFrame(station_time_series)
+    # CMEMS values of all the files extracted in parallel (merged in time order)
+    for file_records, file_rejected_stages, file_raw in parallel.extract_files(extract_cmems_file, nc_files,
+                                                                               n_workers, load=read_cmems_file,
+                                                                               prefetch_depth=prefetch_depth, rad=rad):
+        all_cmems_records.append(file_records)
+        all_cmems_raw.append(file_raw)
+        for stage in rejected_stages:
+            rejected_stages[stage] += file_rejected_stages[stage]
+
+    print(f"Candidate points: {rejected_stages['n_candidates']}, rejected by latitude band: {rejected_stages['rejected_lat']}, "
+          f"by longitude band: {rejected_stages['rejected_lon']}, by haversine: {rejected_stages['rejected_haversine']}")
+
+    # Table of all the CMEMS records (typed columns, one row per file and tide gauge)
+    df2 = recs.to_table(recs.concatenate(all_cmems_records, record_columns), sorted_names, 'station_name')
+    df2 = df2.rename(columns={'n_val': 'num_cmems_points'})
+
+    # Locations within the radius of all the records (row i: record i, index of df)
+    cmems_raw = {name: rg.concatenate([file_raw[name] for file_raw in all_cmems_raw]) for name in raw_columns}
 
     # for i in range(len(sorted_names)):  # CHECKING HOW MANY NANS THERE ARE ACCORDING TO THE RADIUS SIZE
     #     print((df2[df2['station_name'] == sorted_names[i]]['ssha']).isna().sum())
 
-    correlations = []
-    rmsds = []
     consistencys = []
-    var_tg = []
-    var_CMEMS = []
-    var_diff = []
+    compared_tables = []  # Series compared at each station (statistics of all the stations at once)
+    compared_stations = []
     days_used_per_gauge = []
     n_nans_tg = []
             
-    # CONVERT TO DATAFRAME for easier managing
-    df = pd.DataFrame(all_cmems_timeseries).dropna(how='any')  # Convert to DataFrame
-
-    # Convert from Series of ndarrays containing dates to Series of timestamps
-    df['time'] = df['time'].apply(lambda x: x[0])
-
-    df_tg = []
-
-    # Iterate over each DataArray
-    for da in data_arrays:
-        # Extracting values from the DataArray
-        time_values = da["time"].values
-        sla_values = da.values
-        station_name = da.name  # Extracting station name from DataArray name
-        latitude = da.latitude.values
-        longitude = da.longitude.values
-
-        # Create a DataFrame for the current DataArray
-        tg_data = pd.DataFrame({
-            'time': time_values,
-            'ssha': sla_values,
-            'station': [station_name] * len(time_values),
-            'latitude': latitude,
-            'longitude': longitude
-        })
-
-        # Append the DataFrame to the list
-        df_tg.append(tg_data)
+    # Records with data (the index is kept to access the locations within the radius)
+    df = df2.dropna(how='any')
 
-    # Concatenate all DataFrames into a single DataFrame
-    df_tg = pd.concat(df_tg, ignore_index=True).dropna(how='any')
+    df_tg = tgs.tg_table(tg).dropna(how='any')
 
 
 
@@ -286,15 +208,19 @@ for rad in dmedia:
     empty_stations = []
     lolabox = [1, 8, 35, 45]
 
+    # Rows of each station (grouped once instead of comparing all the rows with each station name)
+    df_rows = df.groupby('station_name').indices
+    df_tg_rows = df_tg.groupby('station').indices
+
     idx_tg = np.arange(len(sorted_names))
     for station in idx_tg:
         try:
             # ssh_cmems_station = df[df['station_name'] == sorted_names[station]]
-            ssh_cmems_station = df[df['station_name'] == sorted_names[station]].copy()  # Corrected warnings
+            ssh_cmems_station = df.iloc[df_rows.get(sorted_names[station], [])].copy()  # Corrected warnings
             ssh_cmems_station.sort_values(by='time', inplace=True) # Sort values by time
 
             # tg_station = closest_tg_times[station].dropna(dim='time')
-            tg_station = df_tg[df_tg['station'] == sorted_names[station]].copy()
+            tg_station = df_tg.iloc[df_tg_rows.get(sorted_names[station], [])].copy()
 
             # Convert time column to numpy datetime64
             # ssh_cmems_station['time'] = pd.to_datetime(ssh_cmems_station['time'])
@@ -323,24 +249,10 @@ for rad in dmedia:
             tg_ts.reset_index(inplace=True)
             cmems_ts.reset_index(inplace=True)
 
-            # Calculate correlation between cmems and tg
-            correlation = cmems_ts['demean'].corr(tg_ts['demean'])
-
-            # Calculate RMSD between cmems and tg
-            rmsd = np.sqrt(np.mean((cmems_ts['demean'] - tg_ts['demean']) ** 2))
-
-            # Calculate variances of cmems and tg
-            var_cmems_df = cmems_ts['demean'].var()
-            var_tg_df = tg_ts['demean'].var()
-
-            # Calculate the variance of the difference between cmems and tg
-            var_diff_df = (cmems_ts['demean'] - tg_ts['demean']).var()
-
-            rmsds.append(rmsd)
-            correlations.append(correlation)
-            var_tg.append(var_tg_df)
-            var_CMEMS.append(var_cmems_df)
-            var_diff.append(var_diff_df)
+            # Series compared for the statistics of all the stations (aligned by row, as the pandas operations)
+            compared_tables.append(pd.DataFrame({'station': sorted_names[station], 'cmems': cmems_ts['demean'],
+                                                 'tg': tg_ts['demean']}))
+            compared_stations.append(sorted_names[station])
 
             # Num days used
             days_used_per_gauge.append(len(cmems_ts))
@@ -383,6 +295,16 @@ for rad in dmedia:
             continue  # Skip to the next iteration
 
 
+    # Statistics of all the compared stations in one grouped pass (instead of the pandas operations of each station)
+    compared = (pd.concat(compared_tables, ignore_index=True) if compared_tables
+                else pd.DataFrame(columns=['station', 'cmems', 'tg']))
+    cmems_stats = stats.grouped_stats(compared, 'station', compared_stations, 'tg', ['cmems'])['cmems']
+    correlations = cmems_stats['correlation'].tolist()
+    rmsds = cmems_stats['rmsd'].tolist()
+    var_tg = cmems_stats['var_reference'].tolist()
+    var_CMEMS = cmems_stats['var'].tolist()
+    var_diff = cmems_stats['var_diff'].tolist()
+
     n_val = []  # List to store average number of CMEMS values per station
 
     # Loop through each station name
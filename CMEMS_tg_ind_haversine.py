@@ -5,12 +5,20 @@ import pandas as pd
 import os
 import cartopy.crs as ccrs
 from shapely.geometry import LineString
+from functools import partial  # for fixing the arguments of the reading function
 import warnings
 import cartopy.feature as cfeature
 import statsmodels.api as sm  # for LOWESS filter
 # Set the warning filter to "ignore" to suppress all warnings
 warnings.filterwarnings("ignore")
 import loess_smooth_handmade as loess  # for LOESS filter
+import l4_products as l4  # for gauge averaging matrices of L4 grids
+import extraction_cache as cache  # for caching the extractions of each file
+import parallel_extraction as parallel  # for extracting the files in parallel
+import tg_store as tgs  # for loading the tide gauge data and counting its samples
+import station_stats as stats  # for the statistics of all the stations at once
+import ragged as rg  # for the locations within the radius of the records (flat values and offsets)
+import extraction_records as recs  # for the typed column buffers of the extraction records
 import math
 
 # ----------------------------------PARAMETERS------------------------------------------------------------------------
@@ -25,6 +33,21 @@ dmedia = np.arange(10, 15, 5)  # Array of distances from 5 to 110 km in 5 km inc
 # Window size for the LOESS filter (in days)
 day_window = 7
 
+# Extraction of the CMEMS values around the tide gauges (strategy 0)
+# 'cube': stack all the daily files in a (time, lat, lon) cube and extract the series of all the gauges at once
+# 'daily': process the daily files one by one
+extraction_mode = 'cube'
+
+# Number of processes extracting the daily files in parallel (None: all the CPUs, 1: sequential)
+n_workers = None
+prefetch_depth = 4  # Daily files read ahead while processing the current one (sequential extraction)
+
+# Cache of the extractions (strategy 0): files already extracted with the same radius and tide gauges are not
+# read again (the typed records and the locations of the grid cells within the radius)
+use_cache = True
+record_columns = ['station', 'longitude', 'latitude', 'n_val', 'ssha', 'time', 'min_distance']  # Typed buffers (cached)
+raw_columns = ['cmems_lat_within_radius', 'cmems_lon_within_radius']  # Ragged arrays (cached)
+
 # Function for calculating the Haversine distance between two points
 def haversine(lon1, lat1, lon2, lat2):
     # convert decimal degrees to radians
@@ -52,6 +75,9 @@ threshold_outliers = 2  # Threshold for Z-scores to remove outliers
 # Path to the general SWOT data folder
 path ='/home/dvega/anaconda3/work/SWOT/'
 
+# Folder where the gauge averaging matrices of each product grid are cached
+cache_path = f'{path}cache/'
+
 # ALTIMETRY DATA PRODUCTS PATHS ----------------------------------------------------------------------------------------
 # DUACS (SWOT L4) GLOBAL
 cmems_path = f'{path}SWOT_L4/'
@@ -74,214 +100,213 @@ product_name = 'DUACS (SWOT_L4)'
 # product_name = 'CMEMS_reprocessed'
 
 # tide gauge data paths ---------------------------------------------------
-data_tg = np.load(f'{path}mareografos/TGresiduals1d_2023_European_Seas_SWOT_FSP.npz')
-names_tg = pd.read_csv(f'{path}mareografos/GLOBAL_TGstations_CMEMS_SWOT_FSP_Feb2024', header=None)
+tg_file = f'{path}mareografos/TGresiduals1d_2023_European_Seas_SWOT_FSP.npz'
+tg_names_file = f'{path}mareografos/GLOBAL_TGstations_CMEMS_SWOT_FSP_Feb2024'
 
 
 # ---------------------------------- READING TIDE GAUGE DATA --------------------------------------------------------
 
-sla = data_tg.get('resdacTOTday') * 100  # Convert to centimeters (cm)
-time = data_tg.get('timeTOTday')
-lat_tg = data_tg.get('latTOT')
-lon_tg = data_tg.get('lonTOT')
-
-# Convert datenum into datetime
-epoch_start = pd.Timestamp('1970-01-01')
-time_days = np.array(time, dtype='timedelta64[D]')  # Convert 'time' to a timedelta array
-time_datetime = epoch_start.to_numpy() + time_days
+# Tide gauge stations sorted by longitude from east to west (loaded once, cached in binary form)
+tg = tgs.load_tg(tg_file, tg_names_file, cache_path)
+sorted_names = tg['names'].tolist()
+ordered_lat = tg['latitude'].tolist()
+ordered_lon = tg['longitude'].tolist()
 
-data_arrays = []
-
-for i in range(lat_tg.size):  # Assuming lat_tg and lon_tg are 1D arrays with length 21
-    # Create a DataArray for each station with its corresponding time and SLA values
+# Create a DataFrame to store tide gauge data
+df_tg = tgs.tg_table(tg)  # Keep NaNs for calculating the percentage of NaNs per station
+df_tg_dropna = df_tg.dropna(how='any')
 
-    station_name = names_tg[0][i]
+# Number of samples and NaNs of each station for any time window (percentage of NaNs per station)
+tg_coverage = tgs.coverage_index(df_tg)
 
-    da = xr.DataArray(
-        data=sla[i, :],  # SLA data for the i-th station
-        dims=["time"],
-        coords={
-            "time": time_datetime[i, :],  # Time data for the i-th station
-            "latitude": lat_tg[i],
-            "longitude": lon_tg[i]
-        },
-        name=f"station_{station_name}"
-    )
-    data_arrays.append(da)
 
-    # Order by longitude from east to west:
-    # Pair each station name with its corresponding longitude
-    name_longitude_pairs = [(da.name, da.longitude.item()) for da in data_arrays]
+# ------------------------ PROCESSING CMEMS DATA AROUND TG LOCATIONS --------------------------------------------------
 
-    # Sort the pairs by longitude in descending order
-    sorted_pairs = sorted(name_longitude_pairs, key=lambda x: x[1], reverse=True)
+lolabox = [-2, 8, 35, 45]
 
-    # Extract the sorted names
-    sorted_names = [name for name, _ in sorted_pairs]
+results_rad_comparison = []  # List to store results for each radius
 
+# Loop through all netCDF files in the folder
+nc_files = parallel.sort_by_time([f for f in os.listdir(cmems_path) if f.endswith('.nc')])
+
+if strategy == 0 and extraction_mode == 'cube':
+    cube_files = [os.path.join(cmems_path, f) for f in nc_files]
+    cube_product = f'{product_name} {lolabox}'  # Product and window of the cube (part of the cache key)
+    cube = None  # Stacked only once, when the first radius size not cached is processed
+    daily_files = []  # No file is processed one by one
+else:
+    daily_files = nc_files
+
+# Hash of the tide gauge catalogue (part of the cache key)
+gauges_key = cache.gauge_hash(sorted_names, ordered_lon, ordered_lat)
+
+# Function for reading the lolabox window of one daily CMEMS file (or its extraction, if cached)
+def read_cmems_file(filename, rad):
+    file_path = os.path.join(cmems_path, filename)
+
+    key = None
+    if strategy == 0 and use_cache:
+        # Extraction of the file already cached for this radius and these tide gauges
+        key = cache.extraction_key(file_path, f'{product_name} {lolabox}', [rad], gauges_key, cache_path)
+        cached_records = cache.load_columns(cache_path, key, record_columns)
+        cached_raw = cache.load_raw(cache_path, key, raw_columns)
+        if cached_records is not None and cached_raw is not None:
+            return {'cached_records': cached_records, 'cached_raw': cached_raw}
+
+    with xr.open_dataset(file_path) as ds_all:
+        # Select all latitudes and the last 370 longitudes
+        ds = ds_all.sel(latitude=slice(lolabox[2], lolabox[3]), longitude=slice(lolabox[0], lolabox[1])).load()
 
-# Setting the names_tg per longitude order from east to west
-# Create a new list to store ordered data arrays
-ordered_data_arrays = []
-ordered_lat = []
-ordered_lon = []
+    return {'ds': ds, 'key': key}
 
-# Loop through the sorted station names and get the corresponding DataArray
-for name in sorted_names:
-  for da in data_arrays:
-    if da.name == name:
-      ordered_data_arrays.append(da)
-      ordered_lat.append(np.float64(da['latitude'].values))
-      ordered_lon.append(np.float64(da['longitude'].values))
-      break  # Exit the inner loop once the matching DataArray is found
 
-# Replace the original data_arrays list with the ordered version
-data_arrays = ordered_data_arrays
+# Function for extracting the CMEMS values around all the tide gauges from one daily file (run in parallel)
+def extract_cmems_file(filename, cmems, rad):
+    if 'cached_records' in cmems:
+        return cmems['cached_records'], cmems['cached_raw']
 
-# Create a DataFrame to store tide gauge data
-df_tg = []
-
-# Iterate over each DataArray
-for da in data_arrays:
-    # Extracting values from the DataArray
-    time_values = da["time"].values
-    sla_values = da.values
-    station_name = da.name  # Extracting station name from DataArray name
-    latitude = da.latitude.values
-    longitude = da.longitude.values
-
-    # Create a DataFrame for the current DataArray
-    tg_data = pd.DataFrame({
-        'time': time_values,
-        'ssha': sla_values,
-        'station': [station_name] * len(time_values),
-        'latitude': latitude,
-        'longitude': longitude
-    })
-
-    # Append the DataFrame to the list
-    df_tg.append(tg_data)
-
-# Concatenate all DataFrames into a single DataFrame
-df_tg_dropna = pd.concat(df_tg, ignore_index=True).dropna(how='any')
-df_tg = pd.concat(df_tg, ignore_index=True)  # Keep NaNs for calculating the percentage of NaNs per station
+    # Typed buffers of the CMEMS values of all the tide gauges for this file (one record per tide gauge)
+    file_records = recs.allocate(len(ordered_lon), record_columns)
+    file_records['station'][:] = np.arange(len(ordered_lon))
 
+    # Locations of the grid cells within the radius of each record (stored as ragged arrays, None without data)
+    file_raw = {name: [None] * len(ordered_lon) for name in raw_columns}
 
-# ------------------------ PROCESSING CMEMS DATA AROUND TG LOCATIONS --------------------------------------------------
+    ds = cmems['ds']
+    time = ds['time'].values
+    ssh = ds['sla'][0, :, :]
+    lat = ds['latitude']
+    lon = ds['longitude']
 
-lolabox = [-2, 8, 35, 45]
+    if strategy == 0:
+        # Averaging matrix of the grid cells within the radius of each gauge (built once per grid and radius)
+        weights = l4.load_weight_matrix(lon.values, lat.values, ordered_lon, ordered_lat, rad, cache_path)
 
-results_rad_comparison = []  # List to store results for each radius
+        # Average SSH within the radius of all the gauges with one sparse product
+        ssh_gauges, _ = l4.apply_weights(weights, ssh.values)
 
-# Loop through all netCDF files in the folder
-nc_files = [f for f in os.listdir(cmems_path) if f.endswith('.nc')]
+        # Values of all the tide gauges at once (gauges without grid cells within the radius remain without data)
+        has_cells = weights['n_val'] > 0
+        file_records['longitude'][:] = ordered_lon  # Location of the tide gauges
+        file_records['latitude'][:] = ordered_lat
+        file_records['n_val'][:] = weights['n_val']  # Number of CMEMS points within the radius
+        file_records['ssha'][has_cells] = ssh_gauges[has_cells] * 100  # Convert to centimeters (cm)
+        file_records['time'][:] = time[0]
+        file_records['min_distance'][has_cells] = weights['min_distance'][has_cells]  # Mean distance between CMEMS and tide gauge
 
-for rad in dmedia:
-    print(f'Beggining processing radius {rad} km')
-
-    # List to store all CMEMS time series (one list per radius size)
-    all_cmems_timeseries = []
-
-    for filename in nc_files:
-        file_path = os.path.join(cmems_path, filename)
-        ds_all = xr.open_dataset(file_path)
-
-        # Select all latitudes and the last 370 longitudes
-        ds = ds_all.sel(latitude=slice(lolabox[2], lolabox[3]), longitude=slice(lolabox[0], lolabox[1]))
-
-        time = ds['time'].values
-        ssh = ds['sla'][0, :, :]
-        lat = ds['latitude']
-        lon = ds['longitude']
+        # Latitude and longitude of the grid cells within the radius
+        for tg_idx in np.flatnonzero(has_cells):
+            lat_indexes, lon_indexes = l4.cells_within_radius(weights, tg_idx)
+            file_raw['cmems_lat_within_radius'][tg_idx] = lat.values[lat_indexes]
+            file_raw['cmems_lon_within_radius'][tg_idx] = lon.values[lon_indexes]
 
+    else:  # ----------------------------------------------------------------------------------------------------
         # Loop through each tide gauge location
         for tg_idx, (tg_lon, tg_lat) in enumerate(zip(ordered_lon, ordered_lat)):
+            # Calculate distance for each data point
+            distances = haversine(lon, lat, tg_lon, tg_lat)
 
-            if strategy == 0:  # ------------------------------------------------------------------------------------------
+            # Find indices within the specified radius
+            mask = distances <= rad
 
-                # Calculate distances
-                distances = haversine(lon, lat, tg_lon, tg_lat)
+            # Select closest SSH value within the radius (if any)
+            if np.any(mask):
+                # Find the closest non-NaN index
+                closest_idx = np.nanargmin(distances[mask])
+                file_records['longitude'][tg_idx] = lon[closest_idx]  # Longitude of selected CMEMS point
+                file_records['latitude'][tg_idx] = lat[closest_idx]  # Latitude of selected CMEMS point
+                file_records['n_val'][tg_idx] = 1
+                file_records['ssha'][tg_idx] = ssh[closest_idx] * 100  # Retrieve closest non-NaN SSH and convert to centimeters (cm)
+                file_records['time'][tg_idx] = time[closest_idx]
+                file_records['min_distance'][tg_idx] = distances[mask][closest_idx]  # Obtain the closest distance
 
-                mask = distances <= rad  # Create a mask to select points within the radius
+    file_raw = {name: rg.from_arrays(file_raw[name]) for name in raw_columns}
 
-                # Convert the mask to a numpy array to use it for indexing
-                mask_array = np.array(mask)
+    if strategy == 0 and use_cache:
+        cache.save_columns(cache_path, cmems['key'], file_records)
+        cache.save_raw(cache_path, cmems['key'], file_raw)
 
-                # Apply the mask to the ssh array
-                ssh_serie_within_rad = ssh.values[mask_array]
-  
-                # Average nearby SSH values (if any)
-                if len(ssh_serie_within_rad) > 0:
-                    min_distance = np.min(distances.values[mask_array])
+    return file_records, file_raw
 
-                    # Apply the mask to get boolean indexes for all dimensions
-                    ssh_indexes = np.where(mask_array)
 
-                    # Use the boolean indexes to subset ssh, lat, and lon
-                    ssh_series = ssh[ssh_indexes]
-                    cmems_lat_within_radius = lat.values[ssh_indexes[0]]
-                    cmems_lon_within_radius = lon.values[ssh_indexes[1]]
+for rad in dmedia:
+    print(f'Beggining processing radius {rad} km')
 
-                    n_idx = len(ssh_serie_within_rad)  # How many values are used for computing the mean value
-                    ssh_serie = np.nanmean(ssh_serie_within_rad) * 100  # Convert to centimeters (cm)
-                else:
-                    ssh_serie = np.nan  # No data within radius (remains NaN)
-
-                # Create a dictionary to store tide gauge and CMEMS  data
-                selected_data = {
-                    "station_name": sorted_names[tg_idx],  # Access station name
-                    "longitude": tg_lon,  # Longitude of tide gauge
-                    "latitude": tg_lat,  # Latitude of tide gauge
-                    "num_cmems_points": np.sum(mask),  # Number of CMEMS points within the radius
-                    "ssha": ssh_serie,  # Retrieved SSH valueu
-                    "time": time,
-                    "min_distance": min_distance,  # Mean distance between CMEMS and tide gauge
-                    "cmems_lat_within_radius": cmems_lat_within_radius,
-                    "cmems_lon_within_radius": cmems_lon_within_radius
-                    }
-                
-            else:  # ----------------------------------------------------------------------------------------------------
-                # Calculate distance for each data point
-                distances = haversine(lon, lat, tg_lon, tg_lat)
-
-                # Find indices within the specified radius
-                mask = distances <= rad
-
-                # Select closest SSH value within the radius (if any)
-                if np.any(mask):
-                    # Find the closest non-NaN index
-                    closest_idx = np.nanargmin(distances[mask])
-                    distance_point = distances[mask][closest_idx]  # Obtain the closest distance
-                    ssh_serie = ssh[closest_idx] * 100  # Retrieve closest non-NaN SSH and convert to centimeters (cm)
-                    time_serie = time[closest_idx]
-
-                    # Create a dictionary to store selected CMEMS data
-                    selected_data = {
-                        "station_name": sorted_names[tg_idx],  # Access station name
-                        "longitude": lon[closest_idx],  # Longitude of selected CMEMS point
-                        "latitude": lat[closest_idx],  # Latitude of selected CMEMS point
-                        "ssha": ssh_serie,  # Retrieved SSH value
-                        "time": time_serie,
-                        "mean_distance": distance_point
-                    }
-
-            # Append the selected data to the list
-            all_cmems_timeseries.append(selected_data)
-
-    # CONVERT TO DATAFRAME for easier managing
-    df_dropna = pd.DataFrame(all_cmems_timeseries).dropna(how='any')  # Convert to DataFrame
-
-    df2 = pd.DataFrame(all_cmems_timeseries)
+    # List to store the records (typed buffers) and the locations within the radius of each file (or of the cube)
+    all_cmems_records = []
+    all_cmems_raw = []
+
+    cached_records = cached_raw = None
+    if strategy == 0 and extraction_mode == 'cube' and use_cache:
+        # Extraction of all the files already cached for this radius and these tide gauges
+        key = cache.extraction_key(cube_files, cube_product, [rad], gauges_key, cache_path)
+        cached_records = cache.load_columns(cache_path, key, record_columns)
+        cached_raw = cache.load_raw(cache_path, key, raw_columns)
+
+    if cached_records is not None and cached_raw is not None:
+        all_cmems_records.append(cached_records)
+        all_cmems_raw.append(cached_raw)
+
+    elif strategy == 0 and extraction_mode == 'cube':
+        if cube is None:
+            # Stack the lolabox window of all the daily files (same cube for all the radius sizes)
+            cube = l4.load_time_cube(cube_files, lolabox)
+
+        # Averaging matrix of the grid cells within the radius of each gauge
+        weights = l4.load_weight_matrix(cube['longitude'], cube['latitude'], ordered_lon, ordered_lat, rad, cache_path)
+
+        # Time series of all the gauges over the whole time axis at once (gauges x time)
+        ssh_gauges, _ = l4.extract_gauge_series(weights, cube['sla'])
+
+        # Typed buffers of all the gauges and days (one record per gauge and day, in this order)
+        n_times = len(cube['time'])
+        cube_records = recs.allocate(len(ordered_lon) * n_times, record_columns)
+        cube_records['station'][:] = np.repeat(np.arange(len(ordered_lon)), n_times)
+        cube_records['longitude'][:] = np.repeat(ordered_lon, n_times)  # Location of the tide gauges
+        cube_records['latitude'][:] = np.repeat(ordered_lat, n_times)
+        cube_records['n_val'][:] = np.repeat(weights['n_val'], n_times)  # Number of CMEMS points within the radius
+        cube_records['ssha'][:] = ssh_gauges.ravel() * 100  # Retrieved SSH value (cm)
+        cube_records['time'][:] = np.tile(cube['time'], len(ordered_lon))
+        cube_records['min_distance'][:] = np.repeat(weights['min_distance'], n_times)  # Mean distance between CMEMS and tide gauge
+
+        # CMEMS locations within the radius (the same for every day)
+        cube_raw = {name: [] for name in raw_columns}
+        for tg_idx in range(len(ordered_lon)):
+            lat_indexes, lon_indexes = l4.cells_within_radius(weights, tg_idx)
+            cube_raw['cmems_lat_within_radius'].append(rg.from_matrix(np.broadcast_to(cube['latitude'][lat_indexes], (n_times, lat_indexes.size))))
+            cube_raw['cmems_lon_within_radius'].append(rg.from_matrix(np.broadcast_to(cube['longitude'][lon_indexes], (n_times, lon_indexes.size))))
+        cube_raw = {name: rg.concatenate(cube_raw[name]) for name in raw_columns}
+
+        if use_cache:
+            cache.save_columns(cache_path, key, cube_records)
+            cache.save_raw(cache_path, key, cube_raw)
+
+        all_cmems_records.append(cube_records)
+        all_cmems_raw.append(cube_raw)
+
+    # CMEMS values of the daily files extracted in parallel (merged in time order)
+    for file_records, file_raw in parallel.extract_files(extract_cmems_file, daily_files, n_workers,
+                                                         load=partial(read_cmems_file, rad=rad),
+                                                         prefetch_depth=prefetch_depth, rad=rad):
+        all_cmems_records.append(file_records)
+        all_cmems_raw.append(file_raw)
+
+    # Locations within the radius of all the records (row i: record i, index of df2 and df_dropna before reset)
+    cmems_raw = {name: rg.concatenate([file_raw[name] for file_raw in all_cmems_raw]) for name in raw_columns}
+
+    # CONVERT TO DATAFRAME for easier managing (typed columns of all the records, without data: NaN SSH)
+    df2 = recs.to_table(recs.concatenate(all_cmems_records, record_columns), sorted_names, 'station_name')
+    df2 = df2.rename(columns={'n_val': 'num_cmems_points'})
+
+    df_dropna = df2.dropna(how='any')  # Convert to DataFrame
 
     # for i in range(len(sorted_names)):  # CHECKING HOW MANY NANS THERE ARE ACCORDING TO THE RADIUS SIZE
     #     print((df2[df2['station_name'] == sorted_names[i]]['ssha']).isna().sum())
 
-    correlations = []
-    rmsds = []
     consistencys = []
-    var_tg = []
-    var_CMEMS = []
-    var_diff = []
+    compared_tables = []  # Series compared at each station (statistics of all the stations at once)
+    compared_stations = []
+    compared_axes = {}  # Time series plot of each compared station
     days_used_per_gauge = []
     n_nans_tg = []
     min_distances = []
@@ -296,8 +321,6 @@ for rad in dmedia:
     
     df_dropna = df_dropna[~df_dropna['station_name'].isin(drop_tg_names)].reset_index(drop=True)
 
-    # Convert from Series of ndarrays containing dates to Series of timestamps
-    df_dropna['time'] = df_dropna['time'].apply(lambda x: x[0])
 
 
     # ---------------- MANAGING COMPARISON BETWEEN TG AND SWO ------------------------------------------------
@@ -308,11 +331,15 @@ for rad in dmedia:
     # demean = 'demean'
     demean = 'demean_filtered'
 
+    # Rows of each station (grouped once instead of comparing all the rows with each station name)
+    df_dropna_rows = df_dropna.groupby('station_name').indices
+    df_tg_dropna_rows = df_tg_dropna.groupby('station').indices
+
     idx_tg = np.arange(len(sorted_names))
     for station in idx_tg:
         try:
             # ssh_cmems_station = df[df['station_name'] == sorted_names[station]]
-            ssh_cmems_station = df_dropna[df_dropna['station_name'] == sorted_names[station]].copy()  # Corrected warnings
+            ssh_cmems_station = df_dropna.iloc[df_dropna_rows.get(sorted_names[station], [])].copy()  # Corrected warnings
             
             if ssh_cmems_station.empty:  # Check if the DataFrame is empty                
                 empty_stations.append(station)
@@ -323,7 +350,7 @@ for rad in dmedia:
                 ssh_cmems_station.sort_values(by='time', inplace=True) # Sort values by time
 
                 # tg_station = closest_tg_times[station].dropna(dim='time')
-                tg_station = df_tg_dropna[df_tg_dropna['station'] == sorted_names[station]].copy()
+                tg_station = df_tg_dropna.iloc[df_tg_dropna_rows.get(sorted_names[station], [])].copy()
 
                 # Convert time column to numpy datetime64
                 # ssh_cmems_station['time'] = pd.to_datetime(ssh_cmems_station['time'])
@@ -371,11 +398,8 @@ for rad in dmedia:
                 cmems_ts.reset_index(inplace=True)
 
                 # Drop the stations where the TG stations have more than 20% of NaNs for the period
-                tg_ts_nans = df_tg[df_tg['station'] == sorted_names[station]].copy()
-                tg_ts_nans['time'] = pd.to_datetime(tg_ts_nans['time']) # Convert time to datetime
-                tg_ts_nans.set_index('time', inplace=True)
-                tg_ts_nans = tg_ts_nans[start_date:end_date]
-                tg_ts_nans = tg_ts_nans['ssha'].isna().sum() / len(tg_ts) * 100
+                tg_n_samples, tg_n_valid = tgs.window_counts(tg_coverage, sorted_names[station], start_date, end_date)
+                tg_ts_nans = (tg_n_samples - tg_n_valid) / len(tg_ts) * 100
                 
                 if len(cmems_ts) != 0 and tg_ts_nans < 20:
 
@@ -384,12 +408,12 @@ for rad in dmedia:
 
                     # CMEMS
                     # filt_lowess = sm.nonparametric.lowess(cmems_ts['demean'], cmems_ts['time'], frac=frac_lowess, return_sorted=False)
-                    filt_loess_cmems = loess.loess_smooth_handmade(cmems_ts['demean'].values, frac_loess)
+                    filt_loess_cmems = loess.loess_smooth_handmade(cmems_ts['demean'].values, frac_loess, t=cmems_ts['time'].values)
                     cmems_ts['demean_filtered'] = filt_loess_cmems
 
                     # TGs
                     # filt_lowess = sm.nonparametric.lowess(tg_ts['demean'], tg_ts['time'], frac=frac_lowess, return_sorted=False)
-                    filt_loess_tg = loess.loess_smooth_handmade(tg_ts['demean'].values, frac_loess)
+                    filt_loess_tg = loess.loess_smooth_handmade(tg_ts['demean'].values, frac_loess, t=tg_ts['time'].values)
                     tg_ts['demean_filtered'] = filt_loess_tg
 
                     # Add the stations with less than 20% of NaNs
@@ -401,25 +425,11 @@ for rad in dmedia:
                     print(f"Station {sorted_names[station]} has more than 20% of NaNs")
                     continue
 
-                # Calculate correlation between cmems and tg
-                correlation = cmems_ts[demean].corr(tg_ts[demean])
-
-                # Calculate RMSD between cmems and tg
-                rmsd = np.sqrt(np.mean((cmems_ts[demean] - tg_ts[demean]) ** 2))
-
-                # Calculate variances of cmems and tg
-                var_cmems_df = cmems_ts[demean].var()
-                var_tg_df = tg_ts['demean'].var()
-
-                # Calculate the variance of the difference between cmems and tg
-                var_diff_df = (cmems_ts[demean] - tg_ts[demean]).var()
-
-                rmsds.append(rmsd)
-
-                correlations.append(correlation)
-                var_tg.append(var_tg_df)
-                var_CMEMS.append(var_cmems_df)
-                var_diff.append(var_diff_df)
+                # Series compared for the statistics of all the stations (aligned by row, as the pandas operations)
+                # (the variance of the tide gauge is the one of the unfiltered serie)
+                compared_tables.append(pd.DataFrame({'station': sorted_names[station], 'cmems': cmems_ts[demean],
+                                                     'tg': tg_ts[demean], 'tg_unfiltered': tg_ts['demean']}))
+                compared_stations.append(sorted_names[station])
 
                 # Num days used
                 days_used_per_gauge.append(len(cmems_ts))
@@ -446,13 +456,7 @@ for rad in dmedia:
                 plt.grid(True, alpha=0.2)
                 plt.ylabel('SSHA (cm)')
                 plt.tick_params(axis='both', which='major', labelsize=11)
-                plt.text(0.95, 0.1, f'RMSD: {rmsd:.2f} cm', fontsize=12, color='black', 
-                         transform=plt.gca().transAxes, ha='right', bbox=dict(facecolor='white', alpha=0.5))
-                plt.text(0.95, 0.2, f'CORRELATION: {correlation:.2f}', fontsize=12, color='black', 
-                         transform=plt.gca().transAxes, ha='right', bbox=dict(facecolor='white', alpha=0.5))
-
-
-                # plt.savefig(f'{plot_path}{sorted_names[station]}_{rad}km_{day_window}dLoess_{product_name}.png')
+                compared_axes[sorted_names[station]] = plt.gca()  # RMSD and correlation written (and saved) after the loop
 
 
                 # MAP PLOT OF CMEMS LOCATIONS OBTAINED FROM EACH GAUGE!
@@ -481,6 +485,27 @@ for rad in dmedia:
             continue  # Skip to the next iteration
 
 
+    # Statistics of all the compared stations in one grouped pass (instead of the pandas operations of each station)
+    compared = (pd.concat(compared_tables, ignore_index=True) if compared_tables
+                else pd.DataFrame(columns=['station', 'cmems', 'tg', 'tg_unfiltered']))
+    compared_stats = stats.grouped_stats(compared, 'station', compared_stations, 'tg', ['cmems', 'tg_unfiltered'])
+    cmems_stats = compared_stats['cmems']
+    correlations = cmems_stats['correlation'].tolist()
+    rmsds = cmems_stats['rmsd'].tolist()
+    var_tg = compared_stats['tg_unfiltered']['var'].tolist()
+    var_CMEMS = cmems_stats['var'].tolist()
+    var_diff = cmems_stats['var_diff'].tolist()
+
+    # Write the RMSD and correlation in the time series plot of each station
+    for station_name, ax in compared_axes.items():
+        rmsd, correlation = cmems_stats.loc[station_name, ['rmsd', 'correlation']]
+        ax.text(0.95, 0.1, f'RMSD: {rmsd:.2f} cm', fontsize=12, color='black',
+                transform=ax.transAxes, ha='right', bbox=dict(facecolor='white', alpha=0.5))
+        ax.text(0.95, 0.2, f'CORRELATION: {correlation:.2f}', fontsize=12, color='black',
+                transform=ax.transAxes, ha='right', bbox=dict(facecolor='white', alpha=0.5))
+
+        # ax.figure.savefig(f'{plot_path}{station_name}_{rad}km_{day_window}dLoess_{product_name}.png')
+
     n_val = []  # List to store average number of CMEMS values per station
 
     # Loop through each station name
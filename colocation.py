@@ -0,0 +1,392 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Mean Earth radius (km), same value used by the haversine distance
+EARTH_RADIUS = 6371
+
+# Default memory budget (bytes) for the temporary arrays of the broadcast distance computation
+MAX_MEMORY = 256 * 1024**2
+
+# Dot products closer than this to the threshold of the radius are checked with the exact haversine distance
+DOT_TOLERANCE = 1e-12
+
+
+# Function for calculating the Haversine distance between two points
+def haversine(lon1, lat1, lon2, lat2):
+    # convert decimal degrees to radians
+    lon1 = np.deg2rad(lon1)
+    lon2 = np.deg2rad(lon2)
+    lat1 = np.deg2rad(lat1)
+    lat2 = np.deg2rad(lat2)
+
+    # haversine formula
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    c = 2 * np.arcsin(np.sqrt(a))
+    return c * EARTH_RADIUS
+
+
+# Function for converting longitudes and latitudes (degrees) into 3D unit vectors on the sphere
+def lonlat_to_xyz(lon, lat):
+    lon = np.deg2rad(lon)
+    lat = np.deg2rad(lat)
+    cos_lat = np.cos(lat)
+    return np.stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)), axis=-1)
+
+
+# Function for converting a great circle distance (km) into the straight chord length between two unit vectors
+def distance_to_chord(rad):
+    return 2 * np.sin(np.minimum(rad / EARTH_RADIUS, np.pi) / 2)
+
+
+# Function for converting a chord length between two unit vectors into the great circle distance (km)
+def chord_to_distance(chord):
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(chord / 2, 1))
+
+
+def build_pixel_index(lon, lat):
+    """
+    Build a spherical spatial index (k-d tree over 3D unit vectors) of the pixels of a file.
+    It only has to be built once per file and can then be queried for all the tide gauges.
+    """
+    return cKDTree(lonlat_to_xyz(np.ravel(lon), np.ravel(lat)))
+
+
+def query_radius(tree, lon, lat, gauge_lon, gauge_lat, rad, active=None):
+    """
+    Find the pixels within rad km of every tide gauge with a single batched query of the index.
+    Returns, for each gauge, the indices of the pixels within the radius (in ascending order)
+    and their haversine distances to the gauge. Gauges where active is False are not queried
+    and get no pixels.
+    """
+    gauge_lon = np.atleast_1d(np.asarray(gauge_lon, dtype=np.float64))
+    gauge_lat = np.atleast_1d(np.asarray(gauge_lat, dtype=np.float64))
+
+    in_radius = [np.array([], dtype=np.intp) for _ in range(gauge_lon.size)]
+    distances = [np.array([]) for _ in range(gauge_lon.size)]
+
+    active_idx = np.arange(gauge_lon.size) if active is None else np.flatnonzero(active)
+    if active_idx.size == 0:
+        return in_radius, distances
+
+    # Chord length equivalent to the radius, slightly enlarged to not lose border pixels by rounding
+    chord = distance_to_chord(rad) * (1 + 1e-9)
+    candidates = tree.query_ball_point(lonlat_to_xyz(gauge_lon[active_idx], gauge_lat[active_idx]), chord,
+                                       return_sorted=True)
+
+    for idx, candidate in zip(active_idx, candidates):
+        candidate = np.asarray(candidate, dtype=np.intp)
+
+        # Exact distance only for the candidates returned by the index
+        dist = haversine(lon[candidate], lat[candidate], gauge_lon[idx], gauge_lat[idx])
+        keep = dist <= rad
+
+        in_radius[idx] = candidate[keep]
+        distances[idx] = dist[keep]
+
+    return in_radius, distances
+
+
+def query_radius_bbox(lon, lat, gauge_lon, gauge_lat, rad, active=None):
+    """
+    Find the pixels within rad km of every tide gauge cutting first the candidates with a latitude band
+    and a longitude band (scaled by the cosine of the latitude, across the dateline) derived from rad.
+    The exact haversine distance is only computed for the pixels inside both bands.
+    Returns the pixels within the radius and their distances (as query_radius) and the number of
+    candidates rejected at each stage.
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    gauge_lon = np.atleast_1d(np.asarray(gauge_lon, dtype=np.float64))
+    gauge_lat = np.atleast_1d(np.asarray(gauge_lat, dtype=np.float64))
+
+    in_radius = [np.array([], dtype=np.intp) for _ in range(gauge_lon.size)]
+    distances = [np.array([]) for _ in range(gauge_lon.size)]
+    stats = {'n_candidates': 0, 'rejected_lat': 0, 'rejected_lon': 0, 'rejected_haversine': 0}
+
+    # Pixels sorted by latitude, so the latitude band is a slice of them
+    lat_order = np.argsort(lat, kind='stable')
+    lat_sorted = lat[lat_order]
+
+    # Half width of the latitude band (degrees)
+    dlat = np.rad2deg(rad / EARTH_RADIUS)
+
+    active_idx = np.arange(gauge_lon.size) if active is None else np.flatnonzero(active)
+    for idx in active_idx:
+        stats['n_candidates'] += lon.size
+
+        # Latitude band
+        start = np.searchsorted(lat_sorted, gauge_lat[idx] - dlat, side='left')
+        end = np.searchsorted(lat_sorted, gauge_lat[idx] + dlat, side='right')
+        candidate = lat_order[start:end]
+        stats['rejected_lat'] += int(lon.size - candidate.size)
+
+        # Longitude band, wider with the latitude (all longitudes if the band reaches a pole)
+        max_lat = np.abs(gauge_lat[idx]) + dlat
+        if max_lat < 90:
+            dlon = dlat / np.cos(np.deg2rad(max_lat))
+            lon_diff = (lon[candidate] - gauge_lon[idx] + 180) % 360 - 180  # Across the dateline
+            in_band = np.abs(lon_diff) <= dlon
+            stats['rejected_lon'] += int(candidate.size - np.count_nonzero(in_band))
+            candidate = candidate[in_band]
+
+        # Exact distance only for the pixels inside both bands
+        candidate = np.sort(candidate)
+        dist = haversine(lon[candidate], lat[candidate], gauge_lon[idx], gauge_lat[idx])
+        keep = dist <= rad
+        stats['rejected_haversine'] += int(candidate.size - np.count_nonzero(keep))
+
+        in_radius[idx] = candidate[keep]
+        distances[idx] = dist[keep]
+
+    return in_radius, distances, stats
+
+
+def prepare_pixels(lon, lat):
+    """
+    Precompute the radian coordinates and the cosine of the latitude of the pixels, so they can be
+    reused for all the gauges and radius sizes.
+    """
+    lon_rad = np.deg2rad(np.asarray(lon, dtype=np.float64))
+    lat_rad = np.deg2rad(np.asarray(lat, dtype=np.float64))
+    return {'lon': lon_rad, 'lat': lat_rad, 'cos_lat': np.cos(lat_rad)}
+
+
+def query_radius_broadcast(pixels, gauge_lon, gauge_lat, rad, active=None, max_memory=MAX_MEMORY):
+    """
+    Find the pixels within rad km of every tide gauge evaluating all the gauges against all the pixels
+    as a (gauges x pixels) broadcast. The pixels are processed in tiles so that the temporary arrays
+    stay under max_memory bytes. pixels comes from prepare_pixels.
+    Returns the pixels within the radius and their distances (as query_radius).
+    """
+    gauge_lon = np.atleast_1d(np.asarray(gauge_lon, dtype=np.float64))
+    gauge_lat = np.atleast_1d(np.asarray(gauge_lat, dtype=np.float64))
+
+    in_radius = [np.array([], dtype=np.intp) for _ in range(gauge_lon.size)]
+    distances = [np.array([]) for _ in range(gauge_lon.size)]
+
+    # Nothing to query (no active gauge or no pixels, e.g. a file without lines in the latitudes of the gauges)
+    n_pixels = pixels['lat'].size
+    active_idx = np.arange(gauge_lon.size) if active is None else np.flatnonzero(active)
+    if active_idx.size == 0 or n_pixels == 0:
+        return in_radius, distances
+
+    gauge_lon_rad = np.deg2rad(gauge_lon[active_idx])[:, np.newaxis]
+    gauge_lat_rad = np.deg2rad(gauge_lat[active_idx])[:, np.newaxis]
+    gauge_cos_lat = np.cos(gauge_lat_rad)
+
+    # Haversine term of the radius (slightly enlarged to not lose border pixels by rounding)
+    a_max = np.sin(min(rad / EARTH_RADIUS, np.pi) / 2)**2 * (1 + 1e-9)
+
+    # Number of pixels per tile (about 6 float64 temporaries of gauges x tile elements)
+    tile = max(1, int(max_memory // (6 * 8 * active_idx.size)))
+
+    gauges_found = []
+    pixels_found = []
+    distances_found = []
+    for start in range(0, n_pixels, tile):
+        end = min(start + tile, n_pixels)
+
+        # Haversine formula for all the gauges and the pixels of the tile
+        dlon = pixels['lon'][start:end] - gauge_lon_rad
+        dlat = pixels['lat'][start:end] - gauge_lat_rad
+        a = np.sin(dlat/2)**2 + gauge_cos_lat * pixels['cos_lat'][start:end] * np.sin(dlon/2)**2
+
+        # Distance (arcsin) only for the pixels within the radius
+        gauge, pixel = np.nonzero(a <= a_max)
+        dist = 2 * np.arcsin(np.sqrt(a[gauge, pixel])) * EARTH_RADIUS
+        keep = dist <= rad
+
+        gauges_found.append(gauge[keep])
+        pixels_found.append(pixel[keep] + start)
+        distances_found.append(dist[keep])
+
+    # Group the pixels by gauge (stable sort keeps the pixels in ascending order)
+    gauges_found = np.concatenate(gauges_found)
+    order = np.argsort(gauges_found, kind='stable')
+    pixels_found = np.concatenate(pixels_found)[order]
+    distances_found = np.concatenate(distances_found)[order]
+    bounds = np.searchsorted(gauges_found[order], np.arange(active_idx.size + 1))
+
+    for k, idx in enumerate(active_idx):
+        in_radius[idx] = pixels_found[bounds[k]:bounds[k + 1]].astype(np.intp)
+        distances[idx] = distances_found[bounds[k]:bounds[k + 1]]
+
+    return in_radius, distances
+
+
+def query_radius_chord(vectors, gauge_lon, gauge_lat, rad, active=None, max_memory=MAX_MEMORY, lon=None, lat=None):
+    """
+    Find the pixels within rad km of every tide gauge comparing the dot product of precomputed 3D unit
+    vectors (lonlat_to_xyz) against the cosine of the radius, so no trigonometric function is evaluated
+    per pixel. The pixels whose dot product is within DOT_TOLERANCE of the threshold are checked with the
+    haversine distance (from lon and lat of the pixels if given, from the vectors otherwise), so the pixels
+    at the border of the radius are the same as with haversine <= rad.
+    The pixels are processed in tiles so that the temporary arrays stay under max_memory bytes.
+    Returns, for each gauge, the indices of the pixels within the radius (in ascending order) and the
+    index of the closest pixel (-1 if there is none).
+    """
+    gauge_lon = np.atleast_1d(np.asarray(gauge_lon, dtype=np.float64))
+    gauge_lat = np.atleast_1d(np.asarray(gauge_lat, dtype=np.float64))
+
+    in_radius = [np.array([], dtype=np.intp) for _ in range(gauge_lon.size)]
+    closest = np.full(gauge_lon.size, -1, dtype=np.intp)
+
+    # Nothing to query (no active gauge or no pixels, e.g. a file without lines in the latitudes of the gauges)
+    n_pixels = vectors.shape[0]
+    active_idx = np.arange(gauge_lon.size) if active is None else np.flatnonzero(active)
+    if active_idx.size == 0 or n_pixels == 0:
+        return in_radius, closest
+
+    if lon is None or lat is None:
+        # Longitudes and latitudes of the pixels from their vectors (only used at the border of the radius)
+        lon = np.rad2deg(np.arctan2(vectors[:, 1], vectors[:, 0]))
+        lat = np.rad2deg(np.arcsin(np.clip(vectors[:, 2], -1, 1)))
+
+    gauge_vectors = lonlat_to_xyz(gauge_lon[active_idx], gauge_lat[active_idx])
+
+    # Threshold of the dot product equivalent to the radius (converted only once)
+    cos_max = np.cos(min(rad / EARTH_RADIUS, np.pi))
+
+    # Number of pixels per tile (about 3 float64 temporaries of gauges x tile elements)
+    tile = max(1, int(max_memory // (3 * 8 * active_idx.size)))
+
+    pixels_found = [[] for _ in active_idx]
+    best_dot = np.full(active_idx.size, -np.inf)
+    for start in range(0, n_pixels, tile):
+        end = min(start + tile, n_pixels)
+
+        # Cosine of the angle between each gauge and each pixel of the tile
+        dots = gauge_vectors @ vectors[start:end].T
+        within = dots >= cos_max
+
+        # Exact haversine distance for the pixels at the border of the radius (rounding of the dot product)
+        border_gauge, border_pixel = np.nonzero(np.abs(dots - cos_max) <= DOT_TOLERANCE)
+        if border_gauge.size > 0:
+            within[border_gauge, border_pixel] = haversine(lon[border_pixel + start], lat[border_pixel + start],
+                                                           gauge_lon[active_idx[border_gauge]],
+                                                           gauge_lat[active_idx[border_gauge]]) <= rad
+        gauge, pixel = np.nonzero(within)
+
+        # Closest pixel of each gauge is the one with the largest dot product
+        tile_best = dots.argmax(axis=1)
+        tile_best_dot = dots[np.arange(active_idx.size), tile_best]
+        better = (tile_best_dot > best_dot) & within[np.arange(active_idx.size), tile_best]
+        best_dot[better] = tile_best_dot[better]
+        closest[active_idx[better]] = tile_best[better] + start
+
+        bounds = np.searchsorted(gauge, np.arange(active_idx.size + 1))
+        for k in range(active_idx.size):
+            pixels_found[k].append(pixel[bounds[k]:bounds[k + 1]] + start)
+
+    for k, idx in enumerate(active_idx):
+        in_radius[idx] = np.concatenate(pixels_found[k]).astype(np.intp)
+
+    return in_radius, closest
+
+
+def colocate(lon, lat, gauge_lon, gauge_lat, rad, backend='tree', active=None, max_memory=MAX_MEMORY,
+             return_distances=False):
+    """
+    Find the pixels within rad km of every tide gauge with the chosen backend:
+    'tree': spherical k-d tree of the pixels
+    'bbox': latitude and longitude bands before the haversine distance
+    'broadcast': tiled gauges x pixels haversine distance
+    'chord': tiled dot product of 3D unit vectors (haversine only for the closest pixel)
+    Returns, for each gauge, the indices of the pixels within the radius and the distance to the closest
+    one (NaN if there is none), or the distances to all of them if return_distances is True.
+    """
+    lon = np.asarray(lon)
+    lat = np.asarray(lat)
+    gauge_lon = np.atleast_1d(np.asarray(gauge_lon, dtype=np.float64))
+    gauge_lat = np.atleast_1d(np.asarray(gauge_lat, dtype=np.float64))
+
+    if backend == 'chord':
+        in_radius, closest = query_radius_chord(lonlat_to_xyz(lon, lat), gauge_lon, gauge_lat, rad, active=active,
+                                                max_memory=max_memory, lon=lon, lat=lat)
+        if return_distances:
+            distances = [haversine(lon[idx], lat[idx], g_lon, g_lat)
+                         for idx, g_lon, g_lat in zip(in_radius, gauge_lon, gauge_lat)]
+            return in_radius, distances
+
+        # Exact distance only for the closest pixel of each gauge
+        has_data = closest >= 0
+        min_distance = np.full(gauge_lon.size, np.nan)
+        min_distance[has_data] = haversine(lon[closest[has_data]], lat[closest[has_data]],
+                                           gauge_lon[has_data], gauge_lat[has_data])
+        return in_radius, min_distance
+
+    if backend == 'tree':
+        pixel_index = build_pixel_index(lon, lat) if active is None or np.any(active) else None
+        in_radius, distances = query_radius(pixel_index, lon, lat, gauge_lon, gauge_lat, rad, active=active)
+    elif backend == 'bbox':
+        in_radius, distances, _ = query_radius_bbox(lon, lat, gauge_lon, gauge_lat, rad, active=active)
+    elif backend == 'broadcast':
+        in_radius, distances = query_radius_broadcast(prepare_pixels(lon, lat), gauge_lon, gauge_lat, rad,
+                                                      active=active, max_memory=max_memory)
+    else:
+        raise ValueError(f'Unknown colocation backend: {backend}')
+
+    if return_distances:
+        return in_radius, distances
+
+    min_distance = np.array([dist.min() if dist.size > 0 else np.nan for dist in distances])
+    return in_radius, min_distance
+
+
+def multi_radius_summary(ssh, in_radius, distances, radii):
+    """
+    Obtain the mean SSH, number of points and closest distance for every radius in radii from a single
+    query up to the largest radius. The pixels are sorted by distance once, so the pixels within each
+    radius are a prefix of the sorted pixels and the means come from cumulative sums.
+    """
+    radii = np.asarray(radii)
+
+    # Sort the pixels within the largest radius by distance to the gauge
+    order = np.argsort(distances, kind='stable')
+    sorted_indices = in_radius[order]
+    sorted_distances = distances[order]
+
+    # Number of pixels within each radius
+    n_val = np.searchsorted(sorted_distances, radii, side='right')
+
+    # Mean SSH within each radius from the cumulative sums
+    ssh_cumsum = np.concatenate(([0.], np.cumsum(ssh[sorted_indices], dtype=np.float64)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ssh_mean = np.where(n_val > 0, ssh_cumsum[n_val] / n_val, np.nan)
+
+    # Closest distance and first pixel (in file order) within each radius
+    has_data = n_val > 0
+    min_distance = np.full(radii.shape, np.nan)
+    first_index = np.full(radii.shape, -1, dtype=np.intp)
+    if sorted_indices.size > 0:
+        min_distance[has_data] = sorted_distances[0]
+        first_index[has_data] = np.minimum.accumulate(sorted_indices)[n_val[has_data] - 1]
+
+    return {'sorted_indices': sorted_indices,  # Pixels within the largest radius sorted by distance
+            'n_val': n_val,
+            'ssha': ssh_mean,
+            'min_distance': min_distance,
+            'first_index': first_index}
+
+
+def footprint_coverage(lon_swath, lat_swath, x_ac, gauge_lon, gauge_lat, rad):
+    """
+    Obtain which tide gauges can ever be within rad km of a SWOT pass from its footprint grid
+    (lat, lon and across track distance x_ac). A gauge is covered if its closest footprint point
+    is closer than rad plus the across track spacing of the grid (margin for the grid resolution).
+    """
+    lon_swath = np.ma.filled(np.ma.asarray(lon_swath, dtype=np.float64), np.nan).ravel()
+    lat_swath = np.ma.filled(np.ma.asarray(lat_swath, dtype=np.float64), np.nan).ravel()
+    valid = ~np.isnan(lon_swath) & ~np.isnan(lat_swath)
+
+    # Across track spacing of the footprint grid (km)
+    x_ac = np.ma.filled(np.ma.asarray(x_ac, dtype=np.float64), np.nan).ravel()
+    spacing = np.nanmedian(np.abs(np.diff(np.unique(x_ac[~np.isnan(x_ac)]))))
+
+    # Distance from each gauge to the closest footprint point
+    footprint_index = build_pixel_index(lon_swath[valid], lat_swath[valid])
+    chord, _ = footprint_index.query(lonlat_to_xyz(np.atleast_1d(gauge_lon), np.atleast_1d(gauge_lat)))
+
+    return chord_to_distance(chord) <= rad + spacing
@@ -0,0 +1,123 @@
+import os
+import json
+import threading
+import hashlib
+import numpy as np
+import pandas as pd
+import ragged as rg  # for the raw values within the radius (Parquet list columns)
+
+# Checksums already computed in this session (key: absolute file path)
+_checksums = {}
+_checksums_lock = threading.Lock()  # Files can be hashed by several threads (prefetch)
+
+
+def file_checksum(file_path, cache_path):
+    """
+    SHA1 checksum of the content of a file. The checksums are stored in cache_path (with the size and
+    modification time of the file) so each file is only read once for hashing.
+    """
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    signature = [stat.st_size, stat.st_mtime_ns]
+
+    index_file = os.path.join(cache_path, 'checksums.json')
+    with _checksums_lock:
+        if not _checksums and os.path.exists(index_file):
+            with open(index_file) as f:
+                _checksums.update(json.load(f))
+
+        if file_path in _checksums and _checksums[file_path][:2] == signature:
+            return _checksums[file_path][2]
+
+    sha = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024**2), b''):
+            sha.update(block)
+
+    with _checksums_lock:
+        _checksums[file_path] = signature + [sha.hexdigest()]
+
+        # Written to a temporary file first (several processes can update the index at the same time)
+        os.makedirs(cache_path, exist_ok=True)
+        tmp_file = f'{index_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(_checksums, f)
+        os.replace(tmp_file, index_file)
+
+    return sha.hexdigest()
+
+
+def gauge_hash(names, gauge_lon, gauge_lat):
+    """
+    Hash identifying the catalogue of tide gauges (names and locations, in order).
+    """
+    sha = hashlib.sha1()
+    sha.update('\n'.join(names).encode())
+    sha.update(np.ascontiguousarray(gauge_lon, dtype=np.float64).tobytes())
+    sha.update(np.ascontiguousarray(gauge_lat, dtype=np.float64).tobytes())
+    return sha.hexdigest()
+
+
+def extraction_key(file_paths, product, radii, gauges_key, cache_path):
+    """
+    Key of the extraction of a product from one file (or a list of files extracted together) for a list
+    of radius sizes and a tide gauge catalogue.
+    """
+    if isinstance(file_paths, str):
+        file_paths = [file_paths]
+
+    sha = hashlib.sha1()
+    for file_path in file_paths:
+        sha.update(file_checksum(file_path, cache_path).encode())
+    sha.update(product.encode())
+    sha.update(np.asarray(radii, dtype=np.float64).tobytes())
+    sha.update(gauges_key.encode())
+    return sha.hexdigest()
+
+
+def load_columns(cache_path, key, columns):
+    """
+    Column buffers (dict column: typed array) of a cached extraction, or None if the extraction is not cached
+    (or if the cached table lacks some of the given columns, e.g. cached by an older version of the script).
+    """
+    cache_file = os.path.join(cache_path, f'records_{key}.parquet')
+    if not os.path.exists(cache_file):
+        return None
+    table = pd.read_parquet(cache_file)
+    if not set(columns).issubset(table.columns):
+        return None
+    return {column: table[column].values for column in columns}
+
+
+def save_columns(cache_path, key, records):
+    """
+    Store the column buffers of an extraction (dict column: typed array) in cache_path (Parquet file, the
+    types of the columns are kept). The raw values within the radius are cached with save_raw.
+    """
+    os.makedirs(cache_path, exist_ok=True)
+    cache_file = os.path.join(cache_path, f'records_{key}.parquet')
+    pd.DataFrame(records, copy=False).to_parquet(f'{cache_file}.{os.getpid()}.tmp', index=False)
+    os.replace(f'{cache_file}.{os.getpid()}.tmp', cache_file)
+
+
+def load_raw(cache_path, key, columns):
+    """
+    Ragged arrays (dict column: ragged array) of the raw values within the radius of a cached extraction, or
+    None if they are not cached (or lack some of the given columns).
+    """
+    cache_file = os.path.join(cache_path, f'raw_{key}.parquet')
+    if not os.path.exists(cache_file):
+        return None
+    raggeds = rg.load_parquet(cache_file)
+    if not set(columns).issubset(raggeds):
+        return None
+    return {column: raggeds[column] for column in columns}
+
+
+def save_raw(cache_path, key, raggeds):
+    """
+    Store the ragged arrays of the raw values within the radius of an extraction (dict column: ragged array,
+    same rows as the records) in cache_path (Parquet list columns).
+    """
+    os.makedirs(cache_path, exist_ok=True)
+    rg.save_parquet(os.path.join(cache_path, f'raw_{key}.parquet'), raggeds)
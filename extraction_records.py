@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+# Types of the columns of the extraction records (one record per file, or day, and tide gauge)
+COLUMN_TYPES = {'station': np.int32,  # Index of the tide gauge (order of the sorted names)
+                'longitude': np.float64,  # Location of the value (tide gauge, or selected point for strategy 1)
+                'latitude': np.float64,
+                'time': 'datetime64[ns]',  # Time of the value
+                'day': np.int32,  # Day index of the time (days since 1970-01-01)
+                'ssha': np.float32,  # SSH anomaly (cm)
+                'n_val': np.int32,  # Number of points averaged within the radius
+                'min_distance': np.float32,  # Distance to the closest point within the radius (km)
+                'mean_distance': np.float32,  # Mean distance of the points within the radius (km)
+                'product': np.int8}  # Index of the product (order of the products names)
+
+# Values of the records without data
+MISSING = {'station': -1, 'longitude': np.nan, 'latitude': np.nan, 'time': np.datetime64('NaT'), 'day': -1,
+           'ssha': np.nan, 'n_val': 0, 'min_distance': np.nan, 'mean_distance': np.nan,
+           'product': -1}
+
+
+def allocate(n_records, columns):
+    """
+    Preallocated typed column buffers (dict column: array) for n_records records, filled with the missing
+    values (NaN, NaT, 0 points and -1 for the indices), so the extraction only writes the records with data.
+    """
+    return {column: np.full(n_records, MISSING[column], dtype=COLUMN_TYPES[column]) for column in columns}
+
+
+def concatenate(records_list, columns):
+    """
+    Column buffers with the records of several buffers one after the other (e.g. the records of all the files).
+    """
+    return {column: np.concatenate([records[column] for records in records_list])
+            if records_list else np.empty(0, dtype=COLUMN_TYPES[column]) for column in columns}
+
+
+# Function for obtaining the names of some indices (None for the missing index -1)
+def _names(names, indices):
+    names = np.asarray(list(names) + [None], dtype=object)
+    return names[np.where(indices >= 0, indices, len(names) - 1)]
+
+
+def to_table(records, stations, station_column='station', products=None):
+    """
+    DataFrame of the column buffers (no copy of the typed columns) with the names of the stations (column
+    station_column) and of the products instead of their indices (None for the records without index).
+    """
+    table = {station_column: _names(stations, records['station'])}
+    table.update({column: values for column, values in records.items() if column != 'station'})
+    if products is not None and 'product' in records:
+        table['product'] = _names(products, records['product'])
+    return pd.DataFrame(table, copy=False)
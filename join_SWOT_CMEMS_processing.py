@@ -5,12 +5,22 @@ import pandas as pd
 import os
 import cartopy.crs as ccrs
 from shapely.geometry import LineString
+from functools import partial  # for fixing the arguments of the reading function
 import warnings
 import cartopy.feature as cfeature
 import statsmodels.api as sm  # for LOWESS filter
 # Set the warning filter to "ignore" to suppress all warnings
 warnings.filterwarnings("ignore")
 import loess_smooth_handmade as loess  # for LOESS filter
+import colocation as coloc  # for spatial index of SWOT pixels
+import l4_products as l4  # for gauge averaging matrices of L4 grids
+import swot_reader  # for reading SWOT L3 files
+import extraction_cache as cache  # for caching the extractions of each file
+import parallel_extraction as parallel  # for extracting the files in parallel
+import station_stats as stats  # for the statistics of all the stations at once
+import tg_store as tgs  # for loading the tide gauge data
+import ragged as rg  # for the raw values within the radius of the records (flat values and offsets)
+import extraction_records as recs  # for the typed column buffers of the extraction records
 import math
 
 # ----------------------------------PARAMETERS------------------------------------------------------------------------
@@ -19,12 +29,34 @@ import math
 # 1: Select the closest SSH value within the radius
 strategy = 0
 
+# Method for finding the SWOT pixels within the radius of the tide gauges
+# 'tree': spherical k-d tree, 'bbox': latitude/longitude bands before haversine, 'broadcast': tiled gauges x pixels haversine,
+# 'chord': dot product of 3D unit vectors (haversine only for the closest pixel)
+colocation_backend = 'tree'
+
 # Maximum distance from each CMEMS point to the tide gauge location
 dmedia = np.arange(20, 45, 5)  # Array of distances from 5 to 110 km in 5 km increments
 
 # Window size for the LOESS filter (in days)
 day_window = 7
 
+# Extraction of the L4 products values around the tide gauges
+# 'cube': stack all the daily files in a (time, lat, lon) cube and extract the series of all the gauges at once
+# 'daily': process the daily files one by one
+extraction_mode = 'cube'
+
+# Number of processes extracting the daily files in parallel (None: all the CPUs, 1: sequential)
+n_workers = None
+prefetch_depth = 4  # Daily files read ahead while processing the current one (sequential extraction)
+
+# Cache of the extractions: files already extracted with the same radius and tide gauges are not read again
+# (the typed records and the raw values and locations within the radius)
+use_cache = True
+ssh_variable = 'ssha_noiseless'  # SSH variable read from the SWOT L3 files (part of the cache key)
+# ssh_variable = 'ssha'
+record_columns = ['station', 'longitude', 'latitude', 'ssha', 'time', 'n_val', 'min_distance', 'product']  # Typed buffers (cached)
+raw_columns = ['ssha_raw', 'lat_within_radius', 'lon_within_radius']  # Ragged arrays (cached)
+
 # Function for calculating the Haversine distance between two points
 def haversine(lon1, lat1, lon2, lat2):
     # convert decimal degrees to radians
@@ -49,22 +81,18 @@ def calculate_z_scores(series):
 
 threshold_outliers = 5  # Threshold for Z-scores to remove outliers
 
-def process_ts(time_series, product_n):
+def daily_arrays(df, stations, calendar, columns):
     """
-    Process the given time series by standarizing, removing outliers and smooth the data.
+    Values of the columns of a table (time, station, ...) as dense (station, day) float32 arrays on a daily
+    calendar, NaN where there is no data. The samples of the same station and day are averaged.
     """
-    ts_mean = time_series[product_n].mean()
-    ts_demean = time_series[product_n] - ts_mean
-    time_series['demean'] = ts_demean
-    # z_scores = calculate_z_scores(time_series['demean'])
-    # time_series = time_series[np.abs(z_scores) <= threshold_outliers]
-
-    # Apply a LOESS filter to the time series
-    frac_loess = 1 / day_window
+    codes = pd.Categorical(df['station'], categories=stations).codes
+    day = ((pd.to_datetime(df['time']).dt.floor('d') - calendar[0]) // pd.Timedelta(days=1)).values
+    inside = ~np.isnan(day)
 
-    time_series['demean_filtered'] = loess.loess_smooth_handmade(time_series['demean'].values, frac_loess)
-
-    return time_series
+    means, _ = stats.daily_means(codes[inside], day[inside], df[columns].values[inside],
+                                 len(stations), len(calendar))
+    return {column: means[:, :, i].astype(np.float32) for i, column in enumerate(columns)}
 
 def compute_combined_rmsd(rmsds, threshold):
 
@@ -85,6 +113,9 @@ def compute_combined_rmsd(rmsds, threshold):
 # Path to the general SWOT data folder -----------------------------------------------------------------------------------
 path ='/home/dvega/anaconda3/work/SWOT/'
 
+# Folder where the gauge averaging matrices of each product grid are cached
+cache_path = f'{path}cache/'
+
 # ALTIMETRY DATA PRODUCTS PATHS ----------------------------------------------------------------------------------------
 # Define the products to process
 products = [
@@ -117,8 +148,8 @@ products = [
 products_names = [product['product_name'] for product in products]
 
 # tide gauge data paths ---------------------------------------------------
-data_tg = np.load(f'{path}mareografos/TGresiduals1d_2023_European_Seas_SWOT_FSP.npz')
-names_tg = pd.read_csv(f'{path}mareografos/GLOBAL_TGstations_CMEMS_SWOT_FSP_Feb2024', header=None)
+tg_file = f'{path}mareografos/TGresiduals1d_2023_European_Seas_SWOT_FSP.npz'
+tg_names_file = f'{path}mareografos/GLOBAL_TGstations_CMEMS_SWOT_FSP_Feb2024'
 
 
 # # Dropping wrong tide gauges (errors in tide gauge raw data)
@@ -130,266 +161,231 @@ drop_tg_names = ['station_GL_TS_TG_TamarisTG',
     
 # ---------------------------------- READING TIDE GAUGE DATA --------------------------------------------------------
 
-sla = data_tg.get('resdacTOTday') * 100  # Convert to centimeters (cm)
-time = data_tg.get('timeTOTday')
-lat_tg = data_tg.get('latTOT')
-lon_tg = data_tg.get('lonTOT')
+# Tide gauge stations sorted by longitude from east to west (loaded once, cached in binary form)
+tg = tgs.load_tg(tg_file, tg_names_file, cache_path)
+sorted_names = tg['names'].tolist()
+ordered_lat = tg['latitude'].tolist()
+ordered_lon = tg['longitude'].tolist()
 
-# Convert datenum into datetime
-epoch_start = pd.Timestamp('1970-01-01')
-time_days = np.array(time, dtype='timedelta64[D]')  # Convert 'time' to a timedelta array
-time_datetime = epoch_start.to_numpy() + time_days
+# Create a DataFrame to store tide gauge data
+df_tg = tgs.tg_table(tg)  # Keep NaNs for calculating the percentage of NaNs per station
 
-data_arrays = []
+# Drop wrong stations from the tide gauge data
+df_tg = df_tg[~df_tg['station'].isin(drop_tg_names)].reset_index(drop=True)
+df_tg.set_index('time', inplace=True)
+df_tg.sort_index(inplace=True)
+df_tg_dropna = df_tg.dropna(how='any')
 
-for i in range(lat_tg.size):  # Assuming lat_tg and lon_tg are 1D arrays with length 21
-    # Create a DataArray for each station with its corresponding time and SLA values
+# ------------------------ PROCESSING CMEMS DATA AROUND TG LOCATIONS --------------------------------------------------
 
-    station_name = names_tg[0][i]
+lolabox = [-2, 8, 35, 45]
 
-    da = xr.DataArray(
-        data=sla[i, :],  # SLA data for the i-th station
-        dims=["time"],
-        coords={
-            "time": time_datetime[i, :],  # Time data for the i-th station
-            "latitude": lat_tg[i],
-            "longitude": lon_tg[i]
-        },
-        name=f"station_{station_name}"
-    )
-    data_arrays.append(da)
+results_rad_comparison = []  # List to store results for each radius
 
-    # Order by longitude from east to west:
-    # Pair each station name with its corresponding longitude
-    name_longitude_pairs = [(da.name, da.longitude.item()) for da in data_arrays]
+l4_cubes = {}  # Time cubes of the L4 products (loaded once and used for all the radius sizes)
+cube_box = list(lolabox)  # Window of the time cubes (lolabox is changed inside the loop)
+
+# Hash of the tide gauge catalogue (part of the cache key)
+gauges_key = cache.gauge_hash(sorted_names, ordered_lon, ordered_lat)
+
+# Function for reading the values of a product from one daily file (or its extraction, if cached)
+def read_product_file(filename, rad, folder_path, product_name, swot_lat_range):
+    file_path = os.path.join(folder_path, filename)
+
+    key = None
+    if use_cache:
+        # Extraction of the file already cached for this radius and these tide gauges
+        if product_name == 'SWOT L3':
+            key = cache.extraction_key(file_path, f'{product_name} {ssh_variable}', [rad], gauges_key, cache_path)
+        else:
+            key = cache.extraction_key(file_path, f'{product_name} {lolabox}', [rad], gauges_key, cache_path)
+        cached_records = cache.load_columns(cache_path, key, record_columns)
+        cached_raw = cache.load_raw(cache_path, key, raw_columns)
+        if cached_records is not None and cached_raw is not None:
+            return {'cached_records': cached_records, 'cached_raw': cached_raw}
 
-    # Sort the pairs by longitude in descending order
-    sorted_pairs = sorted(name_longitude_pairs, key=lambda x: x[1], reverse=True)
+    if product_name == 'SWOT L3':
+        # Only the variables used and the lines within the latitudes of the tide gauges are read
+        swot = swot_reader.read_swot_l3(file_path, lat_range=swot_lat_range, ssh_variable=ssh_variable)
 
-    # Extract the sorted names
-    sorted_names = [name for name, _ in sorted_pairs]
+        # Valid values as flat arrays (the time of a pixel is resolved from the time of its line when needed)
+        pixels = swot_reader.valid_pixels(swot)
+        pixels['key'] = key
+        return pixels
 
+    with xr.open_dataset(file_path) as ds_all:
+        # Select all latitudes and the last 370 longitudes
+        ds = ds_all.sel(latitude=slice(lolabox[2], lolabox[3]), longitude=slice(lolabox[0], lolabox[1])).load()
 
-# Setting the names_tg per longitude order from east to west
-# Create a new list to store ordered data arrays
-ordered_data_arrays = []
-ordered_lat = []
-ordered_lon = []
+    return {'ds': ds, 'key': key}
 
-# Loop through the sorted station names and get the corresponding DataArray
-for name in sorted_names:
-  for da in data_arrays:
-    if da.name == name:
-      ordered_data_arrays.append(da)
-      ordered_lat.append(np.float64(da['latitude'].values))
-      ordered_lon.append(np.float64(da['longitude'].values))
-      break  # Exit the inner loop once the matching DataArray is found
 
-# Replace the original data_arrays list with the ordered version
-data_arrays = ordered_data_arrays
+# Function for extracting the values of a product around all the tide gauges from one daily file (run in parallel)
+def extract_product_file(filename, data, rad, product_name):
+    if 'cached_records' in data:
+        return data['cached_records'], data['cached_raw']
 
-# Create a DataFrame to store tide gauge data
-df_tg = []
-
-# Iterate over each DataArray
-for da in data_arrays:
-    # Extracting values from the DataArray
-    time_values = da["time"].values
-    sla_values = da.values
-    station_name = da.name  # Extracting station name from DataArray name
-    latitude = da.latitude.values
-    longitude = da.longitude.values
-
-    # Create a DataFrame for the current DataArray
-    tg_data = pd.DataFrame({
-        'time': time_values,
-        'ssha': sla_values,
-        'station': [station_name] * len(time_values),
-        'latitude': latitude,
-        'longitude': longitude
-    })
-
-    # Append the DataFrame to the list
-    df_tg.append(tg_data)
-
-# Concatenate all DataFrames into a single DataFrame
-df_tg = pd.concat(df_tg, ignore_index=True)  # Keep NaNs for calculating the percentage of NaNs per station
+    # Typed buffers of the values of all the tide gauges for this file (one record per tide gauge)
+    file_records = recs.allocate(len(ordered_lon), record_columns)
+    file_records['station'][:] = np.arange(len(ordered_lon))
+    file_records['longitude'][:] = ordered_lon  # Location of the tide gauges
+    file_records['latitude'][:] = ordered_lat
+    file_records['product'][:] = products_names.index(product_name)
 
-# Drop wrong stations from the tide gauge data
-df_tg = df_tg[~df_tg['station'].isin(drop_tg_names)].reset_index(drop=True)
-df_tg.set_index('time', inplace=True)
-df_tg.sort_index(inplace=True)
-df_tg_dropna = df_tg.dropna(how='any')
+    # Raw values within the radius of each record (stored as ragged arrays, None without data)
+    file_raw = {name: [None] * len(ordered_lon) for name in raw_columns}
 
-# ------------------------ PROCESSING CMEMS DATA AROUND TG LOCATIONS --------------------------------------------------
+    if product_name == 'SWOT L3':  # ------------------------------------------------------------------------------------------
+        lon, lat, ssh = data['lon'], data['lat'], data['ssh']
 
-lolabox = [-2, 8, 35, 45]
+        # Pixels within the radius of all the tide gauges at once
+        in_radius_gauges, min_distance_gauges = coloc.colocate(lon, lat, ordered_lon, ordered_lat, rad,
+                                                               backend=colocation_backend)
+
+        # Loop through each tide gauge location
+        for idx in range(len(ordered_lon)):
+
+            # Indices of the data points within the specified radius
+            in_radius = in_radius_gauges[idx]
+
+            # Average nearby SSH values (if any, the record remains without data otherwise)
+            if in_radius.size > 0:
+                file_records['ssha'][idx] = np.nanmean(ssh[in_radius]) * 100  # Convert to centimeters (cm)
+                file_records['time'][idx] = swot_reader.overpass_time(data, in_radius)  # Exact overpass time (first value of time within the radius)
+                file_records['n_val'][idx] = in_radius.size  # How many values are used for compute the mean value
+                file_records['min_distance'][idx] = min_distance_gauges[idx]  # Closest distance within the radius
+
+                # Store the raw SSH, latitudes and longitudes of SWOT within the radius
+                file_raw['ssha_raw'][idx] = ssh[in_radius]
+                file_raw['lat_within_radius'][idx] = lat[in_radius]
+                file_raw['lon_within_radius'][idx] = lon[in_radius]
+    else:
+
+        # DUACS PRODUCTS ----------------------------------------------------------------------------------------------------
+        ds = data['ds']
+
+        ssh = ds['sla'][0, :, :]
+        lat = ds['latitude']
+        lon = ds['longitude']
+
+        # Averaging matrix of the grid cells within the radius of each gauge (built once per grid and radius)
+        weights = l4.load_weight_matrix(lon.values, lat.values, ordered_lon, ordered_lat, rad, cache_path)
+
+        # Average SSH within the radius of all the gauges with one sparse product (all the gauges at once)
+        ssh_gauges, _ = l4.apply_weights(weights, ssh.values)
+        file_records['ssha'][:] = np.where(weights['n_val'] > 0, ssh_gauges * 100, np.nan)  # Convert to centimeters (cm)
+        file_records['time'][:] = ds['time'].values[0]
+        file_records['n_val'][:] = weights['n_val']  # Number of points within the radius
+        file_records['min_distance'][:] = np.where(weights['n_val'] > 0, weights['min_distance'], np.nan)  # Mean distance between CMEMS and tide gauge
+
+        # Raw SSH values and locations of the grid cells within the radius of each gauge
+        for tg_idx in np.flatnonzero(weights['n_val'] > 0):
+            lat_indexes, lon_indexes = l4.cells_within_radius(weights, tg_idx)
+            file_raw['ssha_raw'][tg_idx] = ssh.values[lat_indexes, lon_indexes]
+            file_raw['lat_within_radius'][tg_idx] = lat.values[lat_indexes]
+            file_raw['lon_within_radius'][tg_idx] = lon.values[lon_indexes]
+
+    file_raw = {name: rg.from_arrays(file_raw[name]) for name in raw_columns}
+
+    if use_cache:
+        cache.save_columns(cache_path, data['key'], file_records)
+        cache.save_raw(cache_path, data['key'], file_raw)
+
+    return file_records, file_raw
 
-results_rad_comparison = []  # List to store results for each radius
 
 # Loop through each radius size
 for rad in dmedia:
     print(f'Beggining processing radius {rad} km')
 
-    products_timeseries = []  # List to store time series for each product
+    # Latitudes of the SWOT lines that can be within the radius of the tide gauges
+    swot_lat_range = swot_reader.latitude_range(ordered_lat, rad)
+
+    products_records = []  # List to store the records (typed buffers) of each file or product
+    products_raw = []  # List to store the raw values within the radius (ragged arrays) of each file or product
 
     # Processing each product for each radius size
     for product in products:
         print(f'Processing product {product["product_name"]}')
 
-        all_altimetry_timeseries = [] # List to store all CMEMS time series (one list per radius size)
-
         folder_path = product['folder_path']
         plot_path = product['plot_path']
         product_name = product['product_name']
 
         # Loop through all netCDF files in the product folder
-        nc_files = [f for f in os.listdir(folder_path) if f.endswith('.nc')]
-
-        for filename in nc_files:
-            file_path = os.path.join(folder_path, filename)
-
-            if product_name == 'SWOT L3':  # ------------------------------------------------------------------------------------------
-
-                ds = xr.open_dataset(file_path)
-
-                # Extract data from variables
-                lon = ds['longitude'].values.flatten()
-                lat = ds['latitude'].values.flatten()
-                ssh = ds['ssha_noiseless'].values.flatten()
-                # ssh = ds['ssha'].values.flatten()
-
-                time_values = ds['time'].values  # Adding a new
-                time = np.tile(time_values[:, np.newaxis], (1, 69)).flatten()  # Not efficient
-
-                # Find indices of non-NaN values
-                valid_indices = np.where(~np.isnan(ssh))
-                lon = lon[valid_indices]
-                lat = lat[valid_indices]
-                time = time[valid_indices]
-                ssh = ssh[valid_indices]
-
-                # Loop through each tide gauge location
-                for idx, (gauge_lon, gauge_lat) in enumerate(zip(ordered_lon, ordered_lat)):
-
-                    # Calculate distance for each data point
-                    distances = haversine(lon, lat, gauge_lon, gauge_lat)
-
-                    # Find indices within the specified radius
-                    in_radius = distances <= rad
-
-                    # Average nearby SSH values (if any)
-                    if np.any(in_radius):
-
-                        ssh_tmp = np.nanmean(ssh[in_radius])
-                        ssh_serie = ssh_tmp * 100  # Convert to centimeters (cm)
-                        time_serie = time[in_radius][~np.isnan(time[in_radius])][0]  # Picking the first value of time within the radius
-
-                        # Store the latitudes and longitudes of SWOT within the radius
-                        lat_within_radius = lat[in_radius]
-                        lon_within_radius = lon[in_radius]
-
-                        # Store closest  distance and number of points used for the average
-                        min_distance_point = distances[in_radius].min()
-                        n_idx = sum(in_radius)  # How many values are used for compute the mean value
-
-                    else:
-                        ssh_serie = np.nan  # No data within radius (remains NaN)
-                        time_serie = time[in_radius][~np.isnan(time[in_radius])]
-                        n_idx = np.nan  # Number of points for the average within the radius
-                        min_distance_point = np.nan
-
-                        # If there's no SWOT data within the radius, set latitudes and longitudes to None
-                        lat_within_radius = None
-                        lon_within_radius = None
-                        # print(f"No SWOT data within {dmedia} km radius of tide gauge {sorted_names[idx]}")
-        
-                    # Create a dictionary to store tide gauge and SWOT data
-                    selected_data = {
-                        "station": sorted_names[idx],  # Access station name
-                        "longitude": gauge_lon,  # Longitude of tide gauge
-                        "latitude": gauge_lat,  # Latitude of tide gauge
-                        "ssha": ssh_serie,  # Retrieved SSH value
-                        "ssha_raw": ssh[in_radius],  # Raw SSH values within the radius
-                        "time": time_serie,
-                        "n_val": n_idx,  # Number of points for the average within the radius
-                        "lat_within_radius": lat_within_radius,  # Latitudes of SWOT within the radius
-                        "lon_within_radius": lon_within_radius,   # Longitudes of SWOT within the radius
-                        "min_distance": min_distance_point,  # Closest distance within the radius
-                        "product": product_name  # Product name 
-                        }
-                    all_altimetry_timeseries.append(selected_data)
-            else:
-
-                # DUACS PRODUCTS ----------------------------------------------------------------------------------------------------
-                ds_all = xr.open_dataset(file_path)
-
-                # Select all latitudes and the last 370 longitudes
-                ds = ds_all.sel(latitude=slice(lolabox[2], lolabox[3]), longitude=slice(lolabox[0], lolabox[1]))
-
-                time = ds['time'].values[0]
-                ssh = ds['sla'][0, :, :]
-                lat = ds['latitude']
-                lon = ds['longitude']
-
-                # Loop through each tide gauge location
-                for tg_idx, (tg_lon, tg_lat) in enumerate(zip(ordered_lon, ordered_lat)):
-
-                    # Calculate distances
-                    distances = haversine(lon, lat, tg_lon, tg_lat)
-
-                    mask = distances <= rad  # Create a mask to select points within the radius
-
-                    # Convert the mask to a numpy array to use it for indexing
-                    in_radius = np.array(mask)
-
-                    # Apply the mask to the ssh array
-                    ssh_serie_within_rad = ssh.values[in_radius]
-    
-                    # Average nearby SSH values (if any)
-                    if np.any(in_radius):
-
-                        # Apply the mask to get boolean indexes for all dimensions
-                        ssh_indexes = np.where(in_radius)
-
-                        # Use the boolean indexes to subset ssh, lat, and lon
-                        ssh_series = ssh[ssh_indexes].values
-                        ssh_serie = np.nanmean(ssh_serie_within_rad) * 100  # Convert to centimeters (cm)
-
-                        lat_within_radius = lat.values[ssh_indexes[0]]
-                        lon_within_radius = lon.values[ssh_indexes[1]]
-
-                        n_idx = np.sum(in_radius)  # How many values are used for computing the mean value
-                        min_distance = np.min(distances.values[in_radius])  # Store minimum distance within the radius
-
-                    
-                    else:
-                        ssh_serie = np.nan  # No data within radius (remains NaN)
-
-                    # Create a dictionary to store tide gauge and CMEMS  data
-                    selected_data = {
-                        "station": sorted_names[tg_idx],  # Access station name
-                        "longitude": tg_lon,  # Longitude of tide gauge
-                        "latitude": tg_lat,  # Latitude of tide gauge
-                        "ssha": ssh_serie,  # Retrieved SSH values
-                        "ssha_raw": ssh_series.flatten(),  # Raw SSH values within the radius
-                        "time": time,
-                        "n_val": n_idx,  # Number of points within the radius
-                        "lat_within_radius": lat_within_radius,
-                        "lon_within_radius": lon_within_radius,                        
-                        "min_distance": min_distance,  # Mean distance between CMEMS and tide gauge
-                        "product": product_name  # Product name
-                        }
-                    # Append the selected data to the list
-                    all_altimetry_timeseries.append(selected_data)
-
-        products_timeseries.extend(all_altimetry_timeseries)
-
-    # CONVERT TO DATAFRAME for easier managing 
-    prod_df = pd.DataFrame(products_timeseries)
-    prod_df['time'] = prod_df['time'].apply(lambda x: pd.NaT if isinstance(x, np.ndarray) and x.size == 0 else x) # Convert empty arrays to NaT
-
-    prod_df_dropna = pd.DataFrame(products_timeseries).dropna(how='any')
+        nc_files = parallel.sort_by_time([f for f in os.listdir(folder_path) if f.endswith('.nc')])
+
+        if product_name != 'SWOT L3' and extraction_mode == 'cube':  # L4 PRODUCTS AS A TIME CUBE ---------------------------
+            cube_files = [os.path.join(folder_path, f) for f in nc_files]
+
+            if use_cache:
+                # Extraction of all the files of the product already cached for this radius and these tide gauges
+                key = cache.extraction_key(cube_files, f'{product_name} {cube_box}', [rad], gauges_key, cache_path)
+                cached_records = cache.load_columns(cache_path, key, record_columns)
+                cached_raw = cache.load_raw(cache_path, key, raw_columns)
+                if cached_records is not None and cached_raw is not None:
+                    products_records.append(cached_records)
+                    products_raw.append(cached_raw)
+                    continue
+
+            # Stack the lolabox window of all the daily files only once per product
+            if product_name not in l4_cubes:
+                l4_cubes[product_name] = l4.load_time_cube(cube_files, cube_box)
+            cube = l4_cubes[product_name]
+
+            # Averaging matrix of the grid cells within the radius of each gauge
+            weights = l4.load_weight_matrix(cube['longitude'], cube['latitude'], ordered_lon, ordered_lat, rad, cache_path)
+
+            # Time series of all the gauges over the whole time axis at once (gauges x time)
+            ssh_gauges, _ = l4.extract_gauge_series(weights, cube['sla'])
+
+            # Typed buffers of all the gauges and days (one record per gauge and day, in this order)
+            n_times = len(cube['time'])
+            cube_records = recs.allocate(len(ordered_lon) * n_times, record_columns)
+            cube_records['station'][:] = np.repeat(np.arange(len(ordered_lon)), n_times)
+            cube_records['longitude'][:] = np.repeat(ordered_lon, n_times)  # Location of the tide gauges
+            cube_records['latitude'][:] = np.repeat(ordered_lat, n_times)
+            cube_records['ssha'][:] = ssh_gauges.ravel() * 100  # Retrieved SSH values (cm)
+            cube_records['time'][:] = np.tile(cube['time'], len(ordered_lon))
+            cube_records['n_val'][:] = np.repeat(weights['n_val'], n_times)  # Number of points within the radius
+            cube_records['min_distance'][:] = np.repeat(weights['min_distance'], n_times)  # Mean distance between CMEMS and tide gauge
+            cube_records['product'][:] = products_names.index(product_name)
+
+            # Raw SSH values and locations of the grid cells within the radius (the same cells for every day)
+            cube_raw = {name: [] for name in raw_columns}
+            for tg_idx in range(len(ordered_lon)):
+                lat_indexes, lon_indexes = l4.cells_within_radius(weights, tg_idx)
+                cube_raw['ssha_raw'].append(rg.from_matrix(cube['sla'][:, lat_indexes, lon_indexes]))
+                cube_raw['lat_within_radius'].append(rg.from_matrix(np.broadcast_to(cube['latitude'][lat_indexes], (n_times, lat_indexes.size))))
+                cube_raw['lon_within_radius'].append(rg.from_matrix(np.broadcast_to(cube['longitude'][lon_indexes], (n_times, lon_indexes.size))))
+            cube_raw = {name: rg.concatenate(cube_raw[name]) for name in raw_columns}
+
+            if use_cache:
+                cache.save_columns(cache_path, key, cube_records)
+                cache.save_raw(cache_path, key, cube_raw)
+
+            products_records.append(cube_records)
+            products_raw.append(cube_raw)
+            continue
+
+        # Values of all the daily files of the product extracted in parallel (merged in time order)
+        for file_records, file_raw in parallel.extract_files(extract_product_file, nc_files, n_workers,
+                                                             load=partial(read_product_file, rad=rad,
+                                                                          folder_path=folder_path,
+                                                                          product_name=product_name,
+                                                                          swot_lat_range=swot_lat_range),
+                                                             prefetch_depth=prefetch_depth,
+                                                             rad=rad, product_name=product_name):
+            products_records.append(file_records)
+            products_raw.append(file_raw)
+
+    # Raw values within the radius of all the records (row i: record i, index of prod_df before reset)
+    prod_raw = {name: rg.concatenate([file_raw[name] for file_raw in products_raw]) for name in raw_columns}
+
+    # CONVERT TO DATAFRAME for easier managing (typed columns of all the records, without data: NaN SSH)
+    prod_df = recs.to_table(recs.concatenate(products_records, record_columns), sorted_names, 'station', products_names)
+
+    prod_df_dropna = prod_df.dropna(how='any')
 
     # for i in range(len(sorted_names)):  # CHECKING HOW MANY NANS THERE ARE ACCORDING TO THE RADIUS SIZE
     #     print((df2[df2['station_name'] == sorted_names[i]]['ssha']).isna().sum())
@@ -420,245 +416,97 @@ for rad in dmedia:
     min_time = max(DUACS_SWOT_L4_dropna.index.min(), CMEMS_NRT_EUR_dropna.index.min(), CMEMS_NRT_GLO_dropna.index.min(), SWOT_L3_dropna.index.min(), df_tg_dropna.index.min())
     max_time = min(DUACS_SWOT_L4_dropna.index.max(), CMEMS_NRT_EUR_dropna.index.max(), CMEMS_NRT_GLO_dropna.index.max(), SWOT_L3_dropna.index.max(), df_tg_dropna.index.max())
     
-    # Containing NaNs-----------------------------------------------------------------------------------------------------------
-    prod_df['time'] = pd.to_datetime(prod_df['time'])
-    prod_df.sort_values(by='time', inplace=True)
-    # Round SWOT time to nearest day
-    prod_df['time'] = prod_df['time'].dt.floor('d')
-    prod_df.set_index('time', inplace=True)
-
-    # Crop the time series of each product to the overlapping period
-    DUACS_SWOT_L4 = prod_df[prod_df['product']==products_names[0]]
-    CMEMS_NRT_EUR = prod_df[prod_df['product']==products_names[1]]
-    CMEMS_NRT_GLO = prod_df[prod_df['product']==products_names[2]]
-    SWOT_L3 = prod_df[prod_df['product']==products_names[3]]
-
-    DUACS_SWOT_L4 = DUACS_SWOT_L4[['station', 'ssha', 'min_distance', 'n_val']]
-    CMEMS_NRT_EUR = CMEMS_NRT_EUR[['station', 'ssha', 'min_distance', 'n_val']]
-    CMEMS_NRT_GLO = CMEMS_NRT_GLO[['station', 'ssha', 'min_distance', 'n_val']]
-    SWOT_L3 = SWOT_L3[['station', 'ssha', 'min_distance', 'n_val']] 
-    df_tg_p1 = df_tg[['station', 'ssha']]
-
-    DUACS_SWOT_L4 = DUACS_SWOT_L4[(DUACS_SWOT_L4.index >= min_time) & (DUACS_SWOT_L4.index <= max_time)]
-    CMEMS_NRT_EUR = CMEMS_NRT_EUR[(CMEMS_NRT_EUR.index >= min_time) & (CMEMS_NRT_EUR.index <= max_time)]
-    CMEMS_NRT_GLO = CMEMS_NRT_GLO[(CMEMS_NRT_GLO.index >= min_time) & (CMEMS_NRT_GLO.index <= max_time)]
-    SWOT_L3 = SWOT_L3[(SWOT_L3.index >= min_time) & (SWOT_L3.index <= max_time)]
-    df_tg_p2 = df_tg_p1[(df_tg_p1.index >= min_time) & (df_tg_p1.index <= max_time)]
-
-    DUACS_SWOT_L4 = DUACS_SWOT_L4.rename(columns={'ssha': 'DUACS (SWOT_L4)', 'min_distance':"min_distance_duacs_swot_l4", 'n_val': 'n_val_duacs_swot_l4'})
-    CMEMS_NRT_EUR = CMEMS_NRT_EUR.rename(columns={'ssha': 'CMEMS_NRT_EUR', 'min_distance': 'min_distance_cmems_eur', 'n_val': 'n_val_cmems_eur'})
-    CMEMS_NRT_GLO = CMEMS_NRT_GLO.rename(columns={'ssha': 'CMEMS_NRT_GLO', 'min_distance': 'min_distance_cmems_glo', 'n_val': 'n_val_cmems_glo'})
-    SWOT_L3 = SWOT_L3.rename(columns={'ssha': 'SWOT L3', 'min_distance': 'min_distance_swot_l3', 'n_val': 'n_val_swot_l3'})
-    df_tg_p3 = df_tg_p2.rename(columns={'ssha': 'TG'})
-
-    # MERGE ALL DATAFRAMES-----------------------------------------------------------------------------------------------------
-    # Reset index
-    df_tg_reset = df_tg_p3.reset_index()
-    SWOT_L3_reset = SWOT_L3.reset_index()
-    CMEMS_NRT_EUR_reset = CMEMS_NRT_EUR.reset_index()
-    CMEMS_NRT_GLO_reset = CMEMS_NRT_GLO.reset_index()
-    DUACS_SWOT_L4_reset = DUACS_SWOT_L4.reset_index()
-
-    matched_df = df_tg_reset.merge(SWOT_L3_reset, left_on=['time', 'station'], right_on=['time', 'station'])
-    matched_df = matched_df.merge(CMEMS_NRT_EUR_reset, left_on=['time', 'station'], right_on=['time', 'station'])
-    matched_df = matched_df.merge(CMEMS_NRT_GLO_reset, left_on=['time', 'station'], right_on=['time', 'station'])
-    matched_df = matched_df.merge(DUACS_SWOT_L4_reset, left_on=['time', 'station'], right_on=['time', 'station'])
+    # ALIGN ALL THE PRODUCTS ON A DAILY CALENDAR------------------------------------------------------------------------------
+    # Dense (product, station, day) arrays over the overlapping period, products in the order TG, SWOT L3,
+    # CMEMS_NRT_EUR, CMEMS_NRT_GLO and DUACS (SWOT_L4)
+    calendar = pd.date_range(min_time, max_time, freq='D')
+    product_order = [products_names[3], products_names[1], products_names[2], products_names[0]]
 
-    # ---------------- MANAGING COMPARISON BETWEEN TG AND SWO ------------------------------------------------
-    empty_stations = []
-
-    correlations_swot_l3 = []
-    correlations_cmems_eur = []
-    correlations_cmems_glo = []
-    correlations_duacs_swot_l4 = []
-
-    rmsds_swot_l3 = []
-    rmsds_cmems_eur = []
-    rmsds_cmems_glo = []
-    rmsds_duacs_swot_l4 = []
-
-    variances_tg = []
-    variances_swot_l3 = []
-    variances_cmems_eur = []
-    variances_cmems_glo = []
-    variances_duacs_swot_l4 = []
-
-    variances_diff_swot_l3 = []
-    variances_diff_cmems_eur = []
-    variances_diff_cmems_glo = []
-    variances_diff_duacs_swot_l4 = []
-    
-    days_used_per_gauge_swot_l3 = []
-    days_used_per_gauge_cmems_eur = []
-    days_used_per_gauge_cmems_glo = []
-    days_used_per_gauge_duacs_swot_l4 = []
+    tg_daily = daily_arrays(df_tg.reset_index(), sorted_names, calendar, ['ssha'])
+    products_daily = [daily_arrays(prod_df[(prod_df['product'] == product_n) & (prod_df['n_val'] > 0)], sorted_names, calendar, ['ssha', 'min_distance', 'n_val'])
+                      for product_n in product_order]
 
-    min_distances_swot_l3 = []
-    min_distances_cmems_eur = []
-    min_distances_cmems_glo = []
-    min_distances_duacs_swot_l4 = []
+    ssha = np.stack([tg_daily['ssha']] + [daily['ssha'] for daily in products_daily])
+    min_distance = np.stack([daily['min_distance'] for daily in products_daily])
+    n_val = np.stack([daily['n_val'] for daily in products_daily])
 
-    n_val_swot_l3 = []
-    n_val_cmems_eur = []
-    n_val_cmems_glo = []
-    n_val_duacs_swot_l4 = []
+    # Days with data of the TG and all the products at each station
+    valid = (np.all(~np.isnan(ssha), axis=0) & np.all(~np.isnan(min_distance), axis=0)
+             & np.all(~np.isnan(n_val), axis=0))
 
+    # ---------------- MANAGING COMPARISON BETWEEN TG AND SWO ------------------------------------------------
     lolabox = [1, 8, 35, 45]
 
-    # Define the column name for the demeaned values according if the data is filtered or not
-    # demean = 'demean'
-    demean = 'demean_filtered'
-
-    idx_tg = np.arange(len(sorted_names))
-    for station in idx_tg:
-        try:
-            ssh_station = matched_df[matched_df['station'] == sorted_names[station]].copy()  # Corrected warnings
-            
-            if ssh_station.empty:  # Check if the DataFrame is empty                
-                empty_stations.append(station)
-                print(f"No CMEMS data found for station {sorted_names[station]}")
-                continue
-
-            else:
-                    # ssh_station.sort_values(by='time', inplace=True) # Sort values by time
-
-                    # # tg_station = closest_tg_times[station].dropna(dim='time')
-                ssh_station.dropna(how='any', inplace=True)  # Drop NaNs in time and ssha
-
-                # SUBSTRACT THE MEAN VALUE OF EACH TIME SERIE FOR COMPARING
-                tg_ts = process_ts(ssh_station[['time', 'TG']], 'TG')
-                cmems_eur = process_ts(ssh_station[['time', 'CMEMS_NRT_EUR', 'min_distance_cmems_eur', 'n_val_cmems_eur']], 'CMEMS_NRT_EUR')
-                cmems_glo = process_ts(ssh_station[['time', 'CMEMS_NRT_GLO', 'min_distance_cmems_glo', 'n_val_cmems_glo']], 'CMEMS_NRT_GLO')
-                swot_l3 = process_ts(ssh_station[['time', 'SWOT L3', 'min_distance_swot_l3', 'n_val_swot_l3']], 'SWOT L3')
-                duacs_swot_l4 = process_ts(ssh_station[['time', 'DUACS (SWOT_L4)', 'min_distance_duacs_swot_l4', 'n_val_duacs_swot_l4']], 'DUACS (SWOT_L4)')
-
-                if tg_ts is None or cmems_eur is None or cmems_glo is None or swot_l3 is None or duacs_swot_l4 is None:
-                    empty_stations.append(station_name)
-                    print(f"One or more products missing for station {station_name}")
-                    continue
+    # SUBSTRACT THE MEAN VALUE OF EACH TIME SERIE FOR COMPARING (all the products and stations at once)
+    ssha_valid = np.where(valid, ssha, np.nan).astype(np.float64)
+    with np.errstate(invalid='ignore'):
+        ssha_demean = ssha_valid - np.nanmean(ssha_valid, axis=2, keepdims=True)
 
-                #     empty_stations.append(station)
-                #     print(f"Station {sorted_names[station]} has no CMEMS data")
-                #     print(f"Station {sorted_names[station]} has more than 20% of NaNs")
-                #     continue
-
-                # Calculate correlation between cmems and tg
-                corr_swot_l3 = swot_l3[demean].corr(tg_ts[demean])
-                corr_cmems_eur = cmems_eur[demean].corr(tg_ts[demean])
-                corr_cmems_glo = cmems_glo[demean].corr(tg_ts[demean])
-                corr_duacs_swot_l4 = duacs_swot_l4[demean].corr(tg_ts[demean])
-
-                # Calculate RMSD between cmems and tg
-                rmsd_swot_l3 = np.sqrt(np.mean((swot_l3[demean] - tg_ts[demean]) ** 2))
-                rmsd_cmems_eur = np.sqrt(np.mean((cmems_eur[demean] - tg_ts[demean]) ** 2))
-                rmsd_cmems_glo = np.sqrt(np.mean((cmems_glo[demean] - tg_ts[demean]) ** 2))
-                rmsd_duacs_swot_l4 = np.sqrt(np.mean((duacs_swot_l4[demean] - tg_ts[demean]) ** 2))
-
-                # Calculate variances of products and tg
-                var_swot_l3 = swot_l3[demean].var()
-                var_cmems_eur = cmems_eur[demean].var()
-                var_cmems_glo = cmems_glo[demean].var()
-                var_duacs_swot_l4 = duacs_swot_l4[demean].var()
-                var_tg = tg_ts[demean].var()
-
-                # Calculate the variance of the difference between cmems and tg
-                var_diff_swot_l3 = (swot_l3[demean] - tg_ts[demean]).var()
-                var_diff_cmems_eur = (cmems_eur[demean] - tg_ts[demean]).var()
-                var_diff_cmems_glo = (cmems_glo[demean] - tg_ts[demean]).var()
-                var_diff_duacs_swot_l4 = (duacs_swot_l4[demean] - tg_ts[demean]).var()
-
-                # Append the results to the lists
-                rmsds_swot_l3.append(rmsd_swot_l3)
-                rmsds_cmems_eur.append(rmsd_cmems_eur)
-                rmsds_cmems_glo.append(rmsd_cmems_glo)
-                rmsds_duacs_swot_l4.append(rmsd_duacs_swot_l4)
-
-                correlations_swot_l3.append(corr_swot_l3)
-                correlations_cmems_eur.append(corr_cmems_eur)
-                correlations_cmems_glo.append(corr_cmems_glo)
-                correlations_duacs_swot_l4.append(corr_duacs_swot_l4)
-
-                variances_tg.append(var_tg)
-                variances_swot_l3.append(var_swot_l3)
-                variances_cmems_eur.append(var_cmems_eur)
-                variances_cmems_glo.append(var_cmems_glo)
-                variances_duacs_swot_l4.append(var_duacs_swot_l4)
-
-                variances_diff_swot_l3.append(var_diff_swot_l3)
-                variances_diff_cmems_eur.append(var_diff_cmems_eur)
-                variances_diff_cmems_glo.append(var_diff_cmems_glo)
-                variances_diff_duacs_swot_l4.append(var_diff_duacs_swot_l4)
-
-                # Num days used
-                days_used_per_gauge_swot_l3.append(len(swot_l3))
-                days_used_per_gauge_cmems_eur.append(len(cmems_eur))
-                days_used_per_gauge_cmems_glo.append(len(cmems_glo))
-                days_used_per_gauge_duacs_swot_l4.append(len(duacs_swot_l4))
-
-                # Average min distances
-                min_distances_swot_l3.append(swot_l3['min_distance_swot_l3'].min())
-                min_distances_cmems_eur.append(cmems_eur['min_distance_cmems_eur'].min())
-                min_distances_cmems_glo.append(cmems_glo['min_distance_cmems_glo'].min())
-                min_distances_duacs_swot_l4.append(duacs_swot_l4['min_distance_duacs_swot_l4'].min())
-
-                # Number of values used for the average
-                n_val_swot_l3.append(swot_l3['n_val_swot_l3'].mean())
-                n_val_cmems_eur.append(cmems_eur['n_val_cmems_eur'].mean())
-                n_val_cmems_glo.append(cmems_glo['n_val_cmems_glo'].mean())
-                n_val_duacs_swot_l4.append(duacs_swot_l4['n_val_duacs_swot_l4'].mean())
-
-                # PLOTTING TIME SERIES
-                # plt.figure(figsize=(10, 6))
-                # plt.plot(alt_ts['time'], cmems_ts[demean], label=f'{product_name}',  linewidth=3, c='b')
-                # plt.plot(cmems_ts['time'], cmems_ts['demean'], label=f'{product_name} unfiltered', linestyle='--', c='b', alpha=0.5)
-
-                # # plt.scatter(cmems_ts['time'], cmems_ts[demean])
-                # plt.plot(tg_ts['time'], tg_ts[demean], label='TGs',  linewidth=3, c='g')
-                # plt.plot(tg_ts['time'], tg_ts['demean'], label='TGs unfiltered', linestyle='--', c='g', alpha=0.5)
-
-                # # plt.scatter(tg_ts['time'], tg_ts[demean])
-                # plt.title(f'{sorted_names[station]}, {rad}km_radius, {day_window}dLoess, {product_name}')
-                # plt.legend()
-                # plt.xticks(rotation=20)
-                # plt.yticks(np.arange(-15, 18, 3))
-
-                # # plt.xlabel('time')
-                # plt.grid(True, alpha=0.2)
-                # plt.ylabel('SSHA (cm)')
-                # plt.tick_params(axis='both', which='major', labelsize=11)
-                # plt.text(0.95, 0.1, f'RMSD: {rmsd:.2f} cm', fontsize=12, color='black', 
-                #          transform=plt.gca().transAxes, ha='right', bbox=dict(facecolor='white', alpha=0.5))
-                # plt.text(0.95, 0.2, f'CORRELATION: {correlation:.2f}', fontsize=12, color='black', 
-                #          transform=plt.gca().transAxes, ha='right', bbox=dict(facecolor='white', alpha=0.5))
-
-
-                # plt.savefig(f'{plot_path}{sorted_names[station]}_{rad}km_{day_window}dLoess_{product_name}.png')
-
-
-                # MAP PLOT OF CMEMS LOCATIONS OBTAINED FROM EACH GAUGE!
-                # fig, ax = plt.subplots(figsize=(10.5, 11), subplot_kw=dict(projection=ccrs.PlateCarree()))
-
-                # # Set the extent to focus on the defined lon-lat box
-                # ax.set_extent(lolabox, crs=ccrs.PlateCarree())
-
-                # # Add scatter plot for specific locations
-                # ax.scatter(tg_ts['longitude'][0], tg_ts['latitude'][0], c='black', marker='o', s=50, transform=ccrs.Geodetic(), label='Tide Gauge')
-                # ax.scatter(cmems_ts['cmems_lon_within_radius'][0], cmems_ts['cmems_lat_within_radius'][0], c='blue', marker='o', s=50, transform=ccrs.Geodetic(), label='CMEMS data')
-
-                # # Add coastlines and gridlines
-                # ax.coastlines()
-                # ax.gridlines(draw_labels=True)
-
-                # ax.legend(loc="upper left")
-                # ax.title(f'Station {sorted_names[station]}')
-
-        except (KeyError, ValueError):  # Handle cases where station might not exist in df or time has NaNs
-            # Print message or log the issue and save the station index for dropping the empty stations
-            print(f'empty station {station}')
-
-            # empty_stations.append(station)
-            # print(f"Station {sorted_names[station]} not found in CMEMS data or time series has NaNs")
-            continue  # Skip to the next iteration
+    # Apply a LOESS filter to all the time series (missing days are gaps of the filter window)
+    frac_loess = 1 / day_window
+    ssha_filtered = loess.loess_smooth_batch(ssha_demean.reshape(-1, len(calendar)), frac_loess).reshape(ssha.shape)
+
+    # Define the values used for the comparison according if the data is filtered or not
+    # ssha_compared = ssha_demean
+    ssha_compared = ssha_filtered
+
+    # Statistics of each product against the TGs for all the stations (reductions along the days, skipping
+    # the days where the filter has no value)
+    compared = valid & ~np.isnan(ssha_compared[1:]) & ~np.isnan(ssha_compared[0])
+    product_stats = stats.dense_stats(ssha_compared[1:], ssha_compared[0], compared)
+
+    # Stations without data in all the products
+    n_days = valid.sum(axis=1)
+    empty_stations = list(np.flatnonzero(n_days == 0))
+    for station in empty_stations:
+        print(f"No CMEMS data found for station {sorted_names[station]}")
+    present = n_days > 0
+
+    # Correlation between products and tg
+    correlations_swot_l3 = product_stats['correlation'][0, present].tolist()
+    correlations_cmems_eur = product_stats['correlation'][1, present].tolist()
+    correlations_cmems_glo = product_stats['correlation'][2, present].tolist()
+    correlations_duacs_swot_l4 = product_stats['correlation'][3, present].tolist()
+
+    # RMSD between products and tg
+    rmsds_swot_l3 = product_stats['rmsd'][0, present].tolist()
+    rmsds_cmems_eur = product_stats['rmsd'][1, present].tolist()
+    rmsds_cmems_glo = product_stats['rmsd'][2, present].tolist()
+    rmsds_duacs_swot_l4 = product_stats['rmsd'][3, present].tolist()
+
+    # Variances of products and tg
+    variances_tg = product_stats['var_reference'][0, present].tolist()
+    variances_swot_l3 = product_stats['var'][0, present].tolist()
+    variances_cmems_eur = product_stats['var'][1, present].tolist()
+    variances_cmems_glo = product_stats['var'][2, present].tolist()
+    variances_duacs_swot_l4 = product_stats['var'][3, present].tolist()
+
+    # Variance of the difference between products and tg
+    variances_diff_swot_l3 = product_stats['var_diff'][0, present].tolist()
+    variances_diff_cmems_eur = product_stats['var_diff'][1, present].tolist()
+    variances_diff_cmems_glo = product_stats['var_diff'][2, present].tolist()
+    variances_diff_duacs_swot_l4 = product_stats['var_diff'][3, present].tolist()
+
+    # Num days used
+    days_used_per_gauge_swot_l3 = n_days[present].tolist()
+    days_used_per_gauge_cmems_eur = n_days[present].tolist()
+    days_used_per_gauge_cmems_glo = n_days[present].tolist()
+    days_used_per_gauge_duacs_swot_l4 = n_days[present].tolist()
+
+    # Min distances and number of values used for the average over the days used
+    station_min = np.min(np.where(valid, min_distance, np.inf), axis=2)
+    with np.errstate(invalid='ignore'):
+        station_mean = np.sum(np.where(valid, n_val, 0), axis=2, dtype=np.float64) / n_days
+
+    min_distances_swot_l3 = station_min[0, present].tolist()
+    min_distances_cmems_eur = station_min[1, present].tolist()
+    min_distances_cmems_glo = station_min[2, present].tolist()
+    min_distances_duacs_swot_l4 = station_min[3, present].tolist()
+
+    n_val_swot_l3 = station_mean[0, present].tolist()
+    n_val_cmems_eur = station_mean[1, present].tolist()
+    n_val_cmems_glo = station_mean[2, present].tolist()
+    n_val_duacs_swot_l4 = station_mean[3, present].tolist()
 
 
     # n_val = []  # List to store average number of altimetry values per station
@@ -772,10 +620,10 @@ for rad in dmedia:
                                 'correlation_cmems_glo': np.mean(correlations_cmems_glo),
                                 'correlation_duacs_swot_l4': np.mean(correlations_duacs_swot_l4),
 
-                                'var_diff_swot_l3': np.mean(var_diff_swot_l3),
-                                'var_diff_cmems_eur': np.mean(var_diff_cmems_eur),
-                                'var_diff_cmems_glo': np.mean(var_diff_cmems_glo),
-                                'var_diff_duacs_swot_l4': np.mean(var_diff_duacs_swot_l4),
+                                'var_diff_swot_l3': np.mean(variances_diff_swot_l3),
+                                'var_diff_cmems_eur': np.mean(variances_diff_cmems_eur),
+                                'var_diff_cmems_glo': np.mean(variances_diff_cmems_glo),
+                                'var_diff_duacs_swot_l4': np.mean(variances_diff_duacs_swot_l4),
 
                                 'min_distance_swot': np.mean(min_distances_swot_l3),
                                 'min_distance_cmems_eur': np.mean(min_distances_cmems_eur),
@@ -0,0 +1,156 @@
+import os
+import hashlib
+import numpy as np
+import scipy.sparse as sp
+import xarray as xr
+import colocation as coloc
+
+# Weight matrices already loaded in this session (key: grid hash)
+_weights_loaded = {}
+
+
+def grid_hash(lon, lat, gauge_lon, gauge_lat, rad):
+    """
+    Hash identifying a product grid together with the tide gauge locations and the radius.
+    """
+    sha = hashlib.sha1()
+    for values in (lon, lat, gauge_lon, gauge_lat, [rad]):
+        sha.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    return sha.hexdigest()
+
+
+def build_weight_matrix(lon, lat, gauge_lon, gauge_lat, rad):
+    """
+    Build the sparse (gauges x grid cells) matrix selecting the cells of a regular lon/lat grid
+    within rad km of each tide gauge. Cells are ordered as the flattened (latitude, longitude) field.
+    """
+    lon_grid, lat_grid = np.meshgrid(lon, lat)
+    lon_grid = lon_grid.ravel()
+    lat_grid = lat_grid.ravel()
+
+    # Cells within the radius of every gauge with the spatial index of the grid
+    grid_index = coloc.build_pixel_index(lon_grid, lat_grid)
+    in_radius, distances = coloc.query_radius(grid_index, lon_grid, lat_grid, gauge_lon, gauge_lat, rad)
+
+    n_val = np.array([cells.size for cells in in_radius])
+    min_distance = np.array([dist.min() if dist.size > 0 else np.nan for dist in distances])
+
+    rows = np.repeat(np.arange(len(in_radius)), n_val)
+    cols = np.concatenate(in_radius) if len(in_radius) > 0 else np.array([], dtype=np.intp)
+    matrix = sp.csr_matrix((np.ones(cols.size), (rows, cols)), shape=(len(in_radius), lon_grid.size))
+
+    return {'matrix': matrix,
+            'n_val': n_val,  # Number of cells within the radius (including land cells)
+            'min_distance': min_distance,  # Closest cell within the radius
+            'grid_shape': (len(lat), len(lon))}
+
+
+def load_weight_matrix(lon, lat, gauge_lon, gauge_lat, rad, cache_path):
+    """
+    Return the weight matrix of a product grid, building it only the first time and caching it on disk
+    in cache_path (keyed by the grid hash).
+    """
+    key = grid_hash(lon, lat, gauge_lon, gauge_lat, rad)
+    if key in _weights_loaded:
+        return _weights_loaded[key]
+
+    cache_file = os.path.join(cache_path, f'weights_{key}.npz')
+    if os.path.exists(cache_file):
+        data = np.load(cache_file)
+        weights = {'matrix': sp.csr_matrix((data['data'], data['indices'], data['indptr']), shape=tuple(data['shape'])),
+                   'n_val': data['n_val'],
+                   'min_distance': data['min_distance'],
+                   'grid_shape': tuple(data['grid_shape'])}
+    else:
+        weights = build_weight_matrix(lon, lat, gauge_lon, gauge_lat, rad)
+        os.makedirs(cache_path, exist_ok=True)
+        matrix = weights['matrix']
+        # Written to a temporary file first (several processes can build the same matrix at the same time)
+        tmp_file = os.path.join(cache_path, f'weights_{key}.{os.getpid()}.tmp.npz')
+        np.savez(tmp_file, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr, shape=matrix.shape,
+                 n_val=weights['n_val'], min_distance=weights['min_distance'], grid_shape=weights['grid_shape'])
+        os.replace(tmp_file, cache_file)
+
+    _weights_loaded[key] = weights
+    return weights
+
+
+def weighted_means(weights, values):
+    """
+    Average the valid (non-NaN) cells of values (grid cells x n) within the radius of every gauge.
+    Returns the mean values and the number of valid cells (gauges x n).
+    """
+    valid = ~np.isnan(values)
+
+    # Sum of the valid values and number of valid values with sparse products
+    sums = weights['matrix'] @ np.where(valid, values, 0)
+    counts = weights['matrix'] @ valid.astype(np.float32)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / counts
+
+    return mean, counts.astype(int)
+
+
+def apply_weights(weights, sla):
+    """
+    Average the valid cells of a daily field within the radius of every gauge.
+    Returns the mean value and the number of valid cells for each gauge.
+    """
+    mean, counts = weighted_means(weights, np.ravel(sla)[:, np.newaxis])
+    return mean[:, 0], counts[:, 0]
+
+
+def load_time_cube(file_paths, lolabox, memmap_path=None):
+    """
+    Stack the lolabox window of the sla field of all the daily files into a (time, lat, lon) float32 cube.
+    If memmap_path is given the cube is stored in a memory-mapped .npy file instead of in memory.
+    """
+    # Grid of the window from the first file (same grid in every daily file of a product)
+    with xr.open_dataset(file_paths[0]) as ds:
+        ds = ds.sel(latitude=slice(lolabox[2], lolabox[3]), longitude=slice(lolabox[0], lolabox[1]))
+        lat = ds['latitude'].values
+        lon = ds['longitude'].values
+
+    shape = (len(file_paths), len(lat), len(lon))
+    if memmap_path is None:
+        sla = np.empty(shape, dtype=np.float32)
+    else:
+        sla = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=np.float32, shape=shape)
+    time = np.empty(len(file_paths), dtype='datetime64[ns]')
+
+    for t_idx, file_path in enumerate(file_paths):
+        with xr.open_dataset(file_path) as ds:
+            ds = ds.sel(latitude=slice(lolabox[2], lolabox[3]), longitude=slice(lolabox[0], lolabox[1]))
+            if ds['sla'].shape[1:] != shape[1:]:
+                raise ValueError(f'Grid of {file_path} differs from the grid of {file_paths[0]}')
+            time[t_idx] = ds['time'].values[0]
+            sla[t_idx] = ds['sla'].values[0]
+
+    return {'time': time, 'latitude': lat, 'longitude': lon, 'sla': sla}
+
+
+def extract_gauge_series(weights, sla_cube, chunk_size=366):
+    """
+    Obtain the time series (gauges x time) of the mean SSH within the radius of every gauge from a
+    (time, lat, lon) cube, processing chunk_size days at a time to bound the memory used.
+    """
+    n_time = sla_cube.shape[0]
+    mean = np.empty((weights['matrix'].shape[0], n_time))
+    counts = np.empty((weights['matrix'].shape[0], n_time), dtype=int)
+
+    for start in range(0, n_time, chunk_size):
+        end = min(start + chunk_size, n_time)
+        # Grid cells x days of the chunk
+        values = np.asarray(sla_cube[start:end]).reshape(end - start, -1).T
+        mean[:, start:end], counts[:, start:end] = weighted_means(weights, values)
+
+    return mean, counts
+
+
+def cells_within_radius(weights, gauge_idx):
+    """
+    Latitude and longitude indices of the grid cells within the radius of a gauge.
+    """
+    matrix = weights['matrix']
+    cells = matrix.indices[matrix.indptr[gauge_idx]:matrix.indptr[gauge_idx + 1]]
+    return np.unravel_index(cells, weights['grid_shape'])
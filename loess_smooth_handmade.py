@@ -1,4 +1,6 @@
 import numpy as np
+from functools import lru_cache
+from scipy.ndimage import correlate1d
 
 def loess_smooth_handmade(data, fc, step=1, t=np.nan, t_final=np.nan):
     '''
@@ -12,7 +14,9 @@ def loess_smooth_handmade(data, fc, step=1, t=np.nan, t_final=np.nan):
     %       - fc        : cut frequency
     % OPTIONS:
     %       - step      : step between two samples  (if regular)
-    %       - t         : coordinates of input data (if not regular)
+    %       - t         : coordinates of input data (if not regular), datetime64 times
+    %                     are used in days (fc in 1/days). Evenly spaced coordinates
+    %                     are filtered as regular samples (convolution kernel)
     %       - t_final   : coordinates of output data (default is t)
     %
     % OUT:
@@ -22,6 +26,16 @@ def loess_smooth_handmade(data, fc, step=1, t=np.nan, t_final=np.nan):
     %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
     '''
   
+    # Times in days
+    t = _to_days(t)
+    t_final = _to_days(t_final)
+
+    # Regular samples (no coordinates, or evenly spaced ones) filtered on the input coordinates: same
+    # neighbourhood for all the points without gaps
+    regular_step = step if np.all(np.isnan(t)) else _regular_step(t)
+    regular = regular_step is not None and np.all(np.isnan(t_final))
+    data_regular = data
+
     if np.all(np.isnan(t)):
         t = np.arange(0, len(data)*step, step)
     
@@ -29,8 +43,8 @@ def loess_smooth_handmade(data, fc, step=1, t=np.nan, t_final=np.nan):
     if np.all(np.isnan(t_final)):
         t_final = t
   
-    # Remove NaNs
-    id_nonan = np.where(~np.isnan(data))
+    # Remove NaNs (and missing times)
+    id_nonan = np.where(~np.isnan(data) & ~np.isnan(t))
     t = t[id_nonan]
     data = data[id_nonan]
   
@@ -41,27 +55,216 @@ def loess_smooth_handmade(data, fc, step=1, t=np.nan, t_final=np.nan):
     data_smooth = np.ones(t_final.shape)*np.nan
  
     # Only compute for the points where t_final is in the range of t
-    sx = np.where(np.logical_and(t_final >= t.min(), t_final <= t.max()))
- 
-    # Loop on final coordinates
-    for i in sx[0]:
-        # Compute distance between current point and the rest
-        dn_tot = np.abs(t-t_final[i])/tau
-        # Select neightboring points
-        idx_weights = np.where(dn_tot<1)
-        n_pts = len(idx_weights[0])
-    
-        # Only try to adjust the polynomial if there are at least 4 neighbors
-        if n_pts > 3:
-            dn = dn_tot[idx_weights]
-            w = 1-dn*dn*dn
-            weights = w**3
-            # adjust a polynomial to these data points
-            X = np.stack((np.ones((n_pts,)),t[idx_weights],t[idx_weights]**2)).T
-            W = np.diag(weights)
-            B = np.linalg.lstsq(np.dot(W,X),np.dot(W,data[idx_weights]))
-            coeff = B[0]
-            # Smoothed value is the polynomial value at this location
-            data_smooth[i] = coeff[0]+coeff[1]*t_final[i]+coeff[2]*t_final[i]**2
-        
-    return data_smooth
\ No newline at end of file
+    in_range = np.logical_and(t_final >= t.min(), t_final <= t.max())
+
+    # Points whose whole window is in the record without gaps are a convolution with a fixed kernel
+    if regular:
+        interior, values = _loess_convolution(data_regular, fc, regular_step)
+        data_smooth[interior] = values[interior]
+        in_range &= ~interior
+
+    sx = np.where(in_range)
+
+    # Sort the input coordinates so the neighbours of each point are a contiguous window
+    order = np.argsort(t, kind='stable')
+    t = t[order]
+    data = data[order]
+
+    # Compute all the points at once
+    t_out = t_final[sx]
+    lo, hi = _window_bounds(t, t_out, tau)
+    data_smooth[sx] = _loess_blocks(t, data, t_out, lo, hi, tau)
+
+    return data_smooth
+
+
+def loess_smooth_batch(data, fc, step=1):
+    '''
+    Loess filtering of several regularly sampled time series at once (same filter as loess_smooth_handmade
+    applied to each serie, sharing the kernel and the weighted fits of all the series)
+
+    IN:
+          - data      : 2D array (series x time), NaN where a serie has no data
+          - fc        : cut frequency
+    OPTIONS:
+          - step      : step between two samples
+
+    OUT:
+          - data_smooth : filtered data (series x time)
+    '''
+    data = np.atleast_2d(np.asarray(data, dtype=float))
+    n_series, n_times = data.shape
+    tau = 1/fc
+    t = np.arange(0, n_times*step, step)[:n_times]
+
+    # Points whose whole window is in the serie without gaps are a convolution with a fixed kernel
+    interior, data_smooth = _loess_convolution(data, fc, step)
+    data_smooth[~interior] = np.nan
+
+    # Valid samples of all the series one after the other (serie segments [start, end))
+    valid = ~np.isnan(data)
+    row, col = np.nonzero(valid)
+    t_valid = t[col]
+    data_valid = data[row, col]
+    end = np.cumsum(valid.sum(axis=1))
+    start = end - valid.sum(axis=1)
+
+    # Remaining points in the range of the valid samples of their serie
+    has_data = end > start
+    t_min = np.full(n_series, np.inf)
+    t_max = np.full(n_series, -np.inf)
+    t_min[has_data] = t_valid[start[has_data]]
+    t_max[has_data] = t_valid[end[has_data] - 1]
+    in_range = (t >= t_min[:, np.newaxis]) & (t <= t_max[:, np.newaxis]) & ~interior
+    row_out, col_out = np.nonzero(in_range)
+    if row_out.size == 0:
+        return data_smooth
+
+    # Windows searched on the coordinates shifted by serie (so the series do not overlap) and limited
+    # to the samples of the serie of each point
+    shift = (t[-1] - t[0]) + 2*tau + 1
+    t_out = t[col_out]
+    lo, hi = _window_bounds(t_valid + row*shift, t_out + row_out*shift, tau)
+    lo = np.maximum(lo, start[row_out])
+    hi = np.minimum(hi, end[row_out])
+
+    data_smooth[row_out, col_out] = _loess_blocks(t_valid, data_valid, t_out, lo, hi, tau)
+
+    return data_smooth
+
+
+# Function for converting datetime64 coordinates to days (other coordinates are returned unchanged)
+def _to_days(t):
+    t = np.asarray(t)
+    if np.issubdtype(t.dtype, np.datetime64):
+        return (t - np.datetime64(0, 'ns')) / np.timedelta64(1, 'D')
+    return t
+
+
+# Function for obtaining the step of evenly spaced coordinates (None if they are not evenly spaced)
+def _regular_step(t):
+    t = np.atleast_1d(t)
+    if t.size < 2 or np.any(np.isnan(t)):
+        return None
+    step = (t[-1] - t[0]) / (t.size - 1)
+    if step <= 0 or not np.allclose(np.diff(t), step, rtol=1e-9, atol=0):
+        return None
+    return step
+
+
+# Maximum number of (point, neighbour) pairs computed at once
+MAX_WINDOW_ELEMENTS = 2**22
+
+
+@lru_cache(maxsize=32)
+def _loess_kernel(fc, step):
+    """
+    Weights of the neighbours (offsets -m*step ... m*step) giving the LOESS value of a regularly sampled point
+    with all its neighbours, or None if there are less than 4 neighbours. Computed once per (fc, step).
+    """
+    tau = 1/fc
+    m = int(np.ceil(tau/step))
+    offsets = np.arange(-m, m + 1)*step
+    offsets = offsets[np.abs(offsets)/tau < 1]
+    if offsets.size <= 3:
+        return None
+
+    # Value at the centre of the weighted polynomial fit, as a linear combination of the data
+    w2 = ((1 - (np.abs(offsets)/tau)**3)**3)**2
+    u = offsets/tau
+    X = np.stack((np.ones(u.shape), u, u**2), axis=1)
+    kernel = np.linalg.solve(X.T @ (w2[:, np.newaxis]*X), (w2[:, np.newaxis]*X).T)[0]
+    kernel.flags.writeable = False
+    return kernel
+
+
+def _loess_blocks(t, data, t_final, lo, hi, tau):
+    """
+    LOESS at the points t_final from the windows [lo, hi) of t, by blocks of points to bound the memory.
+    """
+    block = max(1, MAX_WINDOW_ELEMENTS // max(1, (hi - lo).max(initial=1)))
+    smooth = np.empty(t_final.shape)
+    for start in range(0, t_final.size, block):
+        end = start + block
+        smooth[start:end] = _loess_points(t, data, t_final[start:end], lo[start:end], hi[start:end], tau)
+    return smooth
+
+
+def _loess_convolution(data, fc, step):
+    """
+    LOESS of regularly sampled data computed as a convolution with the kernel of (fc, step).
+    Returns the mask of the points where it is exact (whole window inside the record and without NaNs)
+    and the convolved values. Several series can be given as rows of a 2D array (correlate1d along the
+    time axis, np.correlate only takes 1D arrays).
+    """
+    values = np.ones(data.shape)*np.nan
+    interior = np.zeros(data.shape, dtype=bool)
+
+    kernel = _loess_kernel(fc, step)
+    n_times = data.shape[-1]
+    if kernel is None or n_times < kernel.size:
+        return interior, values
+    m = kernel.size // 2
+
+    # Number of NaNs in the window of each point
+    valid = ~np.isnan(data)
+    n_gaps = np.concatenate((np.zeros(data.shape[:-1] + (1,), dtype=int), np.cumsum(~valid, axis=-1)), axis=-1)
+    centre = np.arange(m, n_times - m)
+    interior[..., centre] = n_gaps[..., centre + m + 1] == n_gaps[..., centre - m]
+
+    convolved = correlate1d(np.where(valid, data, 0), kernel, axis=-1, mode='constant')
+    values[..., centre] = convolved[..., centre]
+    return interior, values
+
+
+def _window_bounds(t, t_final, tau):
+    """
+    First and last (excluded) indices of the sorted coordinates t within tau of each t_final
+    (one more sample on each side, the exact selection is done with the distances).
+    """
+    lo = np.searchsorted(t, t_final - tau, side='left') - 1
+    hi = np.searchsorted(t, t_final + tau, side='right') + 1
+    return np.clip(lo, 0, t.size), np.clip(hi, 0, t.size)
+
+
+def _loess_points(t, data, t_final, lo, hi, tau):
+    """
+    Degree 2 tricube LOESS at the points t_final from the windows [lo, hi) of the sorted t: the weighted
+    normal equations of every point are built from its window and the 3x3 systems are solved at once.
+    Points with less than 4 neighbours are NaN.
+    """
+    # Indices of the neighbours of each point (rows padded to the largest window)
+    n_win = max(1, (hi - lo).max(initial=1))
+    idx = lo[:, np.newaxis] + np.arange(n_win)
+    in_window = idx < hi[:, np.newaxis]
+    idx = np.minimum(idx, t.size - 1)
+
+    # Distance between each point and its neighbours (in units of the filter period)
+    dn = np.abs(t[idx] - t_final[:, np.newaxis])/tau
+    neighbours = in_window & (dn < 1)
+    n_pts = neighbours.sum(axis=1)
+
+    # Tricube weights (squared: the polynomial is adjusted to the weighted data W*X, W*data)
+    w = np.where(neighbours, (1 - np.minimum(dn, 1)**3)**3, 0)
+    w2 = w*w
+
+    # Normal equations of the polynomial centred at each point (same fit, better conditioned)
+    u = (t[idx] - t_final[:, np.newaxis])/tau
+    moments = np.stack([np.sum(w2*u**k, axis=1) for k in range(5)], axis=-1)
+    rhs = np.stack([np.sum(w2*u**k*data[idx], axis=1) for k in range(3)], axis=-1)
+
+    smooth = np.ones(t_final.shape)*np.nan
+
+    # Only try to adjust the polynomial if there are at least 4 neighbors
+    fit = n_pts > 3
+    if np.any(fit):
+        A = moments[fit][:, [[0, 1, 2], [1, 2, 3], [2, 3, 4]]]
+        try:
+            coeff = np.linalg.solve(A, rhs[fit][:, :, np.newaxis])[:, :, 0]
+        except np.linalg.LinAlgError:
+            # Less than 3 different coordinates in a window (least squares solution as lstsq)
+            coeff = (np.linalg.pinv(A) @ rhs[fit][:, :, np.newaxis])[:, :, 0]
+        # Smoothed value is the polynomial value at this location (constant term of the centred polynomial)
+        smooth[fit] = coeff[:, 0]
+
+    return smooth
@@ -0,0 +1,89 @@
+import os
+import re
+import time
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Functions and arguments shared by all the files of a worker (set once per worker)
+_worker = {}
+
+
+# Function for sorting file names by the date (and time) in the name (YYYYMMDD or YYYYMMDDTHHMMSS)
+def sort_by_time(filenames):
+    def time_key(filename):
+        match = re.search(r'(\d{8})(T\d{6})?', filename)
+        return (match.group(0) if match else '', filename)
+    return sorted(filenames, key=time_key)
+
+
+def prefetch(load, filenames, depth=4, n_threads=2):
+    """
+    Yield (filename, load(filename)) in the order of filenames while n_threads background threads read up to
+    depth files ahead (bounded queue), so reading the next files overlaps with processing the current one.
+    The occupancy of the queue (files already read when the next one is requested) is printed at the end
+    for sizing depth: an empty queue means the processing waits for the reading.
+    """
+    occupancy = []
+    wait_time = 0
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        queue = deque()
+        next_file = 0
+
+        while queue or next_file < len(filenames):
+            # Fill the queue up to depth files being read or already read
+            while len(queue) < depth and next_file < len(filenames):
+                queue.append((filenames[next_file], pool.submit(load, filenames[next_file])))
+                next_file += 1
+
+            occupancy.append(sum(future.done() for _, future in queue))
+
+            filename, future = queue.popleft()
+            start = time.perf_counter()
+            data = future.result()
+            wait_time += time.perf_counter() - start
+
+            yield filename, data
+
+    if occupancy:
+        print(f'Prefetch queue: mean occupancy {sum(occupancy) / len(occupancy):.1f} of {depth} files, '
+              f'empty for {occupancy.count(0)} of {len(occupancy)} files ({wait_time:.1f} s waiting for reading)')
+
+
+def _init_worker(extract, load, shared):
+    _worker['extract'] = extract
+    _worker['load'] = load
+    _worker['shared'] = shared
+
+
+def _extract(filename):
+    if _worker['load'] is None:
+        return _worker['extract'](filename, **_worker['shared'])
+    return _worker['extract'](filename, _worker['load'](filename), **_worker['shared'])
+
+
+def extract_files(extract, filenames, n_workers=None, load=None, prefetch_depth=4, **shared):
+    """
+    Apply extract(filename, **shared) to every file with a pool of n_workers processes (all the CPUs if None).
+    The shared arguments (gauges, radius...) are given once to each worker instead of with every file, and the
+    workers are forked so the extract function can be defined in the script itself.
+    If load is given, load(filename) reads each file and extract(filename, data, **shared) processes it; when the
+    files are extracted sequentially the reading is pipelined with prefetch (prefetch_depth files ahead).
+    Returns the results in the order of filenames (use sort_by_time for time order). With n_workers=1, or
+    where processes cannot be forked, the files are extracted sequentially.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    n_workers = min(n_workers, len(filenames))
+
+    if n_workers <= 1 or 'fork' not in mp.get_all_start_methods():
+        if load is None:
+            return [extract(filename, **shared) for filename in filenames]
+        return [extract(filename, data, **shared) for filename, data in prefetch(load, filenames, prefetch_depth)]
+
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context('fork'),
+                             initializer=_init_worker, initargs=(extract, load, shared)) as pool:
+        # Several files per task to reduce the communication with the workers
+        chunksize = max(1, len(filenames) // (4 * n_workers))
+        return list(pool.map(_extract, filenames, chunksize=chunksize))
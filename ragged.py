@@ -0,0 +1,101 @@
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+def from_arrays(arrays, dtype=np.float32):
+    """
+    Ragged array (one row of variable length per record) from a list of arrays (None: empty row), stored as
+    the flat values of all the rows and their offsets: row i is values[offsets[i]:offsets[i + 1]].
+    """
+    lengths = np.array([0 if a is None else np.size(a) for a in arrays], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    values = [np.ravel(a) for a in arrays if a is not None and np.size(a) > 0]
+    values = np.concatenate(values).astype(dtype, copy=False) if values else np.empty(0, dtype=dtype)
+    return {'values': values, 'offsets': offsets}
+
+
+def from_matrix(matrix, dtype=np.float32):
+    """
+    Ragged array with the rows of a 2D array (all the rows with the same length, e.g. the days of a time cube).
+    """
+    matrix = np.asarray(matrix)
+    return {'values': np.ravel(matrix).astype(dtype, copy=False),
+            'offsets': np.arange(matrix.shape[0] + 1, dtype=np.int64) * matrix.shape[1]}
+
+
+# Function for obtaining a ragged array of n empty rows
+def empty(n_rows, dtype=np.float32):
+    return {'values': np.empty(0, dtype=dtype), 'offsets': np.zeros(n_rows + 1, dtype=np.int64)}
+
+
+# Function for obtaining the number of rows of a ragged array
+def n_rows(ragged):
+    return ragged['offsets'].size - 1
+
+
+# Function for obtaining the values of one row of a ragged array (view of the flat values)
+def row(ragged, i):
+    return ragged['values'][ragged['offsets'][i]:ragged['offsets'][i + 1]]
+
+
+def concatenate(raggeds):
+    """
+    Ragged array with the rows of several ragged arrays one after the other (e.g. the records of all the files).
+    """
+    if not raggeds:
+        return empty(0)
+    values = np.concatenate([r['values'] for r in raggeds])
+    starts = np.cumsum([0] + [r['values'].size for r in raggeds[:-1]])
+    offsets = np.concatenate([[0]] + [r['offsets'][1:] + start for r, start in zip(raggeds, starts)])
+    return {'values': values, 'offsets': offsets}
+
+
+def take(ragged, rows):
+    """
+    Ragged array with the given rows (e.g. the rows kept in the table of scalars after dropna).
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = ragged['offsets'][rows]
+    lengths = ragged['offsets'][rows + 1] - starts
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+    # Index of every value of the selected rows in the flat values
+    index = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+    return {'values': ragged['values'][index], 'offsets': offsets}
+
+
+def to_arrow(ragged):
+    """
+    Arrow list array of a ragged array (same flat values and offsets, no copy of the values).
+    """
+    return pa.LargeListArray.from_arrays(pa.array(ragged['offsets'], type=pa.int64()), pa.array(ragged['values']))
+
+
+def from_arrow(array):
+    """
+    Ragged array of an Arrow list array (without null rows).
+    """
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    offsets = np.asarray(array.offsets, dtype=np.int64)
+    values = np.asarray(array.values)[offsets[0]:offsets[-1]]
+    return {'values': values, 'offsets': offsets - offsets[0]}
+
+
+def save_parquet(file_path, raggeds):
+    """
+    Store several ragged arrays with the same rows (dict name: ragged array) as the list columns of a Parquet file.
+    """
+    table = pa.table({name: to_arrow(ragged) for name, ragged in raggeds.items()})
+    pq.write_table(table, f'{file_path}.{os.getpid()}.tmp')
+    os.replace(f'{file_path}.{os.getpid()}.tmp', file_path)
+
+
+def load_parquet(file_path):
+    """
+    Ragged arrays (dict name: ragged array) stored with save_parquet.
+    """
+    table = pq.read_table(file_path)
+    return {name: from_arrow(table[name]) for name in table.column_names}
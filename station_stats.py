@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+
+def _group_moments(codes, x, n_groups):
+    """
+    Number of samples, mean and sum of squared deviations of x in each group (NaNs excluded).
+    """
+    valid = ~np.isnan(x)
+    n = np.bincount(codes[valid], minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(codes[valid], weights=x[valid], minlength=n_groups) / n
+    m2 = np.bincount(codes[valid], weights=(x[valid] - mean[codes[valid]])**2, minlength=n_groups)
+    return n, mean, m2
+
+
+def grouped_stats(table, station_column, stations, reference, products):
+    """
+    Statistics of each product column against the reference column for every station, computed in one
+    grouped pass over the table (no selection of the rows of each station). The correlation, RMSD and variance
+    of the difference use the rows where both values are valid (n pairs), the variances of the product and of
+    the reference use all the valid values of each column, as the pandas methods on the columns of a station.
+    Returns a dict with one DataFrame per product indexed by stations (in the given order). Stations
+    without samples have n = 0 and NaN statistics (variances and correlation need 2 samples, as pandas).
+    """
+    n_groups = len(stations)
+    codes = pd.Categorical(table[station_column], categories=stations).codes
+    in_stations = codes >= 0
+    codes = codes[in_stations]
+    y_all = table[reference].values.astype(np.float64)[in_stations]
+
+    # Variance of the reference over all its values
+    n_y, _, m2_y_all = _group_moments(codes, y_all, n_groups)
+
+    stats = {}
+    for product_n in products:
+        x_all = table[product_n].values.astype(np.float64)[in_stations]
+
+        # Pairs of product and reference values without NaNs
+        pairs = ~np.isnan(x_all) & ~np.isnan(y_all)
+        group = codes[pairs]
+        x = x_all[pairs]
+        y = y_all[pairs]
+
+        n, mean_x, m2_x = _group_moments(group, x, n_groups)
+        _, mean_y, m2_y = _group_moments(group, y, n_groups)
+        _, _, m2_diff = _group_moments(group, x - y, n_groups)
+        cross = np.bincount(group, weights=(x - mean_x[group]) * (y - mean_y[group]), minlength=n_groups)
+        squared_diff = np.bincount(group, weights=(x - y)**2, minlength=n_groups)
+
+        # Variance of the product over all its values
+        n_x, _, m2_x_all = _group_moments(codes, x_all, n_groups)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            several = np.where(n > 1, 1.0, np.nan)
+            stats[product_n] = pd.DataFrame({
+                'correlation': cross / np.sqrt(m2_x * m2_y) * several,
+                'rmsd': np.sqrt(squared_diff / n),
+                'var': m2_x_all / (n_x - 1) * np.where(n_x > 1, 1.0, np.nan),
+                'var_reference': m2_y_all / (n_y - 1) * np.where(n_y > 1, 1.0, np.nan),
+                'var_diff': m2_diff / (n - 1) * several,
+                'n': n}, index=pd.Index(stations, name=station_column))
+
+    return stats
+
+
+def dense_stats(values, reference, valid):
+    """
+    Statistics of series on a dense grid (..., day) against a reference, reduced along the last axis over the
+    valid days (values and reference are broadcast together with the validity mask): correlation, RMSD,
+    variances of the values and of the reference, variance of the difference and number of valid days.
+    Returns a dict of arrays. Series with less than 2 valid days have NaN correlation and variances.
+    """
+    valid = np.broadcast_to(valid, np.broadcast_shapes(np.shape(values), np.shape(reference), np.shape(valid)))
+    x = np.where(valid, values, 0).astype(np.float64)
+    y = np.where(valid, reference, 0).astype(np.float64)
+    n = valid.sum(axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = x.sum(axis=-1) / n
+        mean_y = y.sum(axis=-1) / n
+        dx = np.where(valid, x - mean_x[..., np.newaxis], 0)
+        dy = np.where(valid, y - mean_y[..., np.newaxis], 0)
+        m2_x = np.sum(dx**2, axis=-1)
+        m2_y = np.sum(dy**2, axis=-1)
+        m2_diff = np.sum((dx - dy)**2, axis=-1)
+        several = np.where(n > 1, 1.0, np.nan)
+
+        return {'correlation': np.sum(dx * dy, axis=-1) / np.sqrt(m2_x * m2_y) * several,
+                'rmsd': np.sqrt(np.sum((x - y)**2, axis=-1) / n),
+                'var': m2_x / (n - 1) * several,
+                'var_reference': m2_y / (n - 1) * several,
+                'var_diff': m2_diff / (n - 1) * several,
+                'n': n}
+
+
+def daily_means(codes, days, values, n_stations, n_days):
+    """
+    Mean of the samples of each (station, day) cell for all the stations at once (bincount over the cells),
+    from the integer station codes and day indices of the samples. values is (samples x columns), NaNs and
+    samples outside the grid are ignored. Returns the (station, day, column) means and number of samples.
+    """
+    values = np.asarray(values, dtype=np.float64).reshape(len(codes), -1)
+    codes = np.asarray(codes, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+    inside = (codes >= 0) & (days >= 0) & (days < n_days)
+    cells = codes[inside] * n_days + days[inside]
+
+    means = np.empty((n_stations * n_days, values.shape[1]))
+    counts = np.empty((n_stations * n_days, values.shape[1]), dtype=np.int64)
+    for column in range(values.shape[1]):
+        column_values = values[inside, column]
+        has_value = ~np.isnan(column_values)
+        counts[:, column] = np.bincount(cells[has_value], minlength=n_stations * n_days)
+        sums = np.bincount(cells[has_value], weights=column_values[has_value], minlength=n_stations * n_days)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[:, column] = sums / counts[:, column]
+
+    return means.reshape(n_stations, n_days, -1), counts.reshape(n_stations, n_days, -1)
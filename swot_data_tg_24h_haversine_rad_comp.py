@@ -7,9 +7,18 @@ import math
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 from shapely.geometry import LineString
+from functools import partial  # for fixing the arguments of the reading function
 import cartopy.feature as cfeature
 import statsmodels.api as sm  # for LOWESS filter
 import loess_smooth_handmade as loess  # for LOESS filter
+import colocation as coloc  # for spatial index of SWOT pixels
+import swot_reader  # for reading SWOT L3 files
+import extraction_cache as cache  # for caching the extractions of each file
+import parallel_extraction as parallel  # for extracting the files in parallel
+import tg_store as tgs  # for loading the tide gauge data and counting its samples
+import station_stats as stats  # for the daily means and statistics of all the stations at once
+import ragged as rg  # for the raw values within the radius of the records (flat values and offsets)
+import extraction_records as recs  # for the typed column buffers of the extraction records
 import matplotlib.dates as mdates
 import warnings
 import netCDF4 as nc
@@ -47,9 +56,10 @@ path ='/home/dvega/anaconda3/work/SWOT/'
 # SWOT data -----------------------------------------------------------------------------------------------
 # folder_path = (f'{path}swot_basic_1day/003_016_pass/')  # Define SWOT passes folders
 folder_path = (f'{path}swot_basic_1day/003_016_passv1.0/')  # Define SWOT passes folders
+cache_path = f'{path}cache/'  # Folder for the cached extractions
 
-data_tg = np.load(f'{path}mareografos/TGresiduals1d_2023_European_Seas_SWOT_FSP.npz')
-names_tg = pd.read_csv(f'{path}mareografos/GLOBAL_TGstations_CMEMS_SWOT_FSP_Feb2024', header=None)
+tg_file = f'{path}mareografos/TGresiduals1d_2023_European_Seas_SWOT_FSP.npz'
+tg_names_file = f'{path}mareografos/GLOBAL_TGstations_CMEMS_SWOT_FSP_Feb2024'
 
 # Data of SWOT footprints ----------------------------------------------------------------------------------------
 footprint_folder = f'{path}swot_orbit/'
@@ -69,6 +79,11 @@ x_ac2   = footprint_016.variables['x_ac'][:]  # "Across track distance from nadi
 
 lonnd2  = footprint_016.variables['lon_nadir'][:] 
 latnd2  = footprint_016.variables['lat_nadir'][:]     
+footprint_016.close()
+
+# Footprint grids of each SWOT pass (lon, lat, x_ac) for skipping the tide gauges never covered by the pass
+footprints = {'003': (lonsw1, latsw1, x_ac1),
+              '016': (lonsw2, latsw2, x_ac2)}
 
 color="lightsteelblue"
 alphav=0.1
@@ -95,214 +110,185 @@ names_tg_short = pd.DataFrame({'Stations': ['Baie_Du_Lazaret', 'Bregaillon', 'Ca
 
 # ---------------------------------- READING TIDE GAUGE DATA --------------------------------------------------------
 
-sla = data_tg.get('resdacTOTday') * 100  # Convert to centimeters (cm)
-time = data_tg.get('timeTOTday')
-lat_tg = data_tg.get('latTOT')
-lon_tg = data_tg.get('lonTOT')
+# Tide gauge stations sorted by longitude from east to west (loaded once, cached in binary form)
+tg = tgs.load_tg(tg_file, tg_names_file, cache_path)
+sorted_names = tg['names'].tolist()
+ordered_lat = tg['latitude'].tolist()
+ordered_lon = tg['longitude'].tolist()
 
-# Convert datenum into datetime
-epoch_start = pd.Timestamp('1970-01-01')
-time_days = np.array(time, dtype='timedelta64[D]')  # Convert 'time' to a timedelta array
-time_datetime = epoch_start.to_numpy() + time_days
+# Create dataframe with tide gauge data
+df_tg = tgs.tg_table(tg)
+df_tg_dropna = df_tg.dropna(how='any')
 
-data_arrays = []
+# Number of samples and NaNs of each station for any time window (percentage of NaNs per station)
+tg_coverage = tgs.coverage_index(df_tg)
 
-for i in range(lat_tg.size):  # Assuming lat_tg and lon_tg are 1D arrays with length 21
-    # Create a DataArray for each station with its corresponding time and SLA values
+# ------------------------ PROCESSING SWOT DATA AROUND TG LOCATIONS --------------------------------------------------
+# Choose strategy for handling missing data (average nearby points or closest non-NaN)
+# 0: Average nearby points (within radius)
+# 1: Retrieve closest non-NaN value (within radius)
+strategy = 0
 
-    station_name = names_tg[0][i]
+# Method for finding the SWOT pixels within the radius of the tide gauges
+# 'tree': spherical k-d tree, 'bbox': latitude/longitude bands before haversine, 'broadcast': tiled gauges x pixels haversine,
+# 'chord': dot product of 3D unit vectors (haversine only for the closest pixel)
+colocation_backend = 'tree'
 
-    da = xr.DataArray(
-        data=sla[i, :],  # SLA data for the i-th station
-        dims=["time"],
-        coords={
-            "time": time_datetime[i, :],  # Time data for the i-th station
-            "latitude": lat_tg[i],
-            "longitude": lon_tg[i]
-        },
-        name=f"station_{station_name}"
-    )
-    data_arrays.append(da)
+# Cache of the extraction of each file (strategy 0): files already extracted with the same radius and
+# tide gauges are not read again (the typed records and the raw values within the radius)
+use_cache = True
+ssh_variable = 'ssha_noiseless'  # SSH variable read from the SWOT files
+# ssh_variable = 'ssha'
+swot_product = f'SWOT L3 {ssh_variable}'  # Product and SSH variable extracted (part of the cache key)
+record_columns = ['station', 'longitude', 'latitude', 'ssha', 'time', 'day', 'n_val', 'min_distance']  # Typed buffers (cached)
+raw_columns = ['ssha_raw', 'swot_lat_within_radius', 'swot_lon_within_radius']  # Ragged arrays (cached)
 
-    # Order by longitude from east to west:
-    # Pair each station name with its corresponding longitude
-    name_longitude_pairs = [(da.name, da.longitude.item()) for da in data_arrays]
+# Number of processes extracting the files in parallel (None: all the CPUs, 1: sequential)
+n_workers = None
+prefetch_depth = 4  # Files read ahead while processing the current one (sequential extraction)
 
-    # Sort the pairs by longitude in descending order
-    sorted_pairs = sorted(name_longitude_pairs, key=lambda x: x[1], reverse=True)
+# Radius in km for averaging nearby points
+dmedia = np.arange(10, 15, 5)
 
-    # Extract the sorted names
-    sorted_names = [name for name, _ in sorted_pairs]
+# Loop through all netCDF files in the folder
+nc_files = parallel.sort_by_time([f for f in os.listdir(folder_path) if f.endswith('.nc')])
 
+results_rad_comparison = []
 
-# Setting the names_tg per longitude order from east to west
-# Create a new list to store ordered data arrays
-ordered_data_arrays = []
-ordered_lat = []
-ordered_lon = []
+# Hash of the tide gauge catalogue (part of the cache key)
+gauges_key = cache.gauge_hash(sorted_names, ordered_lon, ordered_lat)
 
-# Loop through the sorted station names and get the corresponding DataArray
-for name in sorted_names:
-  for da in data_arrays:
-    if da.name == name:
-      ordered_data_arrays.append(da)
-      ordered_lat.append(np.float64(da['latitude'].values))
-      ordered_lon.append(np.float64(da['longitude'].values))
-      break  # Exit the inner loop once the matching DataArray is found
+# Function for reading the valid SWOT values of one daily file (or its extraction, if cached)
+def read_swot_file(filename, rad, swot_lat_range):
+    # Reading SWOT daily files
+    file_path = os.path.join(folder_path, filename)
 
-# Replace the original data_arrays list with the ordered version
-data_arrays = ordered_data_arrays
+    key = None
+    if strategy == 0 and use_cache:
+        # Extraction of the file already cached for this radius and these tide gauges
+        key = cache.extraction_key(file_path, swot_product, [rad], gauges_key, cache_path)
+        cached_records = cache.load_columns(cache_path, key, record_columns)
+        cached_raw = cache.load_raw(cache_path, key, raw_columns)
+        if cached_records is not None and cached_raw is not None:
+            return {'cached_records': cached_records, 'cached_raw': cached_raw}
 
-# Create dataframe with tide gauge data
-df_tg = []
-
-# Iterate over each DataArray
-for da in data_arrays:
-    # Extracting values from the DataArray
-    time_values = da["time"].values
-    sla_values = da.values
-    station_name = da.name  # Extracting station name from DataArray name
-    latitude = da.latitude.values  
-    longitude = da.longitude.values
-
-    # Create a DataFrame for the current DataArray
-    tg_data = pd.DataFrame({
-        'time': time_values,
-        'ssha': sla_values,
-        'station': [station_name] * len(time_values),
-        'latitude': latitude,
-        'longitude': longitude
-    })
-
-    # Append the DataFrame to the list
-    df_tg.append(tg_data)
-
-# Concatenate all DataFrames into a single DataFrame
-df_tg_dropna = pd.concat(df_tg, ignore_index=True).dropna(how='any')
-df_tg = pd.concat(df_tg, ignore_index=True)
+    # Only the variables used and the lines within the latitudes of the tide gauges are read
+    swot = swot_reader.read_swot_l3(file_path, lat_range=swot_lat_range, ssh_variable=ssh_variable)
 
-# ------------------------ PROCESSING SWOT DATA AROUND TG LOCATIONS --------------------------------------------------
-# Choose strategy for handling missing data (average nearby points or closest non-NaN)
-# 0: Average nearby points (within radius)
-# 1: Retrieve closest non-NaN value (within radius)
-strategy = 0
+    # Valid values as flat arrays (the time of a pixel is resolved from the time of its line when needed)
+    pixels = swot_reader.valid_pixels(swot)
+    pixels['key'] = key
+    return pixels
 
-# Radius in km for averaging nearby points
-dmedia = np.arange(10, 15, 5)
 
-# Loop through all netCDF files in the folder
-nc_files = [f for f in os.listdir(folder_path) if f.endswith('.nc')]
+# Function for extracting the SWOT values around all the tide gauges from one daily file (run in parallel)
+def extract_swot_file(filename, swot, rad, gauges_covered):
+    if 'cached_records' in swot:
+        return swot['cached_records'], swot['cached_raw']
 
-results_rad_comparison = []
+    # Typed buffers of the SWOT values of all the tide gauges for this file (one record per tide gauge)
+    file_records = recs.allocate(len(ordered_lon), record_columns)
+    file_records['station'][:] = np.arange(len(ordered_lon))
 
-for rad in dmedia:
-    print(f'Beggining processing radius {rad} km')
-    # List to store all SWOT time series
-    all_swot_timeseries = []
+    # Raw values within the radius of each record (stored as ragged arrays, None without data)
+    file_raw = {name: [None] * len(ordered_lon) for name in raw_columns}
 
-    for filename in nc_files:
+    lon, lat, ssh = swot['lon'], swot['lat'], swot['ssh']
 
-        # Reading SWOT daily files
-        file_path = os.path.join(folder_path, filename)
-        ds = xr.open_dataset(file_path)
+    if strategy == 0:
+        # Only the tide gauges covered by the pass of the file are queried (all of them for unknown passes)
+        covered = gauges_covered.get(swot_reader.swot_pass_number(filename), np.ones(len(ordered_lon), dtype=bool))
 
-        # Extract data from variables
-        lon = ds['longitude'].values.flatten()
-        lat = ds['latitude'].values.flatten()
-        ssh = ds['ssha_noiseless'].values.flatten()
-        # ssh = ds['ssha'].values.flatten()
+        # Pixels within the radius of all the tide gauges at once
+        in_radius_gauges, min_distance_gauges = coloc.colocate(lon, lat, ordered_lon, ordered_lat, rad,
+                                                               backend=colocation_backend, active=covered)
 
-        time_values = ds['time'].values  # Adding a new
-        time = np.tile(time_values[:, np.newaxis], (1, 69)).flatten()  # Not efficient
+        # Location of the values: the tide gauges
+        file_records['longitude'][:] = ordered_lon
+        file_records['latitude'][:] = ordered_lat
 
-        # Find indices of non-NaN values
-        valid_indices = np.where(~np.isnan(ssh))
-        lon = lon[valid_indices]
-        lat = lat[valid_indices]
-        time = time[valid_indices]
-        ssh = ssh[valid_indices]
+    # Loop through each tide gauge location
+    for idx, (gauge_lon, gauge_lat) in enumerate(zip(ordered_lon, ordered_lat)):
 
-        # Loop through each tide gauge location
-        for idx, (gauge_lon, gauge_lat) in enumerate(zip(ordered_lon, ordered_lat)):
+        if strategy == 0:  # ------------------------------------------------------------------------------------------
+            # Indices of the data points within the specified radius
+            in_radius = in_radius_gauges[idx]
 
-            if strategy == 0:  # ------------------------------------------------------------------------------------------
-                # Calculate distance for each data point
-                distances = haversine(lon, lat, gauge_lon, gauge_lat)
+            # Average nearby SSH values (if any, the record remains without data otherwise)
+            if in_radius.size > 0:
+                file_records['ssha'][idx] = np.nanmean(ssh[in_radius]) * 100  # Convert to centimeters (cm)
+                file_records['time'][idx] = swot_reader.overpass_time(swot, in_radius)  # Exact overpass time (first value of time within the radius)
+                file_records['n_val'][idx] = in_radius.size  # How many values are used for compute the mean value
+                file_records['min_distance'][idx] = min_distance_gauges[idx]  # Closest distance within the radius
 
-                # Find indices within the specified radius
-                in_radius = distances <= rad
+                # Store the raw SSH, latitudes and longitudes of SWOT within the radius
+                file_raw['ssha_raw'][idx] = ssh[in_radius]
+                file_raw['swot_lat_within_radius'][idx] = lat[in_radius]
+                file_raw['swot_lon_within_radius'][idx] = lon[in_radius]
 
-                # Average nearby SSH values (if any)
-                if np.any(in_radius):
-                    n_idx = sum(in_radius)  # How many values are used for compute the mean value
-                    ssh_tmp = np.nanmean(ssh[in_radius])
-                    ssh_serie = ssh_tmp * 100  # Convert to centimeters (cm)
-                    time_serie = time[in_radius][~np.isnan(time[in_radius])][0]  # Picking the first value of time within the radius
+        else:  # ----------------------------------------------------------------------------------------------------
+            # Calculate distance for each data point
+            distances = haversine(lon, lat, gauge_lon, gauge_lat)
 
-                    # Store the latitudes and longitudes of SWOT within the radius
-                    swot_lat_within_radius = lat[in_radius]
-                    swot_lon_within_radius = lon[in_radius]
+            # Find indices within the specified radius
+            in_radius = distances <= rad
 
-                    # Store closes  distance
-                    min_distance_point = distances[in_radius].min()
+            # Select closest SSH value within the radius (if any)
+            if np.any(in_radius):
+                # Find the closest non-NaN index
+                closest_idx = np.nanargmin(distances[in_radius])
+                file_records['longitude'][idx] = lon[closest_idx]  # Longitude of selected SWOT point
+                file_records['latitude'][idx] = lat[closest_idx]  # Latitude of selected SWOT point
+                file_records['ssha'][idx] = ssh[closest_idx] * 100  # Retrieve closest non-NaN SSH and convert to centimeters (cm)
+                file_records['time'][idx] = swot_reader.pixel_time(swot, closest_idx)
+                file_records['n_val'][idx] = 1
+                file_records['min_distance'][idx] = distances[in_radius][closest_idx]  # Obtain the closest distance
+
+    # Day of the values (days since 1970-01-01)
+    has_time = ~np.isnat(file_records['time'])
+    file_records['day'][has_time] = swot_reader.day_index(file_records['time'][has_time])
+
+    file_raw = {name: rg.from_arrays(file_raw[name]) for name in raw_columns}
+
+    if strategy == 0 and use_cache:
+        cache.save_columns(cache_path, swot['key'], file_records)
+        cache.save_raw(cache_path, swot['key'], file_raw)
+
+    return file_records, file_raw
 
-                else:
-                    ssh_serie = np.nan  # No data within radius (remains NaN)
-                    time_serie = time[in_radius][~np.isnan(time[in_radius])]
-                    n_idx = np.nan  # Number of points for the average within the radius
-                    min_distance_point = np.nan
-
-                    # If there's no SWOT data within the radius, set latitudes and longitudes to None
-                    swot_lat_within_radius = None
-                    swot_lon_within_radius = None
-                    # print(f"No SWOT data within {dmedia} km radius of tide gauge {sorted_names[idx]}")
-
-                # Create a dictionary to store tide gauge and SWOT data
-                selected_data = {
-                    "station_name": sorted_names[idx],  # Access station name
-                    "longitude": gauge_lon,  # Longitude of tide gauge
-                    "latitude": gauge_lat,  # Latitude of tide gauge
-                    "ssha": ssh_serie,  # Retrieved SSH value
-                    "ssha_raw": ssh[in_radius],  # Raw SSH values within the radius
-                    "time": time_serie,
-                    "n_val": n_idx,  # Number of points for the average within the radius
-                    "swot_lat_within_radius": swot_lat_within_radius,  # Latitudes of SWOT within the radius
-                    "swot_lon_within_radius": swot_lon_within_radius,   # Longitudes of SWOT within the radius
-                    "min_distance": min_distance_point  # Closest distance within the radius
-                }
-
-            else:  # ----------------------------------------------------------------------------------------------------
-                # Calculate distance for each data point
-                distances = haversine(lon, lat, gauge_lon, gauge_lat)
-
-                # Find indices within the specified radius
-                in_radius = distances <= rad
-
-                # Select closest SSH value within the radius (if any)
-                if np.any(in_radius):
-                    # Find the closest non-NaN index
-                    closest_idx = np.nanargmin(distances[in_radius])
-                    distance_point = distances[in_radius][closest_idx]  # Obtain the closest distance
-                    ssh_serie = ssh[closest_idx] * 100  # Retrieve closest non-NaN SSH and convert to centimeters (cm)
-                    time_serie = time[closest_idx]
-
-                    # Create a dictionary to store selected SWOT data
-                    selected_data = {
-                        "station_name": sorted_names[idx],  # Access station name
-                        "longitude": lon[closest_idx],  # Longitude of selected SWOT point
-                        "latitude": lat[closest_idx],  # Latitude of selected SWOT point
-                        "ssha": ssh_serie,  # Retrieved SSH value
-                        "time": time_serie,
-                        "n_val": distance_point
-                    }
-            # Append the list of SSH values for all gauges for this file
-            all_swot_timeseries.append(selected_data)
+
+for rad in dmedia:
+    print(f'Beggining processing radius {rad} km')
+    # List to store the records (typed buffers) and the raw values of each file
+    all_swot_records = []
+    all_swot_raw = []
+
+    # Tide gauges that can be within the radius of each pass
+    gauges_covered = {swot_pass: coloc.footprint_coverage(lon_sw, lat_sw, x_ac, ordered_lon, ordered_lat, rad)
+                      for swot_pass, (lon_sw, lat_sw, x_ac) in footprints.items()}
+    for swot_pass, covered in gauges_covered.items():
+        print(f'Pass {swot_pass}: {covered.sum()} of {covered.size} tide gauges covered within {rad} km')
+
+    # Latitudes of the SWOT lines that can be within the radius of the tide gauges
+    swot_lat_range = swot_reader.latitude_range(ordered_lat, rad)
+
+    # SWOT values of all the files extracted in parallel (merged in time order)
+    for file_records, file_raw in parallel.extract_files(extract_swot_file, nc_files, n_workers,
+                                                         load=partial(read_swot_file, rad=rad,
+                                                                      swot_lat_range=swot_lat_range),
+                                                         prefetch_depth=prefetch_depth,
+                                                         rad=rad, gauges_covered=gauges_covered):
+        all_swot_records.append(file_records)
+        all_swot_raw.append(file_raw)
+
+    # Raw values within the radius of all the records (row i: record i, index of df2 and df_dropna before reset)
+    swot_raw = {name: rg.concatenate([file_raw[name] for file_raw in all_swot_raw]) for name in raw_columns}
 
     # Check % of missing data from each station
 
-    # CONVERT TO DATAFRAME for easier managing
-    df_dropna = pd.DataFrame(all_swot_timeseries).dropna(how='any')  # Convert to DataFrame
-    df2 = pd.DataFrame(all_swot_timeseries) # df with nans
+    # CONVERT TO DATAFRAME for easier managing (typed columns of all the records, without data: NaN SSH)
+    df2 = recs.to_table(recs.concatenate(all_swot_records, record_columns), sorted_names, 'station_name')  # df with nans
+    df_dropna = df2.dropna(how='any')
 
     # Dropping wrong tide gauges (errors in tide gauge raw data)
     drop_tg_names = ['station_GL_TS_TG_TamarisTG',
@@ -313,14 +299,26 @@ for rad in dmedia:
     
     df_dropna = df_dropna[~df_dropna['station_name'].isin(drop_tg_names)].reset_index(drop=True)
 
+    # Daily mean of each station (SWOT passes of the same day averaged), all the stations at once
+    daily_columns = ['longitude', 'latitude', 'ssha', 'n_val', 'min_distance']
+    station_codes = pd.Categorical(df_dropna['station_name'], categories=sorted_names).codes
+    days = df_dropna['day'].values.astype(np.int64)
+    first_day = days.min() if days.size > 0 else 0
+    n_days = days.max() - first_day + 1 if days.size > 0 else 0
+    daily_mean, daily_count = stats.daily_means(station_codes, days - first_day, df_dropna[daily_columns].values,
+                                                len(sorted_names), n_days)
+    daily_station, daily_day = np.nonzero(daily_count[:, :, daily_columns.index('ssha')] > 0)
+
+    df_daily = pd.DataFrame(daily_mean[daily_station, daily_day], columns=daily_columns)
+    df_daily.insert(0, 'station_name', np.array(sorted_names)[daily_station])
+    df_daily.insert(1, 'time', (first_day + daily_day).astype('datetime64[D]').astype('datetime64[ns]'))
+
     # ------------------ OBTAINING STATISTICS COMPARISON ---------------------------------------------------
 
-    correlations = []
-    rmsds = []
     consistencys = []
-    var_tg = []
-    var_SWOT = []
-    var_diff = []
+    compared_tables = []  # Series compared at each station (statistics of all the stations at once)
+    compared_stations = []
+    # compared_axes = {}  # Time series plot of each station (RMSD and correlation written after the loop)
     days_used_per_gauge = []
     nans_percentage = []
     min_distances = []
@@ -339,11 +337,15 @@ for rad in dmedia:
     # demean = 'demean'
     demean = 'demean_filtered'
 
+    # Rows of each station (grouped once instead of comparing all the rows with each station name)
+    df_daily_rows = df_daily.groupby('station_name').indices
+    df_tg_dropna_rows = df_tg_dropna.groupby('station').indices
+
     idx_tg = np.arange(len(sorted_names))
     for station in idx_tg:
         try:
             # Filter SWOT and TG data for the current station
-            ssh_swot_station = df_dropna[df_dropna['station_name'] == sorted_names[station]].copy()  # Corrected warnings
+            ssh_swot_station = df_daily.iloc[df_daily_rows.get(sorted_names[station], [])].copy()  # Corrected warnings
 
             if ssh_swot_station.empty:
                 empty_stations.append(station)
@@ -354,21 +356,11 @@ for rad in dmedia:
                 ssh_swot_station.sort_values(by='time', inplace=True)
 
                 # tg_station = closest_tg_times[station].dropna(dim='time')
-                tg_station = df_tg_dropna[df_tg_dropna['station'] == sorted_names[station]].copy()
+                tg_station = df_tg_dropna.iloc[df_tg_dropna_rows.get(sorted_names[station], [])].copy()
 
-                # Transform empty arrays into Not a time (NaT)
-                ssh_swot_station['time'] = ssh_swot_station['time'].apply(lambda x: pd.NaT if isinstance(x, np.ndarray) and x.size == 0 else x)
-                
-                # Convert time column to numpy datetime64
-                ssh_swot_station['time'] = pd.to_datetime(ssh_swot_station['time'])
+                # Convert time column to numpy datetime64 (SWOT values already averaged by day)
                 tg_station['time'] = pd.to_datetime(tg_station['time'])
 
-                # Round SWOT time to nearest day
-                ssh_swot_station['time'] = ssh_swot_station['time'].dt.floor('d')
-
-                # Groupby date and take the mean of the SSHA values
-                ssh_swot_station = ssh_swot_station.groupby('time').mean().reset_index()
-
                 # Set time index
                 ssh_swot_station.set_index('time', inplace=True)
                 tg_station.set_index('time', inplace=True)
@@ -408,11 +400,8 @@ for rad in dmedia:
                 swot_ts.reset_index(inplace=True)
 
                 # Drop the stations where the TG stations have more than 20% of NaNs for the period
-                tg_ts_nans = df_tg[df_tg['station'] == sorted_names[station]].copy()
-                tg_ts_nans['time'] = pd.to_datetime(tg_ts_nans['time']) # Convert time to datetime
-                tg_ts_nans.set_index('time', inplace=True)
-                tg_ts_nans = tg_ts_nans[start_date:end_date]
-                tg_ts_nans = tg_ts_nans['ssha'].isna().sum() / len(tg_ts) * 100
+                tg_n_samples, tg_n_valid = tgs.window_counts(tg_coverage, sorted_names[station], start_date, end_date)
+                tg_ts_nans = (tg_n_samples - tg_n_valid) / len(tg_ts) * 100
 
                 if len(swot_ts) != 0 and tg_ts_nans < 20: #---------------------------------------------------------------------------------------------
 
@@ -423,12 +412,12 @@ for rad in dmedia:
 
                     # SWOT
                     # filt_lowess = sm.nonparametric.lowess(swot_ts['demean'], swot_ts['time'], frac=frac_lowess, return_sorted=False)
-                    filt_loess_swot = loess.loess_smooth_handmade(swot_ts['demean'].values, frac_loess)
+                    filt_loess_swot = loess.loess_smooth_handmade(swot_ts['demean'].values, frac_loess, t=swot_ts['time'].values)
                     swot_ts['demean_filtered'] = filt_loess_swot
 
                     # TGs
                     # filt_lowess = sm.nonparametric.lowess(tg_ts['demean'], tg_ts['time'], frac=frac_lowess, return_sorted=False)
-                    filt_loess_tg = loess.loess_smooth_handmade(tg_ts['demean'].values, frac_loess)
+                    filt_loess_tg = loess.loess_smooth_handmade(tg_ts['demean'].values, frac_loess, t=tg_ts['time'].values)
                     tg_ts['demean_filtered'] = filt_loess_tg
 
                     # Add the stations with less than 20% of NaNs
@@ -440,24 +429,10 @@ for rad in dmedia:
                     print(f"Station {sorted_names[station]} has more than 20% of NaNs")
                     continue  #---------------------------------------------------------------------------------------------
 
-                # Calculate correlation between swot and tg
-                correlation = swot_ts[demean].corr(tg_ts[demean])
-
-                # Calculate RMSD between swot and tg
-                rmsd = np.sqrt(np.mean((swot_ts[demean] - tg_ts[demean]) ** 2))
-
-                # Calculate variances of swot and tg
-                var_swot_df = swot_ts[demean].var()
-                var_tg_df = tg_ts[demean].var()
-
-                # Calculate the variance of the difference between swot and tg
-                var_diff_df = (swot_ts[demean] - tg_ts[demean]).var()
-
-                rmsds.append(rmsd)
-                correlations.append(correlation)
-                var_tg.append(var_tg_df)
-                var_SWOT.append(var_swot_df)
-                var_diff.append(var_diff_df)
+                # Series compared for the statistics of all the stations (aligned by row, as the pandas operations)
+                compared_tables.append(pd.DataFrame({'station': sorted_names[station], 'swot': swot_ts[demean],
+                                                     'tg': tg_ts[demean]}))
+                compared_stations.append(sorted_names[station])
 
                 # Num days used
                 days_used_per_gauge.append(len(swot_ts))
@@ -485,13 +460,7 @@ for rad in dmedia:
                 # plt.tick_params(axis='both', which='major', labelsize=11)
                 # # plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%m-%d'))  # Use '%m-%d' for MM-DD format
                 # plt.gca().xaxis.set_major_locator(mdates.DayLocator(interval=10))
-                # plt.text(0.95, 0.1, f'RMSD: {rmsd:.2f} cm', fontsize=12, color='black', 
-                #          transform=plt.gca().transAxes, ha='right', bbox=dict(facecolor='white', alpha=0.5))
-                # plt.text(0.95, 0.2, f'CORRELATION: {correlation:.2f}', fontsize=12, color='black', 
-                #          transform=plt.gca().transAxes, ha='right', bbox=dict(facecolor='white', alpha=0.5))
-
-
-                # plt.savefig(f'{plot_path}{sorted_names[station]}_{rad}km_{day_window}dLoess.png')
+                # compared_axes[sorted_names[station]] = plt.gca()  # RMSD and correlation written after the loop
 
                 # # PLOT MAP OF DATA OBTAINED FROM EACH GAUGE!
                 # fig, ax = plt.subplots(figsize=(10.5, 11), subplot_kw=dict(projection=ccrs.PlateCarree()))
@@ -517,6 +486,25 @@ for rad in dmedia:
             continue  # Skip to the next iteration
 
 
+    # Statistics of all the compared stations in one grouped pass (instead of the pandas operations of each station)
+    compared = (pd.concat(compared_tables, ignore_index=True) if compared_tables
+                else pd.DataFrame(columns=['station', 'swot', 'tg']))
+    swot_stats = stats.grouped_stats(compared, 'station', compared_stations, 'tg', ['swot'])['swot']
+    correlations = swot_stats['correlation'].tolist()
+    rmsds = swot_stats['rmsd'].tolist()
+    var_tg = swot_stats['var_reference'].tolist()
+    var_SWOT = swot_stats['var'].tolist()
+    var_diff = swot_stats['var_diff'].tolist()
+
+    # # Write the RMSD and correlation in the time series plot of each station and save it
+    # for station_name, ax in compared_axes.items():
+    #     rmsd, correlation = swot_stats.loc[station_name, ['rmsd', 'correlation']]
+    #     ax.text(0.95, 0.1, f'RMSD: {rmsd:.2f} cm', fontsize=12, color='black',
+    #             transform=ax.transAxes, ha='right', bbox=dict(facecolor='white', alpha=0.5))
+    #     ax.text(0.95, 0.2, f'CORRELATION: {correlation:.2f}', fontsize=12, color='black',
+    #             transform=ax.transAxes, ha='right', bbox=dict(facecolor='white', alpha=0.5))
+    #     ax.figure.savefig(f'{plot_path}{station_name}_{rad}km_{day_window}dLoess.png')
+
     n_val = []  # List to store average number of SWOT values per station
 
     # Loop through each station name
@@ -526,7 +514,7 @@ for rad in dmedia:
 
         # Calculate the average number of SWOT values used within the radius (if data exists)
         if not station_data.empty:  # Check if DataFrame is empty
-            n_val_avg = np.mean(station_data['n_val']) 
+            n_val_avg = station_data['n_val'].replace(0, np.nan).mean()  # Records without data (0 points) are skipped
         else:
             n_val_avg = np.nan  # Assign NaN for missing data
 
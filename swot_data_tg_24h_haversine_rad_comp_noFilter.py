@@ -5,7 +5,15 @@ import pandas as pd
 import os
 import cartopy.crs as ccrs
 from shapely.geometry import LineString
+from functools import partial  # for fixing the arguments of the reading function
 import cartopy.feature as cfeature
+import colocation as coloc  # for spatial index of SWOT pixels
+import swot_reader  # for reading SWOT L3 files
+import parallel_extraction as parallel  # for extracting the files in parallel
+import tg_store as tgs  # for loading the tide gauge data
+import station_stats as stats  # for the statistics of all the stations at once
+import ragged as rg  # for the raw values within the radius of the records (flat values and offsets)
+import extraction_records as recs  # for the typed column buffers of the extraction records
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -31,8 +39,9 @@ path ='/home/dvega/anaconda3/work/SWOT/'
 
 folder_path = (f'{path}swot_basic_1day/003_016_pass/')  # Define SWOT passes folders
                 
-data_tg = np.load(f'{path}mareografos/TGresiduals1d_2023_European_Seas_SWOT_FSP.npz')
-names_tg = pd.read_csv(f'{path}mareografos/GLOBAL_TGstations_CMEMS_SWOT_FSP_Feb2024', header=None)
+tg_file = f'{path}mareografos/TGresiduals1d_2023_European_Seas_SWOT_FSP.npz'
+tg_names_file = f'{path}mareografos/GLOBAL_TGstations_CMEMS_SWOT_FSP_Feb2024'
+cache_path = f'{path}cache/'  # Folder for the cached tide gauge data
 # Change format of names
 names_tg_short_sorted = pd.DataFrame({'Stations': ['Porquerolles', 'La_Capte', 'Les_Oursinieres', 'Saint_Louis_Mourillon',
                                             'Toulon', 'Baie_Du_Lazaret', 'Port_De_StElme', 'Tamaris', 'Bregaillon',
@@ -49,63 +58,11 @@ names_tg_short = pd.DataFrame({'Stations': ['Baie_Du_Lazaret', 'Bregaillon', 'Ca
 
 # ---------------------------------- READING TIDE GAUGE DATA --------------------------------------------------------
 
-sla = data_tg.get('resdacTOTday') * 100  # Convert to centimeters (cm)
-time = data_tg.get('timeTOTday')
-lat_tg = data_tg.get('latTOT')
-lon_tg = data_tg.get('lonTOT')
-
-# Convert datenum into datetime
-epoch_start = pd.Timestamp('1970-01-01')
-time_days = np.array(time, dtype='timedelta64[D]')  # Convert 'time' to a timedelta array
-time_datetime = epoch_start.to_numpy() + time_days
-
-data_arrays = []
-
-for i in range(lat_tg.size):  # Assuming lat_tg and lon_tg are 1D arrays with length 21
-    # Create a DataArray for each station with its corresponding time and SLA values
-
-    station_name = names_tg[0][i]
-
-    da = xr.DataArray(
-        data=sla[i, :],  # SLA data for the i-th station
-        dims=["time"],
-        coords={
-            "time": time_datetime[i, :],  # Time data for the i-th station
-            "latitude": lat_tg[i],
-            "longitude": lon_tg[i]
-        },
-        name=f"station_{station_name}"
-    )
-    data_arrays.append(da)
-
-    # Order by longitude from east to west:
-    # Pair each station name with its corresponding longitude
-    name_longitude_pairs = [(da.name, da.longitude.item()) for da in data_arrays]
-
-    # Sort the pairs by longitude in descending order
-    sorted_pairs = sorted(name_longitude_pairs, key=lambda x: x[1], reverse=True)
-
-    # Extract the sorted names
-    sorted_names = [name for name, _ in sorted_pairs]
-
-
-# Setting the names_tg per longitude order from east to west
-# Create a new list to store ordered data arrays
-ordered_data_arrays = []
-ordered_lat = []
-ordered_lon = []
-
-# Loop through the sorted station names and get the corresponding DataArray
-for name in sorted_names:
-  for da in data_arrays:
-    if da.name == name:
-      ordered_data_arrays.append(da)
-      ordered_lat.append(np.float64(da['latitude'].values))
-      ordered_lon.append(np.float64(da['longitude'].values))
-      break  # Exit the inner loop once the matching DataArray is found
-
-# Replace the original data_arrays list with the ordered version
-data_arrays = ordered_data_arrays
+# Tide gauge stations sorted by longitude from east to west (loaded once, cached in binary form)
+tg = tgs.load_tg(tg_file, tg_names_file, cache_path)
+sorted_names = tg['names'].tolist()
+ordered_lat = tg['latitude'].tolist()
+ordered_lon = tg['longitude'].tolist()
 
 
 # ------------------------ PROCESSING SWOT DATA AROUND TG LOCATIONS --------------------------------------------------
@@ -114,163 +71,140 @@ data_arrays = ordered_data_arrays
 # 1: Retrieve closest non-NaN value (within radius)
 strategy = 0
 
+# Method for finding the SWOT pixels within the radius of the tide gauges
+# 'tree': spherical k-d tree, 'bbox': latitude/longitude bands before haversine, 'broadcast': tiled gauges x pixels haversine,
+# 'chord': dot product of 3D unit vectors (haversine only for the closest pixel)
+colocation_backend = 'tree'
+
+# Number of processes extracting the files in parallel (None: all the CPUs, 1: sequential)
+n_workers = None
+prefetch_depth = 4  # Files read ahead while processing the current one (sequential extraction)
+
 # Radius in km for averaging nearby points
 dmedia = np.arange(5, 110, 5)
 
 # Loop through all netCDF files in the folder
-nc_files = [f for f in os.listdir(folder_path) if f.endswith('.nc')]
+nc_files = parallel.sort_by_time([f for f in os.listdir(folder_path) if f.endswith('.nc')])
 
 # List to store all results for each radius
 results_rad_comparison = []
 
-for rad in dmedia:
-    print(f'Beggining processing radius {rad} km')
-
-    # List to store all SWOT time series
-    all_swot_timeseries = []
-
-    for filename in nc_files:
-
-        # Reading SWOT daily files
-        file_path = os.path.join(folder_path, filename)
-        ds = xr.open_dataset(file_path)
-
-        # Extract data from variables
-        lon = ds['longitude'].values.flatten()
-        lat = ds['latitude'].values.flatten()
-        ssh = ds['ssha_noiseless'].values.flatten()
-        # ssh = ds['ssha'].values.flatten()
+# List to store the records (typed buffers) of each file for each radius (and the raw values within the radius)
+swot_records_rad = {rad: [] for rad in dmedia}
+swot_raw_rad = {rad: [] for rad in dmedia}
+record_columns = ['station', 'longitude', 'latitude', 'ssha', 'time', 'n_val', 'min_distance']  # Typed buffers
+raw_columns = ['ssha_raw', 'swot_lat_within_radius', 'swot_lon_within_radius']  # Stored as ragged arrays
+
+# Latitudes of the SWOT lines that can be within the largest radius of the tide gauges
+swot_lat_range = swot_reader.latitude_range(ordered_lat, dmedia.max())
+
+# Function for reading the valid SWOT values of one daily file
+def read_swot_file(filename, swot_lat_range):
+    # Reading SWOT daily files
+    file_path = os.path.join(folder_path, filename)
+    # Only the variables used and the lines within the latitudes of the tide gauges are read
+    swot = swot_reader.read_swot_l3(file_path, lat_range=swot_lat_range)
+    # swot = swot_reader.read_swot_l3(file_path, lat_range=swot_lat_range, ssh_variable='ssha')
+
+    # Valid values as flat arrays (the time of a pixel is resolved from the time of its line when needed)
+    pixels = swot_reader.valid_pixels(swot)
+    return pixels
+
+
+# Function for extracting the SWOT values around all the tide gauges for all the radius sizes from one daily file
+# (each file is read only once, run in parallel)
+def extract_swot_file(filename, swot):
+    # Typed buffers of the SWOT values of all the tide gauges for this file (one per radius, one record per tide gauge)
+    file_records_rad = {rad: recs.allocate(len(ordered_lon), record_columns) for rad in dmedia}
+    for rad in dmedia:
+        file_records_rad[rad]['station'][:] = np.arange(len(ordered_lon))
+        if strategy == 0:
+            file_records_rad[rad]['longitude'][:] = ordered_lon  # Location of the tide gauges
+            file_records_rad[rad]['latitude'][:] = ordered_lat
+
+    # Raw values within the radius of each record (stored as ragged arrays, None without data)
+    file_raw_rad = {rad: {name: [None] * len(ordered_lon) for name in raw_columns} for rad in dmedia}
+
+    lon, lat, ssh = swot['lon'], swot['lat'], swot['ssh']
+
+    if strategy == 0:
+        # Query all the tide gauges up to the largest radius (smaller radius are subsets of it)
+        in_radius_gauges, distances_gauges = coloc.colocate(lon, lat, ordered_lon, ordered_lat, dmedia.max(),
+                                                            backend=colocation_backend, return_distances=True)
+
+    # Loop through each tide gauge location
+    for idx, (gauge_lon, gauge_lat) in enumerate(zip(ordered_lon, ordered_lat)):
+
+        if strategy == 0:  # ------------------------------------------------------------------------------------------
+            # Mean SSH, number of points and closest distance for every radius from the sorted distances
+            summary = coloc.multi_radius_summary(ssh, in_radius_gauges[idx], distances_gauges[idx], dmedia)
+
+            for rad_idx, rad in enumerate(dmedia):
+                # Data points within the radius (sorted by distance)
+                in_radius = summary['sorted_indices'][:summary['n_val'][rad_idx]]
+
+                # Average nearby SSH values (if any, the record remains without data otherwise)
+                if in_radius.size > 0:
+                    file_records = file_records_rad[rad]
+                    file_records['ssha'][idx] = summary['ssha'][rad_idx] * 100  # Convert to centimeters (cm)
+                    file_records['time'][idx] = swot_reader.pixel_time(swot, summary['first_index'][rad_idx])  # Time of the first value within the radius
+                    file_records['n_val'][idx] = in_radius.size  # How many values are used for compute the mean value
+                    file_records['min_distance'][idx] = summary['min_distance'][rad_idx]  # Closest distance within the radius
+
+                    # Store the raw SSH, latitudes and longitudes of SWOT within the radius
+                    file_raw_rad[rad]['ssha_raw'][idx] = ssh[in_radius]
+                    file_raw_rad[rad]['swot_lat_within_radius'][idx] = lat[in_radius]
+                    file_raw_rad[rad]['swot_lon_within_radius'][idx] = lon[in_radius]
+
+        else:  # ----------------------------------------------------------------------------------------------------
+            # Calculate distance for each data point
+            distances = haversine(lon, lat, gauge_lon, gauge_lat)
+
+            for rad in dmedia:
+                # Find indices within the specified radius
+                in_radius = distances <= rad
 
-        time_values = ds['time'].values  # Adding a new
-        time = np.tile(time_values[:, np.newaxis], (1, 69)).flatten()  # Not efficient
+                # Select closest SSH value within the radius (if any)
+                if np.any(in_radius):
+                    # Find the closest non-NaN index
+                    closest_idx = np.nanargmin(distances[in_radius])
+                    file_records = file_records_rad[rad]
+                    file_records['longitude'][idx] = lon[closest_idx]  # Longitude of selected SWOT point
+                    file_records['latitude'][idx] = lat[closest_idx]  # Latitude of selected SWOT point
+                    file_records['ssha'][idx] = ssh[closest_idx] * 100  # Retrieve closest non-NaN SSH and convert to centimeters (cm)
+                    file_records['time'][idx] = swot_reader.pixel_time(swot, closest_idx)
+                    file_records['n_val'][idx] = 1
+                    file_records['min_distance'][idx] = distances[in_radius][closest_idx]  # Obtain the closest distance
 
-        # Find indices of non-NaN values
-        valid_indices = np.where(~np.isnan(ssh))
-        lon = lon[valid_indices]
-        lat = lat[valid_indices]
-        time = time[valid_indices]
-        ssh = ssh[valid_indices]
+    return file_records_rad, {rad: {name: rg.from_arrays(file_raw_rad[rad][name]) for name in raw_columns} for rad in dmedia}
 
-        # Loop through each tide gauge location
-        for idx, (gauge_lon, gauge_lat) in enumerate(zip(ordered_lon, ordered_lat)):
 
-            if strategy == 0:  # ------------------------------------------------------------------------------------------
-                # Calculate distance for each data point
-                distances = haversine(lon, lat, gauge_lon, gauge_lat)
+# SWOT values of all the files extracted in parallel (merged in time order)
+for file_records_rad, file_raw_rad in parallel.extract_files(extract_swot_file, nc_files, n_workers,
+                                                             load=partial(read_swot_file, swot_lat_range=swot_lat_range),
+                                                             prefetch_depth=prefetch_depth):
+    for rad in dmedia:
+        swot_records_rad[rad].append(file_records_rad[rad])
+        swot_raw_rad[rad].append(file_raw_rad[rad])
 
-                # Find indices within the specified radius
-                in_radius = distances <= rad
+for rad in dmedia:
+    print(f'Beggining processing radius {rad} km')
 
-                # Average nearby SSH values (if any)
-                if np.any(in_radius):
-                    n_idx = sum(in_radius)  # How many values are used for compute the mean value
-                    ssh_tmp = np.nanmean(ssh[in_radius])
-                    ssh_serie = ssh_tmp * 100  # Convert to centimeters (cm)
-                    time_serie = time[in_radius][~np.isnan(time[in_radius])][0]  # Picking the first value of time within the radius
-
-                    # Store the latitudes and longitudes of SWOT within the radius
-                    swot_lat_within_radius = lat[in_radius]
-                    swot_lon_within_radius = lon[in_radius]
-
-                    # Store closes  distance
-                    min_distance_point = distances[in_radius].min()
-
-                else:
-                    ssh_serie = np.nan  # No data within radius (remains NaN)
-                    time_serie = time[in_radius][~np.isnan(time[in_radius])]
-                    n_idx = np.nan  # Number of points for the average within the radius
-                    min_distance_point = np.nan
-
-                    # If there's no SWOT data within the radius, set latitudes and longitudes to None
-                    swot_lat_within_radius = None
-                    swot_lon_within_radius = None
-                    # print(f"No SWOT data within {dmedia} km radius of tide gauge {sorted_names[idx]}")
-
-                # Create a dictionary to store tide gauge and SWOT data
-                selected_data = {
-                    "station_name": sorted_names[idx],  # Access station name
-                    "longitude": gauge_lon,  # Longitude of tide gauge
-                    "latitude": gauge_lat,  # Latitude of tide gauge
-                    "ssha": ssh_serie,  # Retrieved SSH value
-                    "ssha_raw": ssh[in_radius],  # Raw SSH values within the radius
-                    "time": time_serie,
-                    "n_val": n_idx,  # Number of points for the average within the radius
-                    "swot_lat_within_radius": swot_lat_within_radius,  # Latitudes of SWOT within the radius
-                    "swot_lon_within_radius": swot_lon_within_radius,   # Longitudes of SWOT within the radius
-                    "min_distance": min_distance_point  # Closest distance within the radius
-                }
-
-            else:  # ----------------------------------------------------------------------------------------------------
-                # Calculate distance for each data point
-                distances = haversine(lon, lat, gauge_lon, gauge_lat)
+    # Table of all the SWOT records (typed columns, one row per file and tide gauge)
+    df2 = recs.to_table(recs.concatenate(swot_records_rad[rad], record_columns), sorted_names, 'station_name')
+    df2 = df2.rename(columns={'n_val': 'num_swot_points'})
 
-                # Find indices within the specified radius
-                in_radius = distances <= rad
+    # Raw values within the radius of all the records (row i: record i, index of df)
+    swot_raw = {name: rg.concatenate([file_raw[name] for file_raw in swot_raw_rad[rad]]) for name in raw_columns}
 
-                # Select closest SSH value within the radius (if any)
-                if np.any(in_radius):
-                    # Find the closest non-NaN index
-                    closest_idx = np.nanargmin(distances[in_radius])
-                    distance_point = distances[in_radius][closest_idx]  # Obtain the closest distance
-                    ssh_serie = ssh[closest_idx] * 100  # Retrieve closest non-NaN SSH and convert to centimeters (cm)
-                    time_serie = time[closest_idx]
-
-                    # Create a dictionary to store selected SWOT data
-                    selected_data = {
-                        "station_name": sorted_names[idx],  # Access station name
-                        "longitude": lon[closest_idx],  # Longitude of selected SWOT point
-                        "latitude": lat[closest_idx],  # Latitude of selected SWOT point
-                        "ssha": ssh_serie,  # Retrieved SSH value
-                        "time": time_serie,
-                        "n_val": distance_point
-                    }
-            # Append the list of SSH values for all gauges for this file
-            all_swot_timeseries.append(selected_data)
-
-
-    # CONVERT TO DATAFRAME for easier managing
-    df = pd.DataFrame(all_swot_timeseries).dropna(how='any')  # Convert to DataFrame
-
-
-    # Dataframe to store time series data for each station (key: station_name, value[list of SSH, lat, lon and time values])
-    station_time_series = []
-
-    for i in range(0, len(all_swot_timeseries)):  # Loop through each file's data
-        file_data = all_swot_timeseries[i]
-
-        station_name = file_data["station_name"]
-        ssha_value = file_data["ssha"]
-        lon = file_data['longitude'],  # Longitude of selected SWOT point
-        lat = file_data['latitude'],  # Latitude of selected SWOT point
-        time = file_data['time']
-        n_val = file_data['n_val']  # Number of points for the average within the radius or distance of the closest point
-        ssh_raw = file_data['ssha_raw']  # Raw SSH values within the radius
-        swot_lat_within_radius = file_data['swot_lat_within_radius']  # Latitudes of SWOT within the radius
-        swot_lon_within_radius = file_data['swot_lon_within_radius']  # Longitudes of SWOT within the radius
-        min_distance = file_data['min_distance']  # Closest distance within the radius
-        
-        # Append the SSH and time s to the station's time series
-        station_time_series.append({'station_name': station_name,
-                                    'ssha': ssha_value,
-                                    'latitude': lat,
-                                    'longitude': lon,
-                                    'time': time,
-                                    'num_swot_points': n_val,
-                                    'raw_ssha': ssh_raw,
-                                    'swot_lat_within_radius': swot_lat_within_radius,
-                                    'swot_lon_within_radius': swot_lon_within_radius,
-                                    'min_distance': min_distance})
-
-    df2 = pd.DataFrame(station_time_series)
+    # Records with data (the index is kept to access the raw values)
+    df = df2.dropna(how='any')
 
     # ------------------ OBTAINING STATISTICS COMPARISON ---------------------------------------------------
 
-    correlations = []
-    rmsds = []
     consistencys = []
-    var_tg = []
-    var_SWOT = []
-    var_diff = []
+    compared_tables = []  # Series compared at each station (statistics of all the stations at once)
+    compared_stations = []
     days_used_per_gauge = []
     n_nans_tg = []
     min_distances = []
@@ -279,31 +213,7 @@ for rad in dmedia:
     # Convert from Series of ndarrays containing dates to Series of timestamps
     # df['time'] = df['time'].apply(lambda x: x[0])
 
-    df_tg = []
-
-    # Iterate over each DataArray
-    for da in data_arrays:
-        # Extracting values from the DataArray
-        time_values = da["time"].values
-        sla_values = da.values
-        station_name = da.name  # Extracting station name from DataArray name
-        latitude = da.latitude.values  
-        longitude = da.longitude.values
-
-        # Create a DataFrame for the current DataArray
-        tg_data = pd.DataFrame({
-            'time': time_values,
-            'ssha': sla_values,
-            'station': [station_name] * len(time_values),
-            'latitude': latitude,
-            'longitude': longitude
-        })
-
-        # Append the DataFrame to the list
-        df_tg.append(tg_data)
-
-    # Concatenate all DataFrames into a single DataFrame
-    df_tg = pd.concat(df_tg, ignore_index=True).dropna(how='any')
+    df_tg = tgs.tg_table(tg).dropna(how='any')
 
 
 
@@ -312,12 +222,16 @@ for rad in dmedia:
     empty_stations = []  # List to store empty stations indexes
     lolabox = [1, 8, 35, 45]
 
+    # Rows of each station (grouped once instead of comparing all the rows with each station name)
+    df_rows = df.groupby('station_name').indices
+    df_tg_rows = df_tg.groupby('station').indices
+
     idx_tg = np.arange(len(sorted_names))
     for station in idx_tg:
         try:
 
             # ssh_swot_station = df[df['station_name'] == sorted_names[station]]
-            ssh_swot_station = df[df['station_name'] == sorted_names[station]].copy()  # Corrected warnings
+            ssh_swot_station = df.iloc[df_rows.get(sorted_names[station], [])].copy()  # Corrected warnings
             
             if ssh_swot_station.empty:
                 empty_stations.append(station)
@@ -328,7 +242,7 @@ for rad in dmedia:
                 ssh_swot_station.sort_values(by='time', inplace=True)
 
                 # tg_station = closest_tg_times[station].dropna(dim='time')
-                tg_station = df_tg[df_tg['station'] == sorted_names[station]].copy()
+                tg_station = df_tg.iloc[df_tg_rows.get(sorted_names[station], [])].copy()
 
                 # Convert time column to numpy datetime64
                 ssh_swot_station['time'] = pd.to_datetime(ssh_swot_station['time'])
@@ -358,24 +272,10 @@ for rad in dmedia:
                 tg_ts.reset_index(inplace=True)
                 swot_ts.reset_index(inplace=True)
 
-                # Calculate correlation between swot and tg
-                correlation = swot_ts['demean'].corr(tg_ts['demean'])
-
-                # Calculate RMSD between swot and tg
-                rmsd = np.sqrt(np.mean((swot_ts['demean'] - tg_ts['demean']) ** 2))
-
-                # Calculate variances of swot and tg
-                var_swot_df = swot_ts['demean'].var()
-                var_tg_df = tg_ts['demean'].var()
-
-                # Calculate the variance of the difference between swot and tg
-                var_diff_df = (swot_ts['demean'] - tg_ts['demean']).var()
-
-                rmsds.append(rmsd)
-                correlations.append(correlation)
-                var_tg.append(var_tg_df)
-                var_SWOT.append(var_swot_df)
-                var_diff.append(var_diff_df)
+                # Series compared for the statistics of all the stations (aligned by row, as the pandas operations)
+                compared_tables.append(pd.DataFrame({'station': sorted_names[station], 'swot': swot_ts['demean'],
+                                                     'tg': tg_ts['demean']}))
+                compared_stations.append(sorted_names[station])
 
                 # Num days used
                 days_used_per_gauge.append(len(swot_ts))
@@ -420,6 +320,16 @@ for rad in dmedia:
             continue  # Skip to the next iteration
 
 
+    # Statistics of all the compared stations in one grouped pass (instead of the pandas operations of each station)
+    compared = (pd.concat(compared_tables, ignore_index=True) if compared_tables
+                else pd.DataFrame(columns=['station', 'swot', 'tg']))
+    swot_stats = stats.grouped_stats(compared, 'station', compared_stations, 'tg', ['swot'])['swot']
+    correlations = swot_stats['correlation'].tolist()
+    rmsds = swot_stats['rmsd'].tolist()
+    var_tg = swot_stats['var_reference'].tolist()
+    var_SWOT = swot_stats['var'].tolist()
+    var_diff = swot_stats['var_diff'].tolist()
+
     n_val = []  # List to store average number of SWOT values per station
 
     # Loop through each station name
@@ -429,7 +339,7 @@ for rad in dmedia:
 
         # Calculate the average number of SWOT values used within the radius (if data exists)
         if not station_data.empty:  # Check if DataFrame is empty
-            n_val_avg = np.mean(station_data['num_swot_points'])  # Access 'n_val' column directly
+            n_val_avg = station_data['num_swot_points'].replace(0, np.nan).mean()  # Records without data (0 points) are skipped
         else:
             n_val_avg = np.nan  # Assign NaN for missing data
 
@@ -0,0 +1,138 @@
+import re
+import threading
+import numpy as np
+import netCDF4 as nc
+import colocation as coloc
+
+# The netCDF/HDF5 library is not thread safe (files read by prefetch threads)
+_netcdf_lock = threading.Lock()
+
+
+# Function for obtaining the pass number from the name of a SWOT L3 file (..._<cycle>_<pass>_<start time>_...)
+def swot_pass_number(filename):
+    match = re.search(r'_(\d{3})_(\d{3})_\d{8}T', filename)
+    return match.group(2) if match else None
+
+
+# Function for obtaining the latitude range of the tide gauges extended by the radius (km)
+def latitude_range(gauge_lat, rad):
+    dlat = np.rad2deg(rad / coloc.EARTH_RADIUS)
+    return np.min(gauge_lat) - dlat, np.max(gauge_lat) + dlat
+
+
+# Function for obtaining the day index (days since 1970-01-01) of datetime64 times
+def day_index(time):
+    return np.asarray(time, dtype='datetime64[ns]').astype('datetime64[D]').astype(np.int64)
+
+
+def _read_float32(variable, lines):
+    """
+    Read the lines of a variable as float32, applying the fill value, missing value, valid range, scale factor
+    and offset by hand (netCDF4 would decode them to float64). As with the automatic masking of netCDF4, the
+    values outside valid_range (or valid_min/valid_max) are missing, compared with the packed values.
+    """
+    variable.set_auto_maskandscale(False)
+    raw = variable[lines]
+    data = raw.astype(np.float32)
+
+    # Missing values (fill value, missing value and values outside the valid range)
+    missing = np.zeros(raw.shape, dtype=bool)
+    if hasattr(variable, '_FillValue'):
+        missing |= raw == variable._FillValue
+    if hasattr(variable, 'missing_value'):
+        missing |= np.isin(raw, np.atleast_1d(variable.missing_value))
+    if hasattr(variable, 'valid_range'):
+        valid_min, valid_max = np.atleast_1d(variable.valid_range)[:2]
+    else:
+        valid_min = getattr(variable, 'valid_min', None)
+        valid_max = getattr(variable, 'valid_max', None)
+    if valid_min is not None:
+        missing |= raw < valid_min
+    if valid_max is not None:
+        missing |= raw > valid_max
+    data[missing] = np.nan
+    if hasattr(variable, 'scale_factor'):
+        data *= np.float32(variable.scale_factor)
+    if hasattr(variable, 'add_offset'):
+        data += np.float32(variable.add_offset)
+    return data
+
+
+def read_swot_l3(file_path, lat_range=None, ssh_variable='ssha_noiseless'):
+    """
+    Read only the variables used from a SWOT L3 file (longitude, latitude, SSH and time).
+    If lat_range (min, max) is given, only the along track lines (num_lines) crossing it are read.
+    Returns the (lines x pixels) float32 fields, the time of each line and the index of the first line read.
+    """
+    with _netcdf_lock, nc.Dataset(file_path) as ds:
+        lines = slice(None)
+        first_line = 0
+
+        if lat_range is not None:
+            # Latitudes of the edges of the swath for each line
+            lat_edges = _read_float32(ds.variables['latitude'], (slice(None), [0, -1]))
+            lat_min = np.nanmin(lat_edges, axis=1)
+            lat_max = np.nanmax(lat_edges, axis=1)
+
+            # Lines crossing the latitude range (contiguous along the pass)
+            crossing = np.flatnonzero((lat_max >= lat_range[0]) & (lat_min <= lat_range[1]))
+            if crossing.size > 0:
+                first_line = crossing[0]
+                lines = slice(crossing[0], crossing[-1] + 1)
+            else:
+                lines = slice(0, 0)
+
+        lon = _read_float32(ds.variables['longitude'], lines)
+        lat = _read_float32(ds.variables['latitude'], lines)
+        ssh = _read_float32(ds.variables[ssh_variable], lines)
+
+        # Time of each line (in the units and calendar of the file)
+        time_variable = ds.variables['time']
+        time_values = np.ma.filled(np.ma.asarray(time_variable[lines], dtype=np.float64), np.nan)
+        time_units = time_variable.units
+        calendar = getattr(time_variable, 'calendar', 'standard')
+
+    # Missing times are NaT (raises ValueError for calendars without real dates, e.g. noleap)
+    time = np.full(time_values.shape, np.datetime64('NaT'), dtype='datetime64[ns]')
+    valid = ~np.isnan(time_values)
+    if np.any(valid):
+        time[valid] = np.array(nc.num2date(time_values[valid], time_units, calendar, only_use_cftime_datetimes=False,
+                                           only_use_python_datetimes=True), dtype='datetime64[ns]')
+
+    return {'longitude': lon,
+            'latitude': lat,
+            'ssh': ssh,
+            'time': time,
+            'first_line': first_line}
+
+
+def valid_pixels(swot):
+    """
+    Valid (non NaN SSH) pixels of a file read with read_swot_l3 as flat arrays (longitude, latitude and SSH in
+    line and pixel order). The pixels keep their (line, pixel) addressing through line_offsets, the number of
+    valid pixels before each line, so their time is resolved from the time of each line (line_time) instead
+    of repeating it for every pixel of the swath.
+    """
+    valid = ~np.isnan(swot['ssh'])
+    return {'lon': swot['longitude'][valid],
+            'lat': swot['latitude'][valid],
+            'ssh': swot['ssh'][valid],
+            'line_time': swot['time'],
+            'line_offsets': np.concatenate(([0], np.cumsum(np.count_nonzero(valid, axis=1))))}
+
+
+# Function for obtaining the along track line of valid pixels (indices of the flat arrays of valid_pixels)
+def pixel_lines(pixels, indices):
+    return np.searchsorted(pixels['line_offsets'], indices, side='right') - 1
+
+
+# Function for obtaining the time of valid pixels (indices of the flat arrays of valid_pixels)
+def pixel_time(pixels, indices):
+    return pixels['line_time'][pixel_lines(pixels, indices)]
+
+
+# Function for obtaining the overpass time over a gauge: time of the first pixel with time within the radius (NaT if none)
+def overpass_time(pixels, indices):
+    time = pixel_time(pixels, np.asarray(indices, dtype=np.int64))
+    time = time[~np.isnat(time)]
+    return time[0] if time.size > 0 else np.datetime64('NaT', 'ns')
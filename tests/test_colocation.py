@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+
+import colocation as coloc
+
+
+# Function for obtaining the pixels within the radius of every gauge from the haversine distance to all the pixels
+def brute_force(lon, lat, gauge_lon, gauge_lat, rad):
+    in_radius = []
+    distances = []
+    for g_lon, g_lat in zip(gauge_lon, gauge_lat):
+        dist = coloc.haversine(lon, lat, g_lon, g_lat)
+        in_radius.append(np.flatnonzero(dist <= rad))
+        distances.append(dist[dist <= rad])
+    return in_radius, distances
+
+
+@pytest.fixture
+def pixels():
+    rng = np.random.default_rng(0)
+    lon = rng.uniform(2, 6, 20000)
+    lat = rng.uniform(38, 42, 20000)
+    gauge_lon = np.array([3.0, 4.5, 5.9, 10.0])  # Last gauge far from all the pixels
+    gauge_lat = np.array([39.0, 40.5, 41.9, 45.0])
+    return lon, lat, gauge_lon, gauge_lat
+
+
+@pytest.mark.parametrize('backend', ['tree', 'bbox', 'broadcast', 'chord'])
+@pytest.mark.parametrize('rad', [5, 20])
+def test_backends_match_brute_force(pixels, backend, rad):
+    lon, lat, gauge_lon, gauge_lat = pixels
+    expected, expected_distances = brute_force(lon, lat, gauge_lon, gauge_lat, rad)
+
+    in_radius, distances = coloc.colocate(lon, lat, gauge_lon, gauge_lat, rad, backend=backend,
+                                          max_memory=1024**2, return_distances=True)
+
+    for idx in range(gauge_lon.size):
+        np.testing.assert_array_equal(in_radius[idx], expected[idx])
+        np.testing.assert_allclose(distances[idx], expected_distances[idx], rtol=1e-9)
+
+
+@pytest.mark.parametrize('backend', ['tree', 'bbox', 'broadcast', 'chord'])
+def test_min_distance(pixels, backend):
+    lon, lat, gauge_lon, gauge_lat = pixels
+    _, expected_distances = brute_force(lon, lat, gauge_lon, gauge_lat, 10)
+
+    _, min_distance = coloc.colocate(lon, lat, gauge_lon, gauge_lat, 10, backend=backend)
+
+    expected = [dist.min() if dist.size > 0 else np.nan for dist in expected_distances]
+    np.testing.assert_allclose(min_distance, expected, rtol=1e-9)
+
+
+@pytest.mark.parametrize('backend', ['tree', 'bbox', 'broadcast', 'chord'])
+def test_inactive_gauges_get_no_pixels(pixels, backend):
+    lon, lat, gauge_lon, gauge_lat = pixels
+    active = np.array([True, False, True, False])
+
+    in_radius, _ = coloc.colocate(lon, lat, gauge_lon, gauge_lat, 20, backend=backend, active=active)
+
+    assert in_radius[0].size > 0
+    assert in_radius[1].size == 0
+
+
+@pytest.mark.parametrize('backend', ['tree', 'bbox', 'broadcast', 'chord'])
+def test_empty_input(backend):
+    # File without lines within the latitudes of the gauges (empty crop)
+    empty = np.array([])
+
+    in_radius, min_distance = coloc.colocate(empty, empty, [3.0, 4.0], [40.0, 41.0], 10, backend=backend)
+
+    assert [idx.size for idx in in_radius] == [0, 0]
+    assert np.isnan(min_distance).all()
+
+
+def test_chord_border_of_the_radius():
+    # Pixels at the border of the radius (distance rad within 1e-9 relative), where rounding of the dot product matters
+    rng = np.random.default_rng(1)
+    rad = 10
+    gauge_lon, gauge_lat = np.deg2rad(3.0), np.deg2rad(40.0)
+    bearing = rng.uniform(0, 2 * np.pi, 20000)
+    angle = rad * (1 + rng.uniform(-1e-9, 1e-9, bearing.size)) / coloc.EARTH_RADIUS
+    lat = np.arcsin(np.sin(gauge_lat) * np.cos(angle) + np.cos(gauge_lat) * np.sin(angle) * np.cos(bearing))
+    lon = gauge_lon + np.arctan2(np.sin(bearing) * np.sin(angle) * np.cos(gauge_lat),
+                                 np.cos(angle) - np.sin(gauge_lat) * np.sin(lat))
+    lon, lat = np.rad2deg(lon), np.rad2deg(lat)
+    expected, _ = brute_force(lon, lat, [3.0], [40.0], rad)
+
+    in_radius, _ = coloc.colocate(lon, lat, [3.0], [40.0], rad, backend='chord')
+    np.testing.assert_array_equal(in_radius[0], expected[0])
+
+    # Same pixels when the coordinates are recovered from the vectors
+    in_radius, closest = coloc.query_radius_chord(coloc.lonlat_to_xyz(lon, lat), [3.0], [40.0], rad)
+    np.testing.assert_array_equal(in_radius[0], expected[0])
+    assert closest[0] in expected[0]
+
+
+def test_multi_radius_summary_matches_each_radius(pixels):
+    lon, lat, gauge_lon, gauge_lat = pixels
+    ssh = np.random.default_rng(1).normal(0, 0.2, lon.size)
+    radii = np.array([2, 5, 10, 20])
+
+    in_radius, distances = coloc.colocate(lon, lat, gauge_lon, gauge_lat, radii.max(), return_distances=True)
+
+    for idx in range(gauge_lon.size):
+        summary = coloc.multi_radius_summary(ssh, in_radius[idx], distances[idx], radii)
+
+        # Reference: mask of each radius over all the pixels (as when each radius was processed on its own)
+        for rad_idx, rad in enumerate(radii):
+            dist = coloc.haversine(lon, lat, gauge_lon[idx], gauge_lat[idx])
+            mask = dist <= rad
+            assert summary['n_val'][rad_idx] == mask.sum()
+            if mask.any():
+                np.testing.assert_allclose(summary['ssha'][rad_idx], np.mean(ssh[mask]))
+                np.testing.assert_allclose(summary['min_distance'][rad_idx], dist[mask].min())
+                assert summary['first_index'][rad_idx] == np.flatnonzero(mask)[0]
+            else:
+                assert np.isnan(summary['ssha'][rad_idx]) and np.isnan(summary['min_distance'][rad_idx])
+                assert summary['first_index'][rad_idx] == -1
+
+
+# Function for obtaining the footprint grid of a pass along a meridian (lat, lon and across track distance, km)
+def footprint_grid(lon_track=0.0):
+    lat_track = np.arange(36, 44, 0.018)
+    x_ac = np.concatenate((np.arange(-60, -9, 2.0), np.arange(10, 61, 2.0)))  # Swaths without the nadir gap
+    lat_swath = np.repeat(lat_track[:, np.newaxis], x_ac.size, axis=1)
+    lon_swath = lon_track + x_ac / (111.32 * np.cos(np.radians(lat_swath)))
+    return lon_swath, lat_swath, np.broadcast_to(x_ac, lon_swath.shape)
+
+
+def test_footprint_coverage_keeps_every_gauge_with_pixels():
+    lon_swath, lat_swath, x_ac = footprint_grid()
+    rng = np.random.default_rng(2)
+    gauge_lon = rng.uniform(-1.5, 1.5, 400)
+    gauge_lat = rng.uniform(37, 43, 400)
+    rad = 10
+
+    covered = coloc.footprint_coverage(lon_swath, lat_swath, x_ac, gauge_lon, gauge_lat, rad)
+
+    # Reference: closest footprint point of each gauge (2 km across track spacing)
+    closest = np.array([coloc.haversine(lon_swath, lat_swath, g_lon, g_lat).min()
+                        for g_lon, g_lat in zip(gauge_lon, gauge_lat)])
+    np.testing.assert_array_equal(covered, closest <= rad + 2)
+    assert covered.any() and not covered.all()
+
+    # Pixels of the pass (between the points of the footprint grid): no gauge with pixels within the radius is skipped
+    lon = lon_swath.ravel() + rng.uniform(-0.01, 0.01, lon_swath.size)
+    lat = lat_swath.ravel() + rng.uniform(-0.009, 0.009, lat_swath.size)
+    in_radius, _ = brute_force(lon, lat, gauge_lon, gauge_lat, rad)
+    assert all(covered[idx] for idx in range(gauge_lon.size) if in_radius[idx].size > 0)
@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+
+import extraction_cache as cache
+import extraction_records as recs
+import ragged as rg
+
+columns = ['station', 'longitude', 'latitude', 'ssha', 'time', 'day', 'n_val', 'min_distance']
+
+
+# Function for obtaining the records of a file (some tide gauges without data)
+def file_records():
+    records = recs.allocate(4, columns)
+    records['station'][:] = np.arange(4)
+    records['longitude'][:] = [1.5, 2.0, 3.25, 4.0]
+    records['latitude'][:] = [38.0, 39.5, 40.0, 41.75]
+    records['ssha'][[0, 2]] = [12.5, -3.25]
+    records['time'][[0, 2]] = np.array(['2023-04-01T10:15:00', '2023-04-01T10:16:30'], dtype='datetime64[ns]')
+    records['day'][[0, 2]] = 19448
+    records['n_val'][[0, 2]] = [15, 3]
+    records['min_distance'][[0, 2]] = [0.5, 2.75]
+    return records
+
+
+def test_save_load_round_trip(tmp_path):
+    records = file_records()
+    cache.save_columns(str(tmp_path), 'key', records)
+
+    loaded = cache.load_columns(str(tmp_path), 'key', columns)
+    for column in columns:
+        assert loaded[column].dtype == records[column].dtype
+        np.testing.assert_array_equal(loaded[column], records[column])
+
+    # No temporary files left
+    assert os.listdir(tmp_path) == ['records_key.parquet']
+
+
+def test_load_missing_extraction_or_columns(tmp_path):
+    assert cache.load_columns(str(tmp_path), 'key', columns) is None
+
+    # Cached without some of the columns (e.g. by an older version of the script)
+    cache.save_columns(str(tmp_path), 'key', {column: values for column, values in file_records().items()
+                                              if column != 'day'})
+    assert cache.load_columns(str(tmp_path), 'key', columns) is None
+    assert cache.load_columns(str(tmp_path), 'key', ['station', 'ssha']) is not None
+
+
+def test_extraction_key_changes_with_the_inputs(tmp_path):
+    file_path = tmp_path / 'file.nc'
+    file_path.write_bytes(b'first content')
+    cache_path = str(tmp_path / 'cache')
+    gauges_key = cache.gauge_hash(['a', 'b'], [1.0, 2.0], [38.0, 39.0])
+
+    key = cache.extraction_key(str(file_path), 'SWOT L3', [6], gauges_key, cache_path)
+    assert key == cache.extraction_key([str(file_path)], 'SWOT L3', [6.0], gauges_key, cache_path)
+    assert key != cache.extraction_key(str(file_path), 'SWOT L3', [7], gauges_key, cache_path)
+    assert key != cache.extraction_key(str(file_path), 'DUACS', [6], gauges_key, cache_path)
+    assert key != cache.extraction_key(str(file_path), 'SWOT L3', [6],
+                                       cache.gauge_hash(['a', 'b'], [1.0, 2.5], [38.0, 39.0]), cache_path)
+
+    # Same file with another content (size and modification time change, the checksum is computed again)
+    file_path.write_bytes(b'second content, longer')
+    assert key != cache.extraction_key(str(file_path), 'SWOT L3', [6], gauges_key, cache_path)
+
+
+def test_raw_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    raw = {name: rg.from_arrays([None if n is None else rng.normal(0, 1, n) for n in [3, None, 0, 5]])
+           for name in ['ssha_raw', 'lat_within_radius', 'lon_within_radius']}
+    assert cache.load_raw(str(tmp_path), 'key', list(raw)) is None
+
+    cache.save_raw(str(tmp_path), 'key', raw)
+    loaded = cache.load_raw(str(tmp_path), 'key', list(raw))
+    for name in raw:
+        np.testing.assert_array_equal(loaded[name]['values'], raw[name]['values'])
+        np.testing.assert_array_equal(loaded[name]['offsets'], raw[name]['offsets'])
+
+    # Cached without some of the columns
+    assert cache.load_raw(str(tmp_path), 'key', ['ssha_raw', 'swot_lat_within_radius']) is None
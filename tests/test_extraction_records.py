@@ -0,0 +1,47 @@
+import numpy as np
+
+import extraction_records as recs
+
+columns = ['station', 'longitude', 'latitude', 'ssha', 'time', 'day', 'n_val', 'min_distance', 'product']
+
+
+def test_allocate_fills_the_missing_values():
+    records = recs.allocate(3, columns)
+
+    for column in columns:
+        assert records[column].dtype == np.dtype(recs.COLUMN_TYPES[column])
+        assert records[column].shape == (3,)
+    assert np.all(records['station'] == -1) and np.all(records['day'] == -1) and np.all(records['product'] == -1)
+    assert np.all(records['n_val'] == 0)
+    assert np.all(np.isnan(records['ssha'])) and np.all(np.isnan(records['min_distance']))
+    assert np.all(np.isnat(records['time']))
+
+
+def test_concatenate_keeps_the_order_and_the_types():
+    first, second = recs.allocate(2, columns), recs.allocate(3, columns)
+    first['station'][:] = [0, 1]
+    second['station'][:] = [2, 0, 1]
+
+    records = recs.concatenate([first, second], columns)
+    np.testing.assert_array_equal(records['station'], [0, 1, 2, 0, 1])
+    assert all(records[column].dtype == first[column].dtype for column in columns)
+
+    empty = recs.concatenate([], columns)
+    assert all(empty[column].size == 0 and empty[column].dtype == first[column].dtype for column in columns)
+
+
+def test_to_table_names_and_missing_indices():
+    records = recs.allocate(4, columns)
+    records['station'][:3] = [2, 0, 1]  # Last record without station
+    records['product'][:2] = [1, 0]  # Last two records without product
+    records['ssha'][:3] = [1.5, -2.0, 0.5]
+
+    table = recs.to_table(records, ['a', 'b', 'c'], 'station_name', ['SWOT L3', 'DUACS'])
+
+    assert list(table['station_name'][:3]) == ['c', 'a', 'b'] and table['station_name'].isna().tolist()[3]
+    assert list(table['product'][:2]) == ['DUACS', 'SWOT L3'] and table['product'].isna().tolist()[2:] == [True, True]
+    np.testing.assert_array_equal(table['ssha'].values, records['ssha'])
+    assert table['ssha'].dtype == np.float32 and table['time'].dtype == 'datetime64[ns]'
+
+    # Records without station are dropped with the records without data
+    assert len(table.dropna(how='any', subset=['station_name', 'ssha'])) == 3
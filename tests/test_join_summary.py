@@ -0,0 +1,58 @@
+import ast
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+import loess_smooth_handmade as loess
+import station_stats as stats
+
+script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'join_SWOT_CMEMS_processing.py')
+
+
+# Function for obtaining the code of the script (functions and statements of the radius loop) without running it
+def script_code():
+    with open(script) as f:
+        tree = ast.parse(f.read())
+    functions = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name == 'compute_combined_rmsd']
+    radius_loop = next(node for node in tree.body if isinstance(node, ast.For)
+                       and isinstance(node.target, ast.Name) and node.target.id == 'rad')
+
+    # Statements from the comparison of the daily arrays to the summary of the radius
+    body = radius_loop.body
+    start = next(i for i, node in enumerate(body) if isinstance(node, ast.Assign)
+                 and any(isinstance(target, ast.Name) and target.id == 'ssha_valid' for target in node.targets))
+    end = next(i for i, node in enumerate(body) if 'results_rad_comparison.append' in ast.unparse(node))
+    return (compile(ast.Module(body=functions, type_ignores=[]), script, 'exec'),
+            compile(ast.Module(body=body[start:end + 1], type_ignores=[]), script, 'exec'))
+
+
+def test_radius_summary_runs_on_daily_arrays():
+    functions, summary = script_code()
+    rng = np.random.default_rng(0)
+    n_stations, n_days = 5, 90
+    calendar = pd.date_range('2023-04-01', periods=n_days, freq='D')
+
+    # TG and 4 products (station x day), the last station without data in the products
+    signal = 10 * np.sin(np.arange(n_days) / 9) + rng.normal(0, 5, (n_stations, 1))
+    ssha = (signal + rng.normal(0, 2, (5, n_stations, n_days))).astype(np.float32)
+    ssha[1:, -1] = np.nan
+    ssha[rng.random(ssha.shape) < 0.1] = np.nan
+    min_distance = rng.uniform(0, 20, (4, n_stations, n_days)).astype(np.float32)
+    n_val = rng.integers(1, 50, (4, n_stations, n_days)).astype(np.float32)
+    valid = np.all(~np.isnan(ssha), axis=0)
+
+    namespace = {'np': np, 'pd': pd, 'math': math, 'loess': loess, 'stats': stats,
+                 'ssha': ssha, 'min_distance': min_distance, 'n_val': n_val, 'valid': valid,
+                 'calendar': calendar, 'day_window': 7, 'rad': 20, 'results_rad_comparison': [],
+                 'sorted_names': [f'station_{i}' for i in range(n_stations)],
+                 'ordered_lat': list(rng.uniform(36, 44, n_stations)),
+                 'ordered_lon': list(rng.uniform(0, 8, n_stations))}
+    exec(functions, namespace)
+    exec(summary, namespace)
+
+    result = namespace['results_rad_comparison'][0]
+    assert result['radius'] == 20 and result['n_tg_used_swot_l3'] == n_stations - 1
+    assert result['var_diff_swot_l3'] == np.mean(namespace['variances_diff_swot_l3'])
+    assert all(np.isfinite(value) for value in result.values())
@@ -0,0 +1,112 @@
+import numpy as np
+import xarray as xr
+
+import l4_products as l4
+
+
+# Function for calculating the Haversine distance between two points (reference of the scripts)
+def haversine(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    return 6371 * 2 * np.arcsin(np.sqrt(a))
+
+
+# Regular grid of an L4 product and tide gauges (one far from the grid, without cells within the radius)
+lon = np.arange(-2.0, 4.0, 0.125)
+lat = np.arange(36.0, 41.0, 0.125)
+gauge_lon = np.array([0.3, 2.61, -1.9, 10.0])
+gauge_lat = np.array([38.4, 39.95, 36.05, 45.0])
+rad = 25
+
+
+# Function for obtaining a daily sla field with land cells (NaN)
+def sla_field(seed=0):
+    rng = np.random.default_rng(seed)
+    sla = rng.normal(0, 0.1, (lat.size, lon.size))
+    sla[rng.random(sla.shape) < 0.15] = np.nan
+    return sla
+
+
+# Function for averaging the field within the radius of each gauge with a mask (as the original scripts)
+def brute_force_means(sla):
+    lon_grid, lat_grid = np.meshgrid(lon, lat)
+    means, n_val, counts, min_distance = [], [], [], []
+    for g_lon, g_lat in zip(gauge_lon, gauge_lat):
+        distances = haversine(lon_grid, lat_grid, g_lon, g_lat)
+        mask = distances <= rad
+        values = sla[mask]
+        means.append(np.nanmean(values) if np.any(~np.isnan(values)) else np.nan)
+        n_val.append(mask.sum())
+        counts.append(np.sum(~np.isnan(values)))
+        min_distance.append(distances[mask].min() if mask.any() else np.nan)
+    return np.array(means), np.array(n_val), np.array(counts), np.array(min_distance)
+
+
+def test_weight_matrix_matches_brute_force():
+    sla = sla_field()
+    expected_mean, expected_n_val, expected_counts, expected_min_distance = brute_force_means(sla)
+
+    weights = l4.build_weight_matrix(lon, lat, gauge_lon, gauge_lat, rad)
+    mean, counts = l4.apply_weights(weights, sla)
+
+    np.testing.assert_array_equal(weights['n_val'], expected_n_val)
+    np.testing.assert_allclose(weights['min_distance'], expected_min_distance)
+    np.testing.assert_array_equal(counts, expected_counts)
+    np.testing.assert_allclose(mean, expected_mean)
+    assert np.isnan(mean[-1]) and weights['n_val'][-1] == 0
+
+
+def test_weight_matrix_cache_round_trip(tmp_path):
+    l4._weights_loaded.clear()
+    built = l4.load_weight_matrix(lon, lat, gauge_lon, gauge_lat, rad, str(tmp_path))
+
+    # Loaded from disk (not from the matrices already loaded in this session)
+    l4._weights_loaded.clear()
+    loaded = l4.load_weight_matrix(lon, lat, gauge_lon, gauge_lat, rad, str(tmp_path))
+
+    assert loaded is not built
+    assert (loaded['matrix'] != built['matrix']).nnz == 0
+    np.testing.assert_array_equal(loaded['n_val'], built['n_val'])
+    np.testing.assert_array_equal(loaded['min_distance'], built['min_distance'])
+    assert loaded['grid_shape'] == built['grid_shape']
+    assert l4.load_weight_matrix(lon, lat, gauge_lon, gauge_lat, rad, str(tmp_path)) is loaded
+
+
+# Function for writing daily files of an L4 product (larger than the lolabox window)
+def daily_files(folder, n_days):
+    paths = []
+    for day in range(n_days):
+        sla = np.pad(sla_field(day), 4, constant_values=9.0)[np.newaxis]
+        ds = xr.Dataset({'sla': (('time', 'latitude', 'longitude'), sla)},
+                        coords={'time': [np.datetime64('2023-04-01') + np.timedelta64(day, 'D')],
+                                'latitude': np.concatenate([lat[0] - 0.125 * np.arange(4, 0, -1), lat,
+                                                            lat[-1] + 0.125 * np.arange(1, 5)]),
+                                'longitude': np.concatenate([lon[0] - 0.125 * np.arange(4, 0, -1), lon,
+                                                             lon[-1] + 0.125 * np.arange(1, 5)])})
+        paths.append(str(folder / f'l4_{day}.nc'))
+        ds.to_netcdf(paths[-1])
+    return paths
+
+
+def test_time_cube_series_match_daily_fields(tmp_path):
+    files = daily_files(tmp_path, 5)
+    lolabox = [lon[0], lon[-1], lat[0], lat[-1]]
+
+    cube = l4.load_time_cube(files, lolabox)
+    np.testing.assert_allclose(cube['longitude'], lon)
+    np.testing.assert_allclose(cube['latitude'], lat)
+    np.testing.assert_array_equal(cube['time'], np.datetime64('2023-04-01') + np.arange(5).astype('timedelta64[D]'))
+
+    # Series of all the gauges (chunks of 2 days) against the average of each daily field
+    weights = l4.build_weight_matrix(cube['longitude'], cube['latitude'], gauge_lon, gauge_lat, rad)
+    mean, counts = l4.extract_gauge_series(weights, cube['sla'], chunk_size=2)
+    for day in range(5):
+        expected_mean, expected_counts = l4.apply_weights(weights, sla_field(day).astype(np.float32))
+        np.testing.assert_allclose(mean[:, day], expected_mean, rtol=1e-6)
+        np.testing.assert_array_equal(counts[:, day], expected_counts)
+
+    # Same cube stored in a memory-mapped file
+    memmap_cube = l4.load_time_cube(files, lolabox, memmap_path=str(tmp_path / 'cube.npy'))
+    np.testing.assert_array_equal(memmap_cube['sla'], cube['sla'])
@@ -0,0 +1,157 @@
+import numpy as np
+import pytest
+
+import loess_smooth_handmade as loess
+
+
+# Function for the LOESS of the baseline (loop over the output points with a least squares fit for each one)
+def reference_loess(data, fc, step=1, t=np.nan, t_final=np.nan):
+    if np.all(np.isnan(t)):
+        t = np.arange(0, len(data)*step, step)
+    if np.all(np.isnan(t_final)):
+        t_final = t
+
+    id_nonan = np.where(~np.isnan(data))
+    t = t[id_nonan]
+    data = data[id_nonan]
+    tau = 1/fc
+    data_smooth = np.ones(t_final.shape)*np.nan
+
+    for i in np.where(np.logical_and(t_final >= t.min(), t_final <= t.max()))[0]:
+        dn_tot = np.abs(t - t_final[i])/tau
+        idx_weights = np.where(dn_tot < 1)
+        n_pts = len(idx_weights[0])
+        if n_pts > 3:
+            weights = (1 - dn_tot[idx_weights]**3)**3
+            X = np.stack((np.ones((n_pts,)), t[idx_weights], t[idx_weights]**2)).T
+            W = np.diag(weights)
+            coeff = np.linalg.lstsq(np.dot(W, X), np.dot(W, data[idx_weights]), rcond=None)[0]
+            data_smooth[i] = coeff[0] + coeff[1]*t_final[i] + coeff[2]*t_final[i]**2
+    return data_smooth
+
+
+# Function for obtaining a noisy serie with a seasonal signal and NaN gaps
+def noisy_serie(n, seed=0, gaps=True):
+    rng = np.random.default_rng(seed)
+    data = np.sin(np.arange(n)*2*np.pi/30) + rng.normal(0, 0.3, n)
+    if gaps:
+        data[rng.random(n) < 0.1] = np.nan
+        data[40:55] = np.nan
+    return data
+
+
+@pytest.mark.parametrize('fc', [1/7, 1/20])
+def test_regular_serie(fc):
+    data = noisy_serie(200)
+    np.testing.assert_allclose(loess.loess_smooth_handmade(data, fc), reference_loess(data, fc), rtol=1e-7, atol=1e-9)
+
+
+def test_irregular_coordinates_and_output_points():
+    rng = np.random.default_rng(1)
+    t = np.sort(rng.uniform(0, 100, 150))
+    data = np.sin(t/5) + rng.normal(0, 0.2, t.size)
+    t_final = np.linspace(-5, 105, 80)  # Some points out of the range of t
+
+    smooth = loess.loess_smooth_handmade(data, 1/10, t=t, t_final=t_final)
+
+    np.testing.assert_allclose(smooth, reference_loess(data, 1/10, t=t, t_final=t_final), rtol=1e-7, atol=1e-9)
+    assert np.isnan(smooth[t_final < t.min()]).all()
+
+
+def test_too_few_neighbours():
+    # Window of less than 4 samples: no polynomial fit (NaN), as the reference
+    data = noisy_serie(30, gaps=False)
+    np.testing.assert_array_equal(loess.loess_smooth_handmade(data, 1/2), reference_loess(data, 1/2))
+    assert np.isnan(loess.loess_smooth_handmade(data, 1/2)).all()
+
+
+def test_convolution_kernel():
+    # Regular serie without gaps: interior points from the kernel, edges from the exact solve
+    data = noisy_serie(300, gaps=False)
+    interior, values = loess._loess_convolution(data, 1/10, 1)
+
+    kernel = loess._loess_kernel(1/10, 1)
+    m = kernel.size // 2
+    assert interior[m:-m].all() and not interior[:m].any() and not interior[-m:].any()
+    np.testing.assert_allclose(values[interior], reference_loess(data, 1/10)[interior], rtol=1e-7, atol=1e-9)
+    np.testing.assert_allclose(loess.loess_smooth_handmade(data, 1/10), reference_loess(data, 1/10),
+                               rtol=1e-7, atol=1e-9)
+
+
+def test_convolution_excludes_gaps():
+    data = noisy_serie(300, gaps=False)
+    data[100] = np.nan
+    interior, _ = loess._loess_convolution(data, 1/10, 1)
+
+    m = loess._loess_kernel(1/10, 1).size // 2
+    assert not interior[100 - m:100 + m + 1].any()
+    assert interior[100 - m - 1] and interior[100 + m + 1]
+
+
+@pytest.mark.parametrize('step', [0.5, 2])
+def test_regular_step(step):
+    data = noisy_serie(200)
+    np.testing.assert_allclose(loess.loess_smooth_handmade(data, 1/10, step=step),
+                               reference_loess(data, 1/10, step=step), rtol=1e-7, atol=1e-9)
+
+
+def test_batch_matches_each_serie():
+    data = np.stack([noisy_serie(120, seed=seed) for seed in range(5)])
+    data[2] = np.nan  # Serie without data
+    data[3, :100] = np.nan  # Serie with data only at the end
+
+    smooth = loess.loess_smooth_batch(data, 1/10)
+
+    expected = np.stack([reference_loess(serie, 1/10) if np.any(~np.isnan(serie)) else np.full(serie.shape, np.nan)
+                         for serie in data])
+    np.testing.assert_allclose(smooth, expected, rtol=1e-7, atol=1e-9)
+
+
+def test_datetime_coordinates():
+    # Irregular SWOT like times (days with several overpasses, missing days)
+    rng = np.random.default_rng(2)
+    days = np.sort(rng.choice(np.arange(0, 200, 0.25), 300, replace=False))
+    t = np.datetime64('2023-05-01', 'ns') + (days*86400e9).astype('timedelta64[ns]')
+    data = np.sin(days/10) + rng.normal(0, 0.2, days.size)
+
+    smooth = loess.loess_smooth_handmade(data, 1/20, t=t)
+
+    np.testing.assert_allclose(smooth, loess.loess_smooth_handmade(data, 1/20, t=loess._to_days(t)), rtol=1e-9)
+    t_days = loess._to_days(t) - loess._to_days(t)[0]  # Same filter on small coordinates for the reference
+    np.testing.assert_allclose(smooth, reference_loess(data, 1/20, t=t_days), rtol=1e-6, atol=1e-8)
+
+
+def test_missing_times_are_ignored():
+    days = np.arange(100.0)
+    data = noisy_serie(100, gaps=False)
+    t = np.datetime64('2023-05-01', 'ns') + (days*86400e9).astype('timedelta64[ns]')
+    t[10] = np.datetime64('NaT')
+
+    smooth = loess.loess_smooth_handmade(data, 1/10, t=t)
+
+    keep = np.arange(100) != 10
+    np.testing.assert_allclose(smooth[keep], reference_loess(data[keep], 1/10, t=days[keep]), rtol=1e-7, atol=1e-9)
+    assert np.isnan(smooth[10])
+
+
+@pytest.mark.parametrize('hours', [24, 1])
+def test_evenly_spaced_times_use_the_kernel(monkeypatch, hours):
+    calls = []
+    convolution = loess._loess_convolution
+    monkeypatch.setattr(loess, '_loess_convolution', lambda *args: calls.append(args[2]) or convolution(*args))
+
+    # Daily or hourly times (fc in 1/days) with NaN gaps in the data
+    data = noisy_serie(300)
+    days = np.arange(300)*hours/24
+    t = np.datetime64('2023-05-01', 'ns') + np.arange(300)*np.timedelta64(hours, 'h')
+
+    smooth = loess.loess_smooth_handmade(data, 1/7, t=t)
+
+    assert len(calls) == 1 and np.isclose(calls[0], hours/24)
+    np.testing.assert_allclose(smooth, reference_loess(data, 1/7, t=days), rtol=1e-7, atol=1e-9)
+
+    # Uneven times (a missing day) are solved point by point
+    calls.clear()
+    keep = np.arange(300) != 150
+    loess.loess_smooth_handmade(data[keep], 1/7, t=t[keep])
+    assert calls == []
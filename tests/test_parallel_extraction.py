@@ -0,0 +1,86 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+import parallel_extraction as parallel
+
+
+# Function for extracting a fake file (process id to check which worker extracted it)
+def extract(filename, offset):
+    return filename, int(filename[-6:-3]) + offset, os.getpid()
+
+
+# Function for reading a fake file
+def load(filename):
+    return np.full(3, int(filename[-6:-3]))
+
+
+# Function for extracting a fake file already read
+def extract_loaded(filename, data, offset):
+    return filename, int(data.sum()) + offset
+
+
+filenames = [f'SWOT_L3_LR_SSH_Expert_{day:03d}_20230401T{day:06d}_{day:03d}.nc' for day in range(40)]
+
+
+def test_sort_by_time():
+    names = ['cmems_20230402.nc', 'SWOT_001_20230401T120000_20230401T130000.nc', 'cmems_20230401.nc',
+             'SWOT_002_20230401T080000_20230401T090000.nc', 'no_date.nc']
+    assert parallel.sort_by_time(names) == ['no_date.nc', 'cmems_20230401.nc',
+                                            'SWOT_002_20230401T080000_20230401T090000.nc',
+                                            'SWOT_001_20230401T120000_20230401T130000.nc', 'cmems_20230402.nc']
+
+
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_extract_files_keeps_the_order(n_workers):
+    expected = [(filename, int(filename[-6:-3]) + 100) for filename in filenames]
+
+    results = parallel.extract_files(extract, filenames, n_workers, offset=100)
+
+    assert [result[:2] for result in results] == expected
+    if n_workers == 1:
+        assert {result[2] for result in results} == {os.getpid()}
+
+
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_extract_files_with_load(n_workers):
+    expected = [(filename, 3 * int(filename[-6:-3]) + 100) for filename in filenames]
+    assert parallel.extract_files(extract_loaded, filenames, n_workers, load=load, prefetch_depth=2,
+                                  offset=100) == expected
+
+
+def test_extract_files_without_files():
+    assert parallel.extract_files(extract, [], None, offset=100) == []
+
+
+def test_prefetch_order_and_depth():
+    loaded = []  # Files read and not processed yet
+    lock = threading.Lock()
+
+    def load_file(filename):
+        with lock:
+            loaded.append(filename)
+        return filename.upper()
+
+    results = []
+    for filename, data in parallel.prefetch(load_file, filenames, depth=3):
+        with lock:
+            # The file being processed and at most depth - 1 files read ahead
+            assert len(loaded) <= 3
+            loaded.remove(filename)
+        results.append((filename, data))
+
+    assert results == [(filename, filename.upper()) for filename in filenames]
+
+
+def test_prefetch_raises_the_errors_of_the_reading():
+    def load_file(filename):
+        if filename == filenames[5]:
+            raise OSError(f'Cannot read {filename}')
+        return filename
+
+    with pytest.raises(OSError, match='Cannot read'):
+        for _ in parallel.prefetch(load_file, filenames, depth=2):
+            pass
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+import ragged as rg
+
+
+# Function for obtaining the values within the radius of several records (None: record without data)
+def record_arrays(seed=0):
+    rng = np.random.default_rng(seed)
+    return [None if n is None else rng.normal(0, 1, n) for n in [3, None, 0, 5, 1, None]]
+
+
+def test_from_arrays_rows_match_the_arrays():
+    arrays = record_arrays()
+    ragged = rg.from_arrays(arrays)
+
+    assert ragged['offsets'].size == len(arrays) + 1
+    for i, a in enumerate(arrays):
+        expected = np.empty(0) if a is None else a.astype(np.float32)
+        np.testing.assert_array_equal(rg.row(ragged, i), expected)
+
+
+def test_from_arrays_without_data():
+    ragged = rg.from_arrays([None, None])
+    assert ragged['values'].size == 0
+    np.testing.assert_array_equal(ragged['offsets'], [0, 0, 0])
+
+
+def test_concatenate_matches_the_list_of_all_the_arrays():
+    files = [record_arrays(seed) for seed in range(3)]
+    ragged = rg.concatenate([rg.from_arrays(arrays) for arrays in files] + [rg.empty(2)])
+
+    # Rows of all the files one after the other, then the empty rows
+    arrays = [a for arrays in files for a in arrays] + [None, None]
+    assert ragged['offsets'].size == len(arrays) + 1
+    for i, a in enumerate(arrays):
+        expected = np.empty(0) if a is None else a.astype(np.float32)
+        np.testing.assert_array_equal(rg.row(ragged, i), expected)
+
+
+def test_concatenate_nothing():
+    ragged = rg.concatenate([])
+    assert ragged['values'].size == 0
+    np.testing.assert_array_equal(ragged['offsets'], [0])
+
+
+def test_from_matrix_rows():
+    matrix = np.arange(12.0).reshape(3, 4)
+    ragged = rg.from_matrix(matrix)
+
+    assert rg.n_rows(ragged) == 3
+    for i in range(3):
+        np.testing.assert_array_equal(rg.row(ragged, i), matrix[i])
+
+
+def test_take_matches_the_selected_arrays():
+    arrays = record_arrays()
+    ragged = rg.from_arrays(arrays)
+
+    # Rows kept after dropna (records with data), in any order and repeated
+    for rows in [[0, 3, 4], [5, 1, 2], [3, 0, 3], []]:
+        taken = rg.take(ragged, rows)
+        assert rg.n_rows(taken) == len(rows)
+        for i, row in enumerate(rows):
+            np.testing.assert_array_equal(rg.row(taken, i), rg.row(ragged, row))
+
+
+def test_arrow_round_trip():
+    ragged = rg.from_arrays(record_arrays())
+    array = rg.to_arrow(ragged)
+
+    assert len(array) == rg.n_rows(ragged)
+    assert array[3].as_py() == rg.row(ragged, 3).tolist()
+
+    # Sliced arrays keep their own offsets
+    back = rg.from_arrow(array.slice(3))
+    np.testing.assert_array_equal(back['offsets'], ragged['offsets'][3:] - ragged['offsets'][3])
+    np.testing.assert_array_equal(back['values'], ragged['values'][ragged['offsets'][3]:])
+
+
+@pytest.mark.parametrize('n_files', [0, 1, 3])
+def test_parquet_round_trip(tmp_path, n_files):
+    raggeds = {'ssha_raw': rg.concatenate([rg.from_arrays(record_arrays(seed)) for seed in range(n_files)]),
+               'lat_within_radius': rg.concatenate([rg.from_arrays(record_arrays(seed + 10)) for seed in range(n_files)])}
+    file_path = str(tmp_path / 'raw.parquet')
+    rg.save_parquet(file_path, raggeds)
+
+    loaded = rg.load_parquet(file_path)
+    assert set(loaded) == set(raggeds)
+    for name, ragged in raggeds.items():
+        assert loaded[name]['values'].dtype == ragged['values'].dtype
+        np.testing.assert_array_equal(loaded[name]['values'], ragged['values'])
+        np.testing.assert_array_equal(loaded[name]['offsets'], ragged['offsets'])
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+import station_stats as stats
+
+
+# Function for obtaining the compared series of several stations (different lengths and NaNs, as after the
+# outliers of each serie are removed and the LOESS leaves NaNs at the edges)
+def compared_table(seed=0):
+    rng = np.random.default_rng(seed)
+    tables = []
+    for station, (n_product, n_reference) in enumerate([(40, 40), (30, 35), (12, 10), (1, 5), (0, 8), (3, 0)]):
+        product = pd.Series(rng.normal(0, 3, n_product))
+        reference = pd.Series(rng.normal(0, 2, n_reference))
+        product[rng.random(n_product) < 0.1] = np.nan
+        tables.append(pd.DataFrame({'station': f'station_{station}', 'product': product, 'reference': reference}))
+    return pd.concat(tables, ignore_index=True)
+
+
+def test_grouped_stats_match_pandas_loop():
+    table = compared_table()
+    stations = [f'station_{station}' for station in range(7)]  # Last station without rows
+
+    result = stats.grouped_stats(table, 'station', stations, 'reference', ['product'])['product']
+
+    for station in stations:
+        # Reference: pandas methods on the rows of the station (aligned by row, as in the comparison loops)
+        rows = table[table['station'] == station].reset_index(drop=True)
+        product, reference = rows['product'], rows['reference']
+        expected = {'correlation': product.corr(reference),
+                    'rmsd': np.sqrt(np.mean((product - reference) ** 2)),
+                    'var': product.var(),
+                    'var_reference': reference.var(),
+                    'var_diff': (product - reference).var(),
+                    'n': int((product.notna() & reference.notna()).sum())}
+        for name, value in expected.items():
+            np.testing.assert_allclose(result.loc[station, name], value, rtol=1e-9, err_msg=f'{station} {name}')
+
+
+
+def test_dense_stats_match_pandas():
+    rng = np.random.default_rng(1)
+    values = rng.normal(0, 3, (2, 4, 50))
+    reference = rng.normal(0, 2, (4, 50))
+    valid = rng.random((2, 4, 50)) < 0.7
+    valid[0, 3] = False  # Serie without valid days
+
+    result = stats.dense_stats(values, reference, valid)
+
+    for i in range(2):
+        for j in range(4):
+            product = pd.Series(np.where(valid[i, j], values[i, j], np.nan))
+            serie_reference = pd.Series(np.where(valid[i, j], reference[j], np.nan))
+            np.testing.assert_allclose(result['correlation'][i, j], product.corr(serie_reference), rtol=1e-9)
+            np.testing.assert_allclose(result['rmsd'][i, j], np.sqrt(np.mean((product - serie_reference) ** 2)), rtol=1e-9)
+            np.testing.assert_allclose(result['var'][i, j], product.var(), rtol=1e-9)
+            np.testing.assert_allclose(result['var_reference'][i, j], serie_reference.var(), rtol=1e-9)
+            np.testing.assert_allclose(result['var_diff'][i, j], (product - serie_reference).var(), rtol=1e-9)
+            assert result['n'][i, j] == valid[i, j].sum()
+
+
+
+def test_daily_means():
+    codes = np.array([0, 0, 1, 1, 1, -1, 2])
+    days = np.array([0, 0, 2, 2, 5, 0, 1])  # Day 5 outside the grid, code -1 without station
+    values = np.array([[1.0, 10.0], [3.0, np.nan], [2.0, 4.0], [4.0, 6.0], [9.0, 9.0], [7.0, 7.0], [np.nan, 5.0]])
+
+    means, counts = stats.daily_means(codes, days, values, n_stations=3, n_days=3)
+
+    # Reference: pandas groupby of the samples inside the grid
+    frame = pd.DataFrame(values, columns=['a', 'b'])
+    frame['station'] = codes
+    frame['day'] = days
+    frame = frame[(frame['station'] >= 0) & (frame['day'] < 3)]
+    expected = frame.groupby(['station', 'day']).mean()
+    expected_counts = frame.groupby(['station', 'day']).count()
+    for (station, day), row in expected.iterrows():
+        np.testing.assert_allclose(means[station, day], row.values)
+        np.testing.assert_array_equal(counts[station, day], expected_counts.loc[(station, day)].values)
+
+    assert np.isnan(means[2, 0]).all() and (counts[2, 0] == 0).all()
+    assert np.isnan(means[2, 1, 0]) and means[2, 1, 1] == 5.0
@@ -0,0 +1,110 @@
+import numpy as np
+import netCDF4 as nc
+import pytest
+
+import swot_reader
+
+
+# Function for writing a small SWOT L3 like file (lines x pixels, packed SSH with fill value and valid range)
+def write_l3_file(file_path, time_units='seconds since 2000-01-01 00:00:00.0', time_values=None):
+    n_lines, n_pixels = 50, 4
+    with nc.Dataset(file_path, 'w') as ds:
+        ds.createDimension('num_lines', n_lines)
+        ds.createDimension('num_pixels', n_pixels)
+
+        lat = ds.createVariable('latitude', 'i4', ('num_lines', 'num_pixels'), fill_value=2147483647)
+        lat.scale_factor = 1e-6
+        lat[:] = np.linspace(35, 45, n_lines)[:, None] + np.arange(n_pixels) * 0.01
+
+        lon = ds.createVariable('longitude', 'i4', ('num_lines', 'num_pixels'), fill_value=2147483647)
+        lon.scale_factor = 1e-6
+        lon[:] = np.full((n_lines, n_pixels), 3.0) + np.arange(n_pixels) * 0.02
+
+        ssh = ds.createVariable('ssha_noiseless', 'i4', ('num_lines', 'num_pixels'), fill_value=2147483647)
+        ssh.scale_factor = 1e-4
+        ssh.add_offset = 0.5
+        ssh.valid_min = -10000
+        ssh.valid_max = 10000
+        ssh.set_auto_maskandscale(False)
+        packed = np.arange(n_lines * n_pixels, dtype=np.int32).reshape(n_lines, n_pixels) * 50 - 5000
+        packed[3, 1] = 2147483647  # Fill value
+        packed[4, 2] = 20000  # Out of the valid range
+        ssh[:] = packed
+
+        time = ds.createVariable('time', 'f8', ('num_lines',), fill_value=np.nan)
+        time.units = time_units
+        time.calendar = 'gregorian'
+        time[:] = np.arange(n_lines) * 1.5 + 7.25e8 if time_values is None else time_values
+
+
+@pytest.fixture
+def l3_file(tmp_path):
+    file_path = str(tmp_path / 'SWOT_L3_LR_SSH_Expert_001_003_20230501T000000_20230501T010000_v1.0.nc')
+    write_l3_file(file_path)
+    return file_path
+
+
+def test_read_matches_netcdf4_decoding(l3_file):
+    swot = swot_reader.read_swot_l3(l3_file)
+
+    # Reference: automatic masking and scaling of netCDF4 (fill value and valid range) as float64
+    with nc.Dataset(l3_file) as ds:
+        for name, variable in [('ssh', 'ssha_noiseless'), ('latitude', 'latitude'), ('longitude', 'longitude')]:
+            expected = np.ma.filled(ds.variables[variable][:].astype(np.float64), np.nan)
+            assert swot[name].dtype == np.float32
+            np.testing.assert_allclose(swot[name], expected, rtol=1e-6, atol=1e-6)
+        expected_time = nc.num2date(ds.variables['time'][:], ds.variables['time'].units, 'gregorian',
+                                    only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+
+    assert np.isnan(swot['ssh'][3, 1]) and np.isnan(swot['ssh'][4, 2])
+    np.testing.assert_array_equal(swot['time'], np.array(expected_time, dtype='datetime64[ns]'))
+
+
+def test_latitude_crop(l3_file):
+    full = swot_reader.read_swot_l3(l3_file)
+    swot = swot_reader.read_swot_l3(l3_file, lat_range=(40, 41))
+
+    lines = np.flatnonzero((full['latitude'].max(axis=1) >= 40) & (full['latitude'].min(axis=1) <= 41))
+    assert swot['first_line'] == lines[0]
+    np.testing.assert_array_equal(swot['ssh'], full['ssh'][lines[0]:lines[-1] + 1])
+    np.testing.assert_array_equal(swot['time'], full['time'][lines[0]:lines[-1] + 1])
+
+
+def test_latitude_crop_without_lines(l3_file):
+    swot = swot_reader.read_swot_l3(l3_file, lat_range=(60, 61))
+    pixels = swot_reader.valid_pixels(swot)
+
+    assert swot['ssh'].shape == (0, 4) and swot['time'].size == 0
+    assert pixels['ssh'].size == 0
+    assert np.isnat(swot_reader.overpass_time(pixels, []))
+
+
+def test_time_units_and_missing_times(tmp_path):
+    file_path = str(tmp_path / 'days.nc')
+    write_l3_file(file_path, time_units='days since 2023-05-01', time_values=np.r_[np.nan, np.arange(49) / 24])
+
+    swot = swot_reader.read_swot_l3(file_path)
+
+    assert np.isnat(swot['time'][0])
+    assert swot['time'][1] == np.datetime64('2023-05-01T00:00', 'ns')
+    assert swot['time'][25] == np.datetime64('2023-05-02T00:00', 'ns')
+
+
+def test_pixel_time(l3_file):
+    swot = swot_reader.read_swot_l3(l3_file)
+    pixels = swot_reader.valid_pixels(swot)
+
+    # Reference: time repeated for every pixel of the swath and flattened with the valid mask
+    valid = ~np.isnan(swot['ssh'])
+    expected = np.tile(swot['time'][:, None], (1, valid.shape[1]))[valid]
+
+    indices = np.arange(pixels['ssh'].size)
+    np.testing.assert_array_equal(swot_reader.pixel_time(pixels, indices), expected)
+    assert swot_reader.overpass_time(pixels, [40, 7, 12]) == expected[40]
+
+
+def test_helpers():
+    name = 'SWOT_L3_LR_SSH_Expert_001_016_20230501T000000_20230501T010000_v1.0.nc'
+    assert swot_reader.swot_pass_number(name) == '016'
+    assert swot_reader.swot_pass_number('other.nc') is None
+    assert swot_reader.day_index(np.array(['1970-01-02T23:00'], dtype='datetime64[ns]'))[0] == 1
@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import tg_store as tgs
+
+
+# Function for obtaining a tide gauge table (daily values with NaNs, stations with different time spans)
+def tg_frame(seed=0):
+    rng = np.random.default_rng(seed)
+    tables = []
+    for station, (start, n_days) in enumerate([('2023-03-01', 120), ('2023-04-15', 60), ('2023-01-01', 365)]):
+        ssha = rng.normal(0, 5, n_days)
+        ssha[rng.random(n_days) < 0.3] = np.nan
+        tables.append(pd.DataFrame({'time': pd.date_range(start, periods=n_days, freq='D'),
+                                    'ssha': ssha, 'station': f'station_{station}'}))
+    return pd.concat(tables, ignore_index=True)
+
+
+@pytest.mark.parametrize('start_date, end_date', [('2023-04-01', '2023-06-30'), ('2023-03-01', '2023-03-01'),
+                                                  ('2022-01-01', '2024-01-01'), ('2023-08-01', '2023-07-01')])
+def test_window_counts_match_the_masked_table(start_date, end_date):
+    df_tg = tg_frame()
+    coverage = tgs.coverage_index(df_tg)
+
+    for station in ['station_0', 'station_1', 'station_2', 'station_missing']:
+        # Reference: rows of the station within the window (as in the comparison loops)
+        window = df_tg[df_tg['station'] == station].set_index('time')[start_date:end_date]
+
+        n_samples, n_valid = tgs.window_counts(coverage, station, start_date, end_date)
+        assert n_samples == len(window)
+        assert n_samples - n_valid == window['ssha'].isna().sum()
+
+
+# Function for writing the tide gauge files (npz with station x time arrays and csv with the names)
+def tg_files(folder, seed=0):
+    rng = np.random.default_rng(seed)
+    n_stations, n_days = 5, 30
+    resid = rng.normal(0, 0.05, (n_stations, n_days))
+    resid[rng.random(resid.shape) < 0.2] = np.nan
+    time = np.tile(19358 + np.arange(n_days, dtype=float), (n_stations, 1))  # Days since 1970-01-01
+    lon = np.array([[5.3], [6.9], [3.1], [6.9], [-0.5]])  # Two stations at the same longitude
+    lat = rng.uniform(36, 44, (n_stations, 1))
+    npz_file, names_file = str(folder / 'tg.npz'), str(folder / 'tg_names')
+    np.savez(npz_file, resdacTOTday=resid, timeTOTday=time, latTOT=lat, lonTOT=lon)
+    pd.DataFrame([f'Port_{i}' for i in range(n_stations)]).to_csv(names_file, header=False, index=False)
+    return npz_file, names_file
+
+
+# Function for building the tide gauge table as the original scripts (one DataArray per station)
+def reference_table(npz_file, names_file):
+    data_tg = np.load(npz_file)
+    names_tg = pd.read_csv(names_file, header=None)
+    sla = data_tg.get('resdacTOTday') * 100
+    lon_tg = data_tg.get('lonTOT')
+    time_datetime = pd.Timestamp('1970-01-01').to_numpy() + np.array(data_tg.get('timeTOTday'), dtype='timedelta64[D]')
+
+    # Stations sorted by longitude from east to west
+    stations = sorted(range(lon_tg.size), key=lambda i: lon_tg[i].item(), reverse=True)
+    return pd.concat([pd.DataFrame({'time': time_datetime[i, :], 'ssha': sla[i, :],
+                                    'station': [f'station_{names_tg[0][i]}'] * sla.shape[1],
+                                    'latitude': data_tg.get('latTOT')[i].item(), 'longitude': lon_tg[i].item()})
+                      for i in stations], ignore_index=True)
+
+
+def test_tg_table_matches_the_data_array_build(tmp_path):
+    npz_file, names_file = tg_files(tmp_path)
+
+    store = tgs.load_tg(npz_file, names_file)
+    pd.testing.assert_frame_equal(tgs.tg_table(store), reference_table(npz_file, names_file), check_dtype=False)
+    assert list(store['names']) == ['station_Port_1', 'station_Port_3', 'station_Port_0', 'station_Port_2',
+                                    'station_Port_4']
+
+
+def test_load_tg_cache_round_trip(tmp_path):
+    npz_file, names_file = tg_files(tmp_path)
+    cache_path = str(tmp_path / 'cache')
+
+    built = tgs.load_tg(npz_file, names_file, cache_path)
+    cache_files = [f for f in os.listdir(cache_path) if f.startswith('tg_store_')]
+    assert len(cache_files) == 1
+    modified = os.stat(os.path.join(cache_path, cache_files[0])).st_mtime_ns
+
+    # Read from the cache (not written again)
+    cached = tgs.load_tg(npz_file, names_file, cache_path)
+    assert os.stat(os.path.join(cache_path, cache_files[0])).st_mtime_ns == modified
+    assert set(cached) == set(built)
+    for name in built:
+        np.testing.assert_array_equal(cached[name], built[name])
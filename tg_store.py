@@ -0,0 +1,106 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import extraction_cache as cache  # for the checksums of the tide gauge files
+
+
+def load_tg(npz_file, names_file, cache_path=None):
+    """
+    Load the daily tide gauge residuals (npz file) and the station names (csv file) into a columnar store with
+    the stations sorted by longitude from east to west: names ('station_<name>'), longitude, latitude, and the
+    time and ssha (cm) arrays (station x time). order is the index of each station in the files.
+    If cache_path is given, the store is cached there in binary form (rebuilt when the files change).
+    """
+    if cache_path is not None:
+        sha = hashlib.sha1()
+        for file_path in (npz_file, names_file):
+            sha.update(cache.file_checksum(file_path, cache_path).encode())
+        cache_file = os.path.join(cache_path, f'tg_store_{sha.hexdigest()}.npz')
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                return {name: cached[name] for name in cached.files}
+
+    data_tg = np.load(npz_file)
+    names_tg = pd.read_csv(names_file, header=None)
+
+    sla = data_tg.get('resdacTOTday') * 100  # Convert to centimeters (cm)
+    lat_tg = np.asarray(data_tg.get('latTOT'), dtype=np.float64).ravel()
+    lon_tg = np.asarray(data_tg.get('lonTOT'), dtype=np.float64).ravel()
+
+    # Convert datenum into datetime
+    time_days = np.array(data_tg.get('timeTOTday'), dtype='timedelta64[D]')
+    time_datetime = pd.Timestamp('1970-01-01').to_numpy() + time_days
+
+    # Order by longitude from east to west (stable for stations at the same longitude)
+    order = np.argsort(-lon_tg, kind='stable')
+    names = np.array([f'station_{name}' for name in names_tg[0].values[:lon_tg.size]])
+
+    store = {'names': names[order],
+             'longitude': lon_tg[order],
+             'latitude': lat_tg[order],
+             'time': time_datetime[order],
+             'ssha': sla[order],
+             'order': order}
+
+    if cache_path is not None:
+        os.makedirs(cache_path, exist_ok=True)
+        np.savez(f'{cache_file}.{os.getpid()}.tmp.npz', **store)
+        os.replace(f'{cache_file}.{os.getpid()}.tmp.npz', cache_file)
+
+    return store
+
+
+def tg_table(store):
+    """
+    Table of the tide gauge data with one row per station and time (columns time, ssha, station, latitude
+    and longitude), stations in the order of the store.
+    """
+    n_times = store['ssha'].shape[1]
+    return pd.DataFrame({'time': store['time'].ravel(),
+                         'ssha': store['ssha'].ravel(),
+                         'station': np.repeat(store['names'], n_times),
+                         'latitude': np.repeat(store['latitude'], n_times),
+                         'longitude': np.repeat(store['longitude'], n_times)})
+
+
+def coverage_index(df_tg):
+    """
+    Cumulative number of samples and of valid (non NaN) samples of each station of a tide gauge table
+    (columns station, time and ssha) along the common time grid of the table, so the samples and NaNs of
+    any station and time window are counted with two lookups (window_counts).
+    """
+    station_codes, stations = pd.factorize(df_tg['station'])
+    time = pd.to_datetime(df_tg['time']).values
+    times = np.unique(time[~np.isnat(time)])
+
+    # Rows with a time on the grid
+    time_codes = np.searchsorted(times, time)
+    on_grid = ~np.isnat(time) & (station_codes >= 0)
+
+    # Samples of each station on each time (station x time), with a leading column of zeros
+    n_samples = np.zeros((len(stations), times.size + 1), dtype=np.int64)
+    n_valid = np.zeros((len(stations), times.size + 1), dtype=np.int64)
+    valid = on_grid & ~np.isnan(df_tg['ssha'].values.astype(float))
+    np.add.at(n_samples, (station_codes[on_grid], time_codes[on_grid] + 1), 1)
+    np.add.at(n_valid, (station_codes[valid], time_codes[valid] + 1), 1)
+
+    return {'stations': {name: i for i, name in enumerate(stations)},
+            'time': times,
+            'n_samples': np.cumsum(n_samples, axis=1),
+            'n_valid': np.cumsum(n_valid, axis=1)}
+
+
+def window_counts(coverage, station, start_date, end_date):
+    """
+    Number of samples and of valid samples of a station between start_date and end_date (both included).
+    """
+    i = coverage['stations'].get(station)
+    if i is None:
+        return 0, 0
+
+    start = np.searchsorted(coverage['time'], np.datetime64(pd.Timestamp(start_date), 'ns'), side='left')
+    end = max(start, np.searchsorted(coverage['time'], np.datetime64(pd.Timestamp(end_date), 'ns'), side='right'))  # Empty if end_date < start_date
+    n_samples = coverage['n_samples'][i, end] - coverage['n_samples'][i, start]
+    n_valid = coverage['n_valid'][i, end] - coverage['n_valid'][i, start]
+    return n_samples, n_valid